@@ -0,0 +1,55 @@
+# Time from -play to "Queued": a metadata-only search (what enqueue does now) against a full search with format resolution (what it did before).
+# Also times what a song that plays right away costs, ie a metadata search followed by a full one, against a single full search.
+#
+#   python benchmarks/enqueue_latency.py [queries...] [--runs 3]
+#
+# Needs access to youtube. Searches are cached by youtube and yt_dlp, so the order of the phases is alternated between runs
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from music_bot.client import QueuedSong
+
+QUERIES: list[str] = [
+    "never gonna give you up",
+    "https://www.youtube.com/watch?v=kJQP7kiw5Fk",
+    "bohemian rhapsody queen",
+    "lofi hip hop",
+    "https://www.youtube.com/watch?v=9bZkp7q19f0",
+]
+
+async def timed(query: str, with_player: bool) -> float:
+    start: float = time.perf_counter()
+    song: QueuedSong | Exception | None = await QueuedSong.create(query, with_player = with_player)
+    if not isinstance(song, QueuedSong): raise RuntimeError(f"Search for {query} failed: {song}")
+    return time.perf_counter() - start
+
+async def run(queries: list[str], runs: int) -> dict[str, list[float]]:
+    results: dict[str, list[float]] = {'metadata': [], 'full': []}
+    for i in range(runs):
+        for query in queries:
+            for with_player in ((False, True) if i % 2==0 else (True, False)):
+                results['full' if with_player else 'metadata'].append(await timed(query, with_player))
+    return results
+
+def summary(times: list[float]) -> str:
+    ordered: list[float] = sorted(times)
+    return f"median {statistics.median(ordered)*1000:7.0f}ms  p95 {ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]*1000:7.0f}ms  n={len(ordered)}"
+
+if __name__ == '__main__':
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(description = "Compare enqueue acknowledge latency of metadata-only and full searches")
+    parser.add_argument('queries', nargs = '*', default = QUERIES)
+    parser.add_argument('--runs', type = int, default = 3)
+    args: argparse.Namespace = parser.parse_args()
+
+    results: dict[str, list[float]] = asyncio.run(run(args.queries, args.runs))
+    print(f"Queued, before (full search):     {summary(results['full'])}")
+    print(f"Queued, after (metadata search):  {summary(results['metadata'])}")
+    # A song that plays right away needed both searches before it could play, now it only does the full one
+    both: list[float] = [m + f for m, f in zip(results['metadata'], results['full'])]
+    print(f"First audio, metadata then full:  {summary(both)}")
+    print(f"First audio, full only (idle):    {summary(results['full'])}")
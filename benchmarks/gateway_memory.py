@@ -0,0 +1,138 @@
+# Memory and CPU the gateway cache costs in a large server, with BOT_GATEWAY_MODE=full against BOT_GATEWAY_MODE=lean.
+#
+#   python benchmarks/gateway_memory.py [--members 100000] [--online 0.2] [--messages 5000] [--presence-updates 50000]
+#
+# Feeds discord.py's connection state the same kind of events discord sends, built locally instead of coming from a gateway:
+# a GUILD_CREATE for one large server, the member chunks that full mode asks for at startup, presence updates
+# (only sent with the presences intent), and messages. Each mode runs in its own process, and memory is measured with tracemalloc
+import argparse
+import asyncio
+import gc
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import Any
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import discord
+from discord.state import ConnectionState, ChunkRequest
+
+GUILD_ID: int = 462469935436922880
+TEXT_CHANNEL_ID: int = GUILD_ID + 1
+VOICE_CHANNEL_ID: int = GUILD_ID + 2
+# Discord only sends online members in GUILD_CREATE for servers over this size
+LARGE_THRESHOLD: int = 250
+CHUNK_SIZE: int = 1000
+
+def user(i: int) -> dict[str, Any]:
+    return {'id': str(10**17 + i), 'username': f"user{i}", 'global_name': f"User {i}", 'discriminator': '0', 'avatar': None}
+
+def member(i: int) -> dict[str, Any]:
+    return {'user': user(i), 'roles': [], 'joined_at': "2024-01-01T00:00:00+00:00", 'deaf': False, 'mute': False, 'nick': None, 'flags': 0}
+
+def presence(i: int, status: str = 'online') -> dict[str, Any]:
+    return {'user': {'id': str(10**17 + i)}, 'status': status, 'client_status': {'desktop': status},
+            'activities': [{'name': f"Game {i % 50}", 'type': 0, 'created_at': 0}]}
+
+def guild_create(members: int, online: int, voice: int) -> dict[str, Any]:
+    # Large servers only come with their online members, everyone else has to be requested in chunks
+    shown: list[int] = list(range(min(online, LARGE_THRESHOLD) if members > LARGE_THRESHOLD else members))
+    return {
+        'id': str(GUILD_ID), 'name': "Synthetic", 'owner_id': str(10**17), 'member_count': members, 'large': members > LARGE_THRESHOLD,
+        'features': [], 'emojis': [], 'stickers': [], 'unavailable': False,
+        'roles': [{'id': str(GUILD_ID), 'name': "@everyone", 'permissions': '0', 'position': 0, 'color': 0, 'hoist': False, 'managed': False, 'mentionable': False}],
+        'channels': [
+            {'id': str(TEXT_CHANNEL_ID), 'type': 0, 'name': "general", 'position': 0, 'permission_overwrites': []},
+            {'id': str(VOICE_CHANNEL_ID), 'type': 2, 'name': "music", 'position': 1, 'permission_overwrites': [], 'bitrate': 64000, 'user_limit': 0},
+        ],
+        'members': [member(i) for i in shown],
+        'presences': [presence(i) for i in shown],
+        'voice_states': [{'user_id': str(10**17 + i), 'channel_id': str(VOICE_CHANNEL_ID), 'session_id': f"s{i}", 'deaf': False, 'mute': False,
+                          'self_deaf': False, 'self_mute': False, 'self_video': False, 'suppress': False, 'member': member(i)} for i in range(voice)],
+    }
+
+def message(i: int, author: int) -> dict[str, Any]:
+    return {'id': str(10**18 + i), 'channel_id': str(TEXT_CHANNEL_ID), 'guild_id': str(GUILD_ID), 'author': user(author), 'member': member(author),
+            'content': f"-play song number {i}", 'timestamp': "2024-01-01T00:00:00+00:00", 'edited_timestamp': None, 'tts': False,
+            'mention_everyone': False, 'mentions': [], 'mention_roles': [], 'attachments': [], 'embeds': [], 'pinned': False, 'type': 0}
+
+def make_state(mode: str) -> ConnectionState:
+    # The same client options main.py uses for each mode
+    if mode=="lean":
+        intents: discord.Intents = discord.Intents.none()
+        intents.guilds = True
+        intents.guild_messages = True
+        intents.message_content = True
+        intents.voice_states = True
+        options: dict[str, Any] = {'intents': intents, 'chunk_guilds_at_startup': False, 'member_cache_flags': discord.MemberCacheFlags.from_intents(intents), 'max_messages': 100}
+    else:
+        options = {'intents': discord.Intents.all()}
+    state: ConnectionState = ConnectionState(dispatch = lambda *args, **kwargs: None, handlers = {}, hooks = {}, http = None, **options)
+    state._ready_state = None
+    return state
+
+def run(mode: str, args: argparse.Namespace) -> dict[str, float]:
+    online: int = int(args.members * args.online)
+    # Build every event up front, so only what the cache keeps gets measured
+    create: dict[str, Any] = guild_create(args.members, online, args.voice)
+    chunks: list[dict[str, Any]] = []
+    if mode=="full":
+        # What chunking at startup gets back for every member, with presences since the presences intent is on
+        for index, start in enumerate(range(0, args.members, CHUNK_SIZE)):
+            ids: range = range(start, min(start + CHUNK_SIZE, args.members))
+            chunks.append({'guild_id': str(GUILD_ID), 'chunk_index': index, 'chunk_count': (args.members + CHUNK_SIZE - 1) // CHUNK_SIZE,
+                           'members': [member(i) for i in ids], 'presences': [presence(i) for i in ids if i < online]})
+    # Presence updates are only sent to bots with the presences intent
+    updates: list[dict[str, Any]] = [{**presence(i % online, 'idle' if i % 2 else 'online'), 'guild_id': str(GUILD_ID)}
+                                     for i in range(args.presence_updates)] if mode=="full" and online > 0 else []
+    messages: list[dict[str, Any]] = [message(i, i % max(online, 1)) for i in range(args.messages)]
+
+    async def feed(state: ConnectionState) -> float:
+        start: float = time.process_time()
+        state.parse_guild_create(create)
+        if chunks:
+            # The request chunking at startup makes, which the chunks get matched to by nonce
+            request: ChunkRequest = ChunkRequest(GUILD_ID, 0, asyncio.get_running_loop(), state._get_guild, cache = True)
+            state._chunk_requests[request.nonce] = request
+            for chunk in chunks: state.parse_guild_members_chunk({**chunk, 'nonce': request.nonce})
+        for update in updates: state.parse_presence_update(update)
+        for data in messages: state.parse_message_create(data)
+        return time.process_time() - start
+
+    gc.collect()
+    tracemalloc.start()
+    before: int = tracemalloc.get_traced_memory()[0]
+    state: ConnectionState = make_state(mode)
+    cpu: float = asyncio.run(feed(state))
+    gc.collect()
+    kept: int = tracemalloc.get_traced_memory()[0] - before
+    guild: discord.Guild = state._get_guild(GUILD_ID)
+    return {'mode': mode, 'cached_mb': kept / 2**20, 'cpu_s': cpu, 'members': len(guild._members), 'messages': len(state._messages or []),
+            'events': 1 + len(chunks) + len(updates) + len(messages), 'voice_states': len(guild._voice_states)}
+
+if __name__ == '__main__':
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(description = "Compare gateway cache memory between the full and lean gateway modes")
+    parser.add_argument('--members', type = int, default = 100_000)
+    parser.add_argument('--online', type = float, default = 0.2, help = "Fraction of members that are online")
+    parser.add_argument('--voice', type = int, default = 20, help = "Members in voice channels")
+    parser.add_argument('--messages', type = int, default = 5_000)
+    parser.add_argument('--presence-updates', type = int, default = 50_000)
+    parser.add_argument('--mode', choices = ("full", "lean"), help = argparse.SUPPRESS)
+    args: argparse.Namespace = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(run(args.mode, args)))
+        sys.exit(0)
+
+    # Each mode in a fresh process, so neither one's leftovers count towards the other
+    results: list[dict[str, Any]] = []
+    for mode in ("full", "lean"):
+        out: str = subprocess.run([sys.executable, __file__, '--mode', mode] + sys.argv[1:], capture_output = True, text = True, check = True).stdout
+        results.append(json.loads(out.strip().splitlines()[-1]))
+    print(f"{args.members} members, {int(args.members * args.online)} online, {args.voice} in voice, {args.messages} messages, {args.presence_updates} presence updates (full only)")
+    for r in results:
+        print(f"{r['mode']:>5}: {r['cached_mb']:8.1f} MB cached, {r['cpu_s']:6.2f}s CPU over {r['events']} events, "
+              f"{r['members']} members, {r['voice_states']} voice states, {r['messages']} messages cached")
@@ -0,0 +1,83 @@
+# Memory a long queue costs: QueuedSong as it is now (__slots__, int seconds, video ids, stream urls in STREAM_URLS)
+# against the old layout, where every song was a plain object with the full url, duration string, thumbnail url and player in its __dict__.
+#
+#   python benchmarks/queue_memory.py [--songs 100000] [--players 50]
+#
+# Songs are built from freshly made strings shaped like the ones a youtube playlist page gives, the same way QueuedSong.get_playlist builds them.
+# Each layout runs in its own process, and memory is measured with tracemalloc
+import argparse
+import gc
+import json
+import os
+import random
+import string
+import subprocess
+import sys
+import tracemalloc
+from typing import Any
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from music_bot.client import QueuedSong, YT_WATCH_URL, YT_THUMBNAIL_URL
+from music_bot.streams import STREAM_URLS
+
+ID_CHARS: str = string.ascii_letters + string.digits + "-_"
+
+class OldQueuedSong:
+    """QueuedSong as it was before songs were made compact
+    """
+    def __init__(self, url: str | None, name: str, dur: str, thumbnail: str, player: str | None = None):
+        self.name: str = name
+        self.url: str | None = url
+        self.duration: str = dur
+        self.thumbnail: str = thumbnail
+        self.player: str | None = player
+        self.generating_player: bool = False
+
+def playlist_entry(rng: random.Random) -> tuple[str, str, str, str]:
+    vid: str = ''.join(rng.choices(ID_CHARS, k = 11))
+    title: str = f"Artist {rng.randrange(1000)} - Song title number {rng.randrange(10**6)} (Official Video)"
+    seconds: int = rng.randrange(60, 600)
+    thumbnail: str = f"{YT_THUMBNAIL_URL}{vid}/hqdefault.jpg?sqp=-oaymwEbCKgBEF5IVfKriqkDDggBFQAAiEIYAXABwAEG&rs={''.join(rng.choices(ID_CHARS, k = 32))}"
+    return f"{YT_WATCH_URL}{vid}", title, f"{seconds // 60}:{seconds % 60:02d}", thumbnail
+
+def stream_url(rng: random.Random) -> str:
+    # Video players are long signed googlevideo urls
+    return f"https://rr{rng.randrange(10)}---sn-abc.googlevideo.com/videoplayback?expire=1700000000&ei={''.join(rng.choices(ID_CHARS, k = 900))}"
+
+def run(layout: str, args: argparse.Namespace) -> dict[str, Any]:
+    rng: random.Random = random.Random(args.seed)
+    cls: type = QueuedSong if layout=="slots" else OldQueuedSong
+    gc.collect()
+    tracemalloc.start()
+    before: int = tracemalloc.get_traced_memory()[0]
+    queue: list[Any] = []
+    for i in range(args.songs):
+        queue.append(cls(*playlist_entry(rng)))
+        # Songs that were about to play got a video player
+        if i < args.players: queue[-1].player = stream_url(rng)
+    gc.collect()
+    kept: int = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return {'layout': layout, 'mb': kept / 2**20, 'per_song': kept / max(args.songs, 1),
+            'players': len(STREAM_URLS) if layout=="slots" else sum(1 for song in queue if song.player)}
+
+if __name__ == '__main__':
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(description = "Compare queue memory between the compact QueuedSong and the old per-song dict layout")
+    parser.add_argument('--songs', type = int, default = 100_000)
+    parser.add_argument('--players', type = int, default = 50, help = "Songs that have a video player")
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--layout', choices = ("slots", "dict"), help = argparse.SUPPRESS)
+    args: argparse.Namespace = parser.parse_args()
+
+    if args.layout:
+        print(json.dumps(run(args.layout, args)))
+        sys.exit(0)
+
+    # Each layout in a fresh process, so neither one's leftovers count towards the other
+    results: list[dict[str, Any]] = []
+    for layout in ("dict", "slots"):
+        out: str = subprocess.run([sys.executable, __file__, '--layout', layout] + sys.argv[1:], capture_output = True, text = True, check = True).stdout
+        results.append(json.loads(out.strip().splitlines()[-1]))
+    print(f"{args.songs} songs, {args.players} with a video player")
+    for r in results:
+        print(f"{r['layout']:>5}: {r['mb']:8.1f} MB, {r['per_song']:6.0f} B/song, {r['players']} video players kept")
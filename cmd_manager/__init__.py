@@ -1,10 +1,14 @@
 from .cmd_runner import CmdResult, CmdContext, CmdRunner
+from .rate_limit import RateLimit
+from .tracing import CmdTracer, CmdTrace
 from . import server_data
 
 def setup_runner(client: cmd_runner.Client, *, 
                  saved_servers_file: str | None = None, prefixes: list[str] = ["!","-","/",":","~",",",".","#","$","%","^","&","*","+","=","_",";"], 
                  on_success: cmd_runner.Callable[[CmdContext], cmd_runner.Any] | None = None, 
-                 on_fail: cmd_runner.Callable[[CmdContext], cmd_runner.Any] | None = None) -> CmdRunner:
+                 on_fail: cmd_runner.Callable[[CmdContext], cmd_runner.Any] | None = None,
+                 typing_delay: float | None = 1.0,
+                 lane_size: int = 16, lane_overflow: str = "reject") -> CmdRunner:
     """Sets up a command runner, which can be used to assign functions to specific "command" keywords sent in a discord text channel
     
     Args:
@@ -13,8 +17,11 @@ def setup_runner(client: cmd_runner.Client, *,
         prefixes (_type_, optional): Valid prefixes that a server may use to run commands. Defaults to ["!","-","/",":","~",",",".","#","$","%","^","&","*","+","=","_",";"].
         on_success (Callable[[CmdContext], Any] | None, optional): A function that gets called every time a command runs successfully. Defaults to None.
         on_fail (Callable[[CmdContext], Any] | None, optional): A function that gets called every time a command fails. Defaults to None.
+        typing_delay (float | None, optional): Seconds a command has to run for before the typing indicator is shown, or None to never show it. Defaults to 1.0.
+        lane_size (int, optional): Most commands that can be waiting to run in a single server. Defaults to 16.
+        lane_overflow (str, optional): "reject" to reject new commands while a server's lane is full, or "drop_oldest" to reject the longest waiting command. Defaults to "reject".
 
     Returns:
         CmdRunner: Command runner used to run commands. Make sure to call CmdRunner.on_message inside of a @client.event on_message() function!
     """
-    return CmdRunner(client, server_data.ServerData(prefixes, saved_servers_file), on_success, on_fail)
+    return CmdRunner(client, server_data.ServerData(prefixes, saved_servers_file), on_success, on_fail, typing_delay, lane_size, lane_overflow)
@@ -1,8 +1,18 @@
+import asyncio
+import time
 from typing import Any, Callable, Awaitable
 from .server_data import ServerData
+from .rate_limit import CommandLimits, RateLimit
+from .lanes import GuildLane
+from .tracing import CmdTracer, CmdTrace
 from discord import Message, Client, Guild
+from metrics import REGISTRY, Counter
 import traceback
 
+COMMANDS: Counter = REGISTRY.counter("cmd_runner_commands_total", "Commands run, by command and result", ("command", "result"))
+RATE_LIMITED: Counter = REGISTRY.counter("cmd_runner_rate_limited_total", "Commands rejected for going over a rate limit", ("command",))
+COALESCED: Counter = REGISTRY.counter("cmd_runner_coalesced_total", "Commands merged into an identical command that was already running", ("command",))
+
 type CmdResult = CmdResult
 
 # Rust has had an irreparable impact on my code
@@ -10,6 +20,8 @@ class CmdResult:
     def __init__(self, success: bool, result_value: Any):
         self.success: bool = success
         self.__val: Exception | str | Any = result_value
+        # Timings of the command that gave this result
+        self.trace: CmdTrace | None = None
     
     def ok(val: Any) -> CmdResult:
         return CmdResult(True, val)
@@ -17,6 +29,13 @@ class CmdResult:
     def err(err_msg: Exception | str | None = None) -> CmdResult:
         return CmdResult(False, err_msg)
     
+    def with_trace(self, trace: CmdTrace | None) -> CmdResult:
+        """Copy of this result with the given trace attached (results can be shared between merged commands, but traces can't)
+        """
+        res: CmdResult = CmdResult(self.success, self.__val)
+        res.trace = trace
+        return res
+    
     def is_ok(self) -> bool:
         return self.success
     
@@ -47,6 +66,16 @@ class CmdContext:
         self.message: Message = message
         self.guild: Guild = message.guild
         self.arg: str = arg
+        self.trace: CmdTrace | None = None
+        self._handoff: asyncio.Event | None = None
+        
+    def handoff(self):
+        """Let the next command in this server start running, while this command keeps running in the background. 
+        
+        Commands in a server run one at a time, in order. Call this once everything that depends on that order is done,
+        (ie the song has a spot reserved in the queue) before doing something slow. 
+        """
+        if self._handoff: self._handoff.set()
 
 class CmdRunner:
     """
@@ -54,19 +83,52 @@ class CmdRunner:
     """
     def __init__(self, client: Client, server_data: ServerData, 
                  on_success: Callable[[CmdContext], Awaitable[None]] | None = None, 
-                 on_fail: Callable[[CmdContext], Awaitable[None]] | None = None):
+                 on_fail: Callable[[CmdContext], Awaitable[None]] | None = None,
+                 typing_delay: float | None = 1.0,
+                 lane_size: int = 16, lane_overflow: str = "reject",
+                 tracer: CmdTracer | None = None):
         self.client: Client = client
         self.server_data: ServerData = server_data
         self.commands: dict[str, Callable[[CmdContext], Awaitable[Any]]] = {}
         self.on_success: Callable[[CmdContext], Awaitable[None]] = on_success
         self.on_fail: Callable[[CmdContext], Awaitable[None]] = on_fail
         
+        # Seconds a command has to run for before the typing indicator is shown (None to never show it)
+        self.typing_delay: float | None = typing_delay
+        self.commands_run: int = 0
+        self.typing_started: int = 0
+        
+        # Rate limits by command name, and commands currently being merged together
+        self.limits: dict[str, CommandLimits] = {}
+        self._coalescing: dict[tuple[int, Callable, str | None], asyncio.Task] = {}
+        self.rate_limited: int = 0
+        self.coalesced: int = 0
+        
+        # Commands in each server run one at a time
+        self.lane_size: int = lane_size
+        self.lane_overflow: str = lane_overflow
+        self.lanes: dict[int, GuildLane] = {}
+        
+        # Timings for every stage of running a command
+        self.tracer: CmdTracer = tracer if tracer else CmdTracer()
+        
+        REGISTRY.gauge("cmd_runner_lane_depth", "Commands waiting to run, across every server", fn = lambda: sum(lane.depth() for lane in self.lanes.values()))
+        REGISTRY.gauge("cmd_runner_typing_started", "Commands that ran long enough to show the typing indicator", fn = lambda: self.typing_started)
+        self.commands['stats'] = self._stats_command
+        
     async def _prefix_command(self, ctx: CmdContext) -> CmdResult:
-        if self.server_data[ctx.guild].set_prefix(ctx.arg):
+        if (await self.server_data.get(ctx.guild.id)).set_prefix(ctx.arg):
             await ctx.message.channel.send(f"Updated prefix to {ctx.arg}")
             return CmdResult.ok(None)
         else:
             return CmdResult.err("Invalid prefix")
+    
+    async def _stats_command(self, ctx: CmdContext) -> CmdResult:
+        typing: dict[str, float] = self.typing_stats()
+        await ctx.message.channel.send('```' + self.tracer.summary() 
+                                       + f"\n\nTyping requests saved per 1000 commands: {typing['saved_per_1000']:.0f}"
+                                       + f"\nRate limited: {self.rate_limited}, merged: {self.coalesced}" + '```')
+        return CmdResult.ok(None)
         
     def __setitem__(self, key: str | list[str], value: Callable[[CmdContext], Awaitable[Any]]):
         """
@@ -82,6 +144,110 @@ class CmdRunner:
                 self.commands[k] = value
         else: self.commands[key] = value        
     
+    def set_limits(self, key: str | list[str], *, user: RateLimit | None = None, guild: RateLimit | None = None, coalesce: float = 0):
+        """Limit how often a command can be used. All names given share the same limits. 
+
+        Args:
+            key (str | list[str]): The command name or list of names (ie aliases) to limit
+            user (RateLimit | None, optional): Limit for each user. Defaults to None.
+            guild (RateLimit | None, optional): Limit for each server. Defaults to None.
+            coalesce (float, optional): Seconds during which the same command with the same argument in the same server 
+            only runs once, with every use sharing that result. Defaults to 0.
+        """
+        limits: CommandLimits = CommandLimits(user, guild, coalesce)
+        for k in (key if type(key)==list else [key]):
+            self.limits[k] = limits
+    
+    async def _dispatch(self, cmd_func: Callable[[CmdContext], Awaitable[Any]], ctx: CmdContext, limits: CommandLimits | None) -> Any:
+        """Run a command, sharing the result with an identical command from the same server if one was started within the coalesce window
+        """
+        if limits==None or limits.coalesce <= 0:
+            return await self._run_in_lane(cmd_func, ctx)
+        
+        key: tuple[int, Callable, str | None] = (ctx.guild.id, cmd_func, ctx.arg)
+        task: asyncio.Task | None = self._coalescing.get(key)
+        if task:
+            self.coalesced += 1
+            COALESCED.labels(ctx.trace.cmd if ctx.trace else "unknown").inc()
+            return await asyncio.shield(task)
+        
+        task = asyncio.ensure_future(self._run_in_lane(cmd_func, ctx))
+        self._coalescing[key] = task
+        asyncio.get_running_loop().call_later(limits.coalesce, lambda: self._coalescing.pop(key, None) if self._coalescing.get(key) is task else None)
+        return await asyncio.shield(task)
+    
+    async def _run_in_lane(self, cmd_func: Callable[[CmdContext], Awaitable[Any]], ctx: CmdContext) -> Any:
+        """Run a command after every command sent before it in the same server has run (or handed off)
+        """
+        guild_id: int = ctx.guild.id
+        lane: GuildLane | None = self.lanes.get(guild_id)
+        if lane==None:
+            # Lanes are dropped once they run out of commands, so servers that went quiet don't keep one around
+            lane = self.lanes[guild_id] = GuildLane(self.lane_size, self.lane_overflow, on_idle = lambda: self._drop_lane(guild_id))
+        
+        submitted: float = time.perf_counter()
+        def run(handoff: asyncio.Event) -> Awaitable[Any]:
+            ctx._handoff = handoff
+            if ctx.trace: ctx.trace.record("lane_wait", time.perf_counter() - submitted)
+            return self._run_command(cmd_func, ctx)
+        
+        return await lane.submit(run, lambda: CmdResult.err("Too many commands at once, try again in a moment"))
+    
+    async def close(self):
+        """Save any server settings that haven't been written yet. Call this while shutting down
+        """
+        await self.server_data.flush()
+    
+    def _drop_lane(self, guild_id: int):
+        lane: GuildLane | None = self.lanes.get(guild_id)
+        if lane and lane.depth()==0: del self.lanes[guild_id]
+    
+    def lane_stats(self) -> dict[int, dict[str, float]]:
+        """Queue depth and wait time metrics for the command lane of every server that has commands running or waiting
+
+        Returns:
+            dict[int, dict[str, float]]: Lane metrics by server id
+        """
+        return {guild_id: lane.stats() for guild_id, lane in self.lanes.items()}
+    
+    async def _run_command(self, cmd_func: Callable[[CmdContext], Awaitable[Any]], ctx: CmdContext) -> Any:
+        """Run a command, only showing the typing indicator if the command takes longer than typing_delay. 
+        Most commands finish right away, so this saves sending a typing request for them. 
+        """
+        self.commands_run += 1
+        started: float = time.perf_counter()
+        try:
+            return await self._run_with_typing(cmd_func, ctx)
+        finally:
+            if ctx.trace: ctx.trace.record("run", time.perf_counter() - started)
+    
+    async def _run_with_typing(self, cmd_func: Callable[[CmdContext], Awaitable[Any]], ctx: CmdContext) -> Any:
+        if self.typing_delay==None: return await cmd_func(ctx)
+        
+        task: asyncio.Task = asyncio.ensure_future(cmd_func(ctx))
+        if self.typing_delay > 0:
+            try:
+                return await asyncio.wait_for(asyncio.shield(task), self.typing_delay)
+            except asyncio.TimeoutError:
+                pass
+        
+        self.typing_started += 1
+        async with ctx.message.channel.typing():
+            return await task
+    
+    def typing_stats(self) -> dict[str, float]:
+        """How many typing indicator requests were skipped because commands finished before typing_delay
+
+        Returns:
+            dict[str, float]: Number of commands run, typing indicators started, and requests saved per 1000 commands
+        """
+        saved: int = self.commands_run - self.typing_started
+        return {
+            'commands_run': self.commands_run,
+            'typing_started': self.typing_started,
+            'saved_per_1000': saved * 1000 / self.commands_run if self.commands_run > 0 else 0,
+        }
+    
     async def on_message(self, message: Message) -> None | CmdResult:
         """
         Run this whenever a message gets sent to try to run one of the defined commands
@@ -92,18 +258,24 @@ class CmdRunner:
         Args:
             message (discord.Message): The message that was just sent, possibly containing a command
 
+        Failed commands with an error message get it sent as a reply in the same channel.
+
         Returns:
             None | CommandResult: None if not a command, otherwise the result of running the command
         """
-        if message.author == self.client.user or message.author.bot:
+        # Reject anything that can't be a command before looking up any server settings
+        if not message.content or message.content[0] not in self.server_data.prefix_set:
             return None
-        if not message.guild or len(message.content)==0:
+        if message.author == self.client.user or message.author.bot:
             return None
-        if message.content==None or message.content[0]!=self.server_data[message.guild].prefix:
+        if not message.guild or message.content[0]!=await self.server_data.prefix_of(message.guild.id):
             return None
+        started: float = time.perf_counter()
         
         # Get the command and argument
         temp: list = message.content[1::].split(None, 1)
+        # A prefix followed by nothing but whitespace isn't a command
+        if len(temp)==0: return None
         cmd: str = temp[0]
         arg: str | None = temp[1] if len(temp) > 1 else None
         
@@ -111,26 +283,59 @@ class CmdRunner:
         cmd_func: Callable | None = self.commands.get(cmd)
         if cmd_func==None: return None
         
+        trace: CmdTrace = self.tracer.start(cmd, message.guild.id, started)
+        trace.record("lookup", time.perf_counter() - started)
+        
+        # Reject the command without running it if the user or server is using it too often
+        limits: CommandLimits | None = self.limits.get(cmd)
+        if limits and not (limits.coalesce > 0 and (message.guild.id, cmd_func, arg) in self._coalescing) and not limits.allow(message.author.id, message.guild.id):
+            self.rate_limited += 1
+            RATE_LIMITED.labels(cmd).inc()
+            with trace.span("callback"):
+                if self.on_fail: await self.on_fail(CmdContext(self.client, message, cmd))
+            trace.finish()
+            return CmdResult.err().with_trace(trace)
+        
+        cmd_ctx: CmdContext = CmdContext(self.client, message, arg)
+        cmd_ctx.trace = trace
         try:
             # Run the function and get the result
-            async with message.channel.typing():
-                res = await cmd_func(CmdContext(self.client, message, arg))
+            res = await self._dispatch(cmd_func, cmd_ctx, limits)
             
             # Context used for on_success and on_fail callbacks
             ctx: CmdContext = CmdContext(self.client, message, cmd)
             
-            # If the result is of type CmdResult, run on_success or on_fail callbacks, then return the result
-            if type(res)==CmdResult:
+            # If the result is not of type CmdResult, assume the command ran successfully and return CmdResult.ok()
+            if type(res)!=CmdResult: res = CmdResult.ok(res)
+            
+            # Run on_success or on_fail callbacks, then return the result
+            with trace.span("callback"):
                 if self.on_success and res.is_ok(): await self.on_success(ctx)
                 elif self.on_fail and res.is_err(): await self.on_fail(ctx)
-                return res
-            
-            # Otherwise, assume the command ran successfully and return CmdResult.ok()
-            if self.on_success: await self.on_success(ctx)
-            
-            return CmdResult.ok(res)
+            await CmdRunner._reply_error(message, res, trace)
+            trace.finish()
+            COMMANDS.labels(cmd, "ok" if res.is_ok() else "err").inc()
+            return res.with_trace(trace)
         
         # If there was an error while running the command, catch the error and return the exception
         except Exception as e:
-            if self.on_fail: await self.on_fail(CmdContext(self.client, message, cmd))
-            return CmdResult.err(e)
\ No newline at end of file
+            with trace.span("callback"):
+                if self.on_fail: await self.on_fail(CmdContext(self.client, message, cmd))
+            res = CmdResult.err(e)
+            await CmdRunner._reply_error(message, res, trace)
+            trace.finish()
+            COMMANDS.labels(cmd, "exception").inc()
+            return res.with_trace(trace)
+    
+    async def _reply_error(message: Message, res: CmdResult, trace: CmdTrace):
+        """Send a failed command's error message to the channel it was sent in. 
+        Runs before the trace is finished, so the reply counts towards the command's total time
+        """
+        # Formatting the error can mean formatting a whole traceback, so only do it once
+        err_msg: str | None = res.err_msg()
+        if not err_msg: return
+        with trace.span("error_reply"):
+            try:
+                await message.channel.send(err_msg)
+            except Exception as e:
+                print(f"Failed to send error message: {e}")
\ No newline at end of file
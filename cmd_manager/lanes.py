@@ -0,0 +1,108 @@
+import asyncio
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable
+
+type GuildLane = GuildLane
+
+class _LaneItem:
+    __slots__ = ('run', 'future', 'handoff', 'enqueued_at')
+
+    def __init__(self, run: Callable[[asyncio.Event], Awaitable[Any]]):
+        self.run: Callable[[asyncio.Event], Awaitable[Any]] = run
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.handoff: asyncio.Event = asyncio.Event()
+        self.enqueued_at: float = time.monotonic()
+
+class GuildLane:
+    """
+    Runs the commands of one server one at a time, in the order they were sent.
+
+    A command can hand off the lane (see CmdContext.handoff) once it has done everything that needs to stay in order,
+    so slow work like searching for a song doesn't hold up the commands behind it.
+    """
+    def __init__(self, maxsize: int = 16, overflow: str = "reject", on_idle: Callable[[], Any] | None = None):
+        """
+        Args:
+            maxsize (int, optional): Most commands that can wait in the lane. Defaults to 16.
+            overflow (str, optional): What happens to a command sent while the lane is full.
+            "reject" rejects the new command, "drop_oldest" rejects the command that has been waiting longest instead. Defaults to "reject".
+            on_idle (Callable[[], Any] | None, optional): Called once every command in the lane has run (or handed off), ie to drop the lane. Defaults to None.
+        """
+        if overflow not in ("reject", "drop_oldest"): raise ValueError(f"Unknown overflow policy: {overflow}")
+        self.maxsize: int = maxsize
+        self.overflow: str = overflow
+        self._items: deque[_LaneItem] = deque()
+        self._worker: asyncio.Task | None = None
+        self._on_idle: Callable[[], Any] | None = on_idle
+
+        self.submitted: int = 0
+        self.rejected: int = 0
+        self.max_depth: int = 0
+        self.total_wait: float = 0
+        self.max_wait: float = 0
+        self.started: int = 0
+
+    def submit(self, run: Callable[[asyncio.Event], Awaitable[Any]], on_overflow: Callable[[], Any]) -> asyncio.Future:
+        """Add a command to the end of the lane
+
+        Args:
+            run (Callable[[asyncio.Event], Awaitable[Any]]): Runs the command. Given the event that hands off the lane when set
+            on_overflow (Callable[[], Any]): Result given to a command that gets rejected because the lane is full
+
+        Returns:
+            asyncio.Future: Result of the command once it has run
+        """
+        item: _LaneItem = _LaneItem(run)
+        self.submitted += 1
+        if len(self._items) >= self.maxsize:
+            self.rejected += 1
+            if self.overflow=="reject":
+                item.future.set_result(on_overflow())
+                return item.future
+            dropped: _LaneItem = self._items.popleft()
+            dropped.future.set_result(on_overflow())
+
+        self._items.append(item)
+        self.max_depth = max(self.max_depth, len(self._items))
+        if self._worker==None or self._worker.done():
+            self._worker = asyncio.get_running_loop().create_task(self._work())
+        return item.future
+
+    async def _work(self):
+        while self._items:
+            item: _LaneItem = self._items.popleft()
+            if item.future.done(): continue
+
+            wait: float = time.monotonic() - item.enqueued_at
+            self.started += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+            task: asyncio.Task = asyncio.ensure_future(item.run(item.handoff))
+            task.add_done_callback(lambda t, f=item.future: GuildLane._resolve(f, t))
+            handoff: asyncio.Task = asyncio.ensure_future(item.handoff.wait())
+            await asyncio.wait((task, handoff), return_when=asyncio.FIRST_COMPLETED)
+            handoff.cancel()
+        if self._on_idle: self._on_idle()
+
+    def _resolve(future: asyncio.Future, task: asyncio.Task):
+        if future.done(): return
+        if task.cancelled(): future.cancel()
+        elif task.exception(): future.set_exception(task.exception())
+        else: future.set_result(task.result())
+
+    def depth(self) -> int:
+        return len(self._items)
+
+    def stats(self) -> dict[str, float]:
+        """Queue depth and wait time metrics for this lane
+        """
+        return {
+            'depth': len(self._items),
+            'max_depth': self.max_depth,
+            'submitted': self.submitted,
+            'rejected': self.rejected,
+            'avg_wait': self.total_wait / self.started if self.started > 0 else 0,
+            'max_wait': self.max_wait,
+        }
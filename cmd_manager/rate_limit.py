@@ -0,0 +1,80 @@
+import time
+from typing import Hashable
+
+class TokenBucket:
+    """
+    Token bucket that refills continuously, holding at most `capacity` tokens
+    """
+    __slots__ = ('capacity', 'rate', 'tokens', 'updated')
+
+    def __init__(self, capacity: float, rate: float):
+        self.capacity: float = capacity
+        self.rate: float = rate
+        self.tokens: float = capacity
+        self.updated: float = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, tokens: float = 1) -> bool:
+        """Take tokens from the bucket if there are enough
+
+        Returns:
+            bool: Whether the tokens were taken
+        """
+        self._refill(time.monotonic())
+        if self.tokens < tokens: return False
+        self.tokens -= tokens
+        return True
+
+    def time_until(self, tokens: float = 1) -> float:
+        """Seconds until the bucket will have enough tokens
+        """
+        self._refill(time.monotonic())
+        return max(0, (tokens - self.tokens) / self.rate)
+
+    def is_full(self) -> bool:
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity
+
+class RateLimit:
+    """
+    Allows `capacity` uses every `per` seconds, tracked separately for each key (ie each user or each server)
+    """
+    def __init__(self, capacity: int, per: float):
+        self.capacity: int = capacity
+        self.per: float = per
+        self._buckets: dict[Hashable, TokenBucket] = {}
+
+    def allow(self, key: Hashable) -> bool:
+        """Use up one token for the given key
+
+        Args:
+            key (Hashable): What is being limited, ie a user id
+
+        Returns:
+            bool: False if the key is over the limit
+        """
+        bucket: TokenBucket | None = self._buckets.get(key)
+        if bucket==None:
+            # Buckets that have fully refilled are the same as new buckets, so they can be dropped
+            if len(self._buckets) >= 1024:
+                self._buckets = {k: b for k, b in self._buckets.items() if not b.is_full()}
+            bucket = self._buckets[key] = TokenBucket(self.capacity, self.capacity / self.per)
+        return bucket.take()
+
+class CommandLimits:
+    """
+    Rate limits for one command, by user and by server,
+    and how long identical uses of the command in the same server get merged into a single run
+    """
+    def __init__(self, user: RateLimit | None = None, guild: RateLimit | None = None, coalesce: float = 0):
+        self.user: RateLimit | None = user
+        self.guild: RateLimit | None = guild
+        self.coalesce: float = coalesce
+
+    def allow(self, user_id: int, guild_id: int) -> bool:
+        if self.user and not self.user.allow(user_id): return False
+        if self.guild and not self.guild.allow(guild_id): return False
+        return True
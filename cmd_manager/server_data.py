@@ -1,6 +1,17 @@
-import pickle
+import asyncio
+import sqlite3
+import threading
 from typing import Callable
 from discord import Guild
+from executors import DATABASE
+
+DEFAULT_PREFIX = '-'
+
+# Seconds to wait after a change before writing it, so bursts of changes get written together
+FLUSH_DELAY = 2.0
+
+# Seconds to wait for another process that is writing to the database, ie another worker of a sharded bot
+BUSY_TIMEOUT = 30.0
 
 class ServerSettings:
     """
@@ -24,17 +35,43 @@ class ServerSettings:
 class ServerData:
     """
     Stores all the ServerSettings used by this bot
+
+    When given a file, settings are saved in an SQLite database. A server's settings are only read the first time the server is used,
+    and changes are written in batches a couple seconds after they're made, in a single transaction. 
+    Both happen on the database pool, so the event loop never waits on the database.
     """
-    def __init__(self, prefixes: list[str], load_file: str | None = None):
+    def __init__(self, prefixes: list[str], load_file: str | None = None, flush_delay: float = FLUSH_DELAY):
+        """
+        Args:
+            prefixes (list[str]): Prefixes a server can choose from
+            load_file (str | None, optional): SQLite database the settings are saved in, or None to not save them. Defaults to None.
+            flush_delay (float, optional): Seconds between a change and it being written. Defaults to FLUSH_DELAY.
+        """
         self.prefixes: list[str] = prefixes
+        # Used to quickly reject messages that don't start with any valid prefix
+        self.prefix_set: frozenset[str] = frozenset(prefixes)
         self.file_loc: str | None = load_file
+        self.flush_delay: float = flush_delay
         self.servers: dict[int, ServerSettings] = {}
-        if load_file != None: self.load_servers_from_file(load_file)
+        # Servers known to have no saved settings, so they aren't looked up again
+        self._unsaved: set[int] = set()
+        # server id -> prefix, for changes that haven't been written yet
+        self._dirty: dict[int, str] = {}
+        self._flush_handle: asyncio.TimerHandle | None = None
+        self._flushing: asyncio.Future | None = None
+        self._flush_task: asyncio.Task | None = None
+        # server id -> settings being read, so servers that send several messages at once are only read once
+        self._loading: dict[int, asyncio.Future] = {}
+        # Reads and writes both run on the database pool, which has more than one thread
+        self._conn: sqlite3.Connection | None = None
+        self._conn_lock: threading.Lock = threading.Lock()
+        if load_file != None: self._connect(load_file).close()
         
     def __getitem__(self, key: int | str | Guild) -> ServerSettings:
         """Get saved server info using the server's id (int or str), or by discord.Guild
 
-        If a server is not found, then will add the server using default settings before returning the result
+        If a server is not found, then will add the server using default settings before returning the result. 
+        Saved settings are only known once the server was loaded with get or prefix_of, which CmdRunner does before running any command
         
         Args:
             key (int | str | Guild): Identifier for which server information we want. 
@@ -45,33 +82,140 @@ class ServerData:
         server_id: int = key if type(key)==int else key.id if type(key) == Guild else int(key)
         return self.add_server(server_id)
     
-    def add_server(self, server_id: int, prefix: str = '-') -> ServerSettings:
+    async def prefix_of(self, server_id: int) -> str:
+        """Get the prefix used by a server, without adding the server if it doesn't have saved settings
+
+        Args:
+            server_id (int): Id of the server
+
+        Returns:
+            str: The server's prefix
+        """
+        settings: ServerSettings | None = self.servers.get(server_id)
+        if settings==None and not server_id in self._unsaved: settings = await self.load_server(server_id)
+        return settings.prefix if settings else DEFAULT_PREFIX
+
+    async def get(self, server_id: int) -> ServerSettings:
+        """Get a server's settings, loading them first if they haven't been yet, or adding the server if nothing was saved for it
+        """
+        settings: ServerSettings | None = self.servers.get(server_id)
+        if settings==None and not server_id in self._unsaved: settings = await self.load_server(server_id)
+        return settings if settings else self.add_server(server_id)
+
+    def add_server(self, server_id: int, prefix: str = DEFAULT_PREFIX) -> ServerSettings:
         settings: ServerSettings | None = self.servers.get(server_id)
         if settings: return settings
         
+        return self._add(server_id, prefix)
+
+    def _add(self, server_id: int, prefix: str) -> ServerSettings:
         settings = ServerSettings(server_id, prefix, self.prefixes)
-        if self.file_loc: settings._set_on_update(lambda: self.save_server_data(self.file_loc))
+        if self.file_loc: settings._set_on_update(lambda: self._mark_dirty(settings))
         self.servers[server_id] = settings
+        self._unsaved.discard(server_id)
         return settings
     
-    # 'server_data/data.pkl'
-    def load_servers_from_file(self, file: str) -> dict[int, ServerSettings]:
-        with open(file, 'rb') as f:
-            saved_prefix_data: dict[int, str] = pickle.load(f)
-            for server_id, prefix in saved_prefix_data.items():
-                if not prefix in self.prefixes:
-                    print(f"Error with server: {server_id}")
-                else:
-                    self.add_server(server_id, prefix)
-
-            print("Loaded server data")
+    def _connect(self, file: str, check_same_thread: bool = True) -> sqlite3.Connection:
+        conn = sqlite3.connect(file, timeout=BUSY_TIMEOUT, check_same_thread=check_same_thread)
+        # Readers don't wait on the writer, and a crash mid-write leaves the last committed settings intact
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS servers (
+                server_id INTEGER PRIMARY KEY,
+                prefix TEXT NOT NULL
+            )
+        ''')
+        conn.commit()
+        return conn
+
+    async def load_server(self, server_id: int) -> ServerSettings | None:
+        """Load a server's saved settings, if it has any
                     
-    def save_server_data(self, file: str | None):
-        if file==None:
+        Args:
+            server_id (int): Id of the server
+
+        Returns:
+            ServerSettings | None: The server's settings, or None if nothing was saved for the server
+        """
+        if self.file_loc==None:
+            self._unsaved.add(server_id)
+            return None
+        loading: asyncio.Future | None = self._loading.get(server_id)
+        if loading==None:
+            loading = self._loading[server_id] = DATABASE.submit(self._read, server_id)
+        try:
+            row: tuple[str] | None = await asyncio.shield(loading)
+        except Exception as e:
+            # Use the default prefix for now, and try reading again next time
+            print(f"Failed to load server data for {server_id}: {e}")
+            return None
+        finally:
+            if self._loading.get(server_id) is loading: del self._loading[server_id]
+        # Another message from the server may have loaded it first
+        if server_id in self.servers: return self.servers[server_id]
+        if row==None or not row[0] in self.prefixes:
+            if row: print(f"Error with server: {server_id}")
+            self._unsaved.add(server_id)
+            return None
+        return self._add(server_id, row[0])
+
+    def _mark_dirty(self, settings: ServerSettings):
+        self._dirty[settings.id] = settings.prefix
+        try:
+            loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Not running in an event loop, so there is nothing to block
+            self._write(self._take_dirty())
             return
-        prefix_data: dict[int, str]
-        for server_id, server_data in self.servers.items():
-            prefix_data[server_id] = server_data.prefix
-        with open(file, 'wb') as f:
-            pickle.dump(prefix_data, f, pickle.HIGHEST_PROTOCOL)
-            print("Saved server data")
\ No newline at end of file
+        if self._flush_handle==None: self._flush_handle = loop.call_later(self.flush_delay, self._start_flush)
+
+    def _start_flush(self):
+        self._flush_handle = None
+        self._flush_task = asyncio.get_running_loop().create_task(self.flush())
+
+    def _take_dirty(self) -> dict[int, str]:
+        dirty: dict[int, str] = self._dirty
+        self._dirty = {}
+        return dirty
+
+    async def flush(self):
+        """Write every change that hasn't been written yet, ie before shutting down
+        """
+        if self._flush_handle:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        # Batches are written one at a time, so an older batch can't overwrite a newer one
+        while self._flushing and not self._flushing.done():
+            await asyncio.wait({self._flushing})
+        if len(self._dirty)==0: return
+        batch: dict[int, str] = self._take_dirty()
+        flushing: asyncio.Future = DATABASE.submit(self._write, batch)
+        self._flushing = flushing
+        try:
+            await asyncio.shield(flushing)
+        except Exception as e:
+            # Try again with the next flush, unless the servers changed again since
+            for server_id, prefix in batch.items(): self._dirty.setdefault(server_id, prefix)
+            print(f"Failed to save server data: {e}")
+            if self._flush_handle==None: self._flush_handle = asyncio.get_running_loop().call_later(self.flush_delay, self._start_flush)
+        finally:
+            if self._flushing is flushing: self._flushing = None
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn==None: self._conn = self._connect(self.file_loc, check_same_thread=False)
+        return self._conn
+
+    def _read(self, server_id: int) -> tuple[str] | None:
+        with self._conn_lock:
+            return self._db().execute('SELECT prefix FROM servers WHERE server_id=?', (server_id,)).fetchone()
+
+    def _write(self, batch: dict[int, str]):
+        # Written in one transaction, so either the whole batch is saved or none of it is
+        with self._conn_lock:
+            conn: sqlite3.Connection = self._db()
+            with conn:
+                conn.executemany('''
+                    INSERT INTO servers (server_id, prefix) VALUES (?, ?)
+                    ON CONFLICT(server_id) DO UPDATE SET prefix=excluded.prefix
+                ''', batch.items())
+        print(f"Saved server data for {len(batch)} server(s)")
@@ -0,0 +1,116 @@
+import json
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Iterator
+from executors import MISC
+
+type CmdTrace = CmdTrace
+type CmdTracer = CmdTracer
+
+class CmdTrace:
+    """
+    Timings for each stage of running a single command
+    """
+    def __init__(self, tracer: CmdTracer, cmd: str, guild_id: int, started: float):
+        self.tracer: CmdTracer = tracer
+        self.cmd: str = cmd
+        self.guild_id: int = guild_id
+        self.started: float = started
+        self.spans: dict[str, float] = {}
+        self.finished: bool = False
+
+    def record(self, stage: str, seconds: float):
+        self.spans[stage] = self.spans.get(stage, 0) + seconds
+        self.tracer._add(self.cmd, stage, seconds)
+
+    @contextmanager
+    def span(self, stage: str) -> Iterator[None]:
+        """Time the code run inside this context as the given stage
+        """
+        start: float = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def finish(self):
+        """Record the total time taken by the command. Stages recorded after this only count towards the per-stage summaries.
+        """
+        if self.finished: return
+        self.finished = True
+        self.tracer._finish(self, time.perf_counter() - self.started)
+
+class CmdTracer:
+    """
+    Collects command timings, keeping a rolling window of the latest timings of each command and stage,
+    and logging commands that took longer than a threshold to a JSONL file
+    """
+    def __init__(self, slow_threshold: float = 3, slow_log_file: str | None = 'slow_commands.jsonl', window: int = 512):
+        """
+        Args:
+            slow_threshold (float, optional): Seconds a command can take before it gets logged as slow. Defaults to 3.
+            slow_log_file (str | None, optional): File slow commands are logged to, or None to not log them. Defaults to 'slow_commands.jsonl'.
+            window (int, optional): Number of latest timings kept for each command and stage. Defaults to 512.
+        """
+        self.slow_threshold: float = slow_threshold
+        self.slow_log_file: str | None = slow_log_file
+        self.window: int = window
+        # (command, stage) -> latest timings
+        self._timings: dict[tuple[str, str], deque[float]] = {}
+        self.slow_count: int = 0
+
+    def start(self, cmd: str, guild_id: int, started: float | None = None) -> CmdTrace:
+        return CmdTrace(self, cmd, guild_id, started if started!=None else time.perf_counter())
+
+    def _add(self, cmd: str, stage: str, seconds: float):
+        timings: deque[float] | None = self._timings.get((cmd, stage))
+        if timings==None: timings = self._timings[(cmd, stage)] = deque(maxlen=self.window)
+        timings.append(seconds)
+
+    def _finish(self, trace: CmdTrace, total: float):
+        self._add(trace.cmd, "total", total)
+        if total < self.slow_threshold or not self.slow_log_file: return
+        self.slow_count += 1
+        line: str = json.dumps({
+            'time': time.time(),
+            'cmd': trace.cmd,
+            'guild': trace.guild_id,
+            'total': round(total, 4),
+            'spans': {stage: round(seconds, 4) for stage, seconds in trace.spans.items()},
+        })
+        try:
+            MISC.submit(self._write_slow, line)
+        except RuntimeError:
+            self._write_slow(line)
+
+    def _write_slow(self, line: str):
+        with open(self.slow_log_file, 'a', encoding='utf-8') as f:
+            f.write(line + '\n')
+
+    def percentiles(self, cmd: str, stage: str = "total") -> tuple[int, float, float, float] | None:
+        """Percentiles over the latest timings of a command's stage
+
+        Returns:
+            tuple[int, float, float, float] | None: (number of timings, p50, p95, p99) in seconds, or None if there are no timings
+        """
+        timings: deque[float] | None = self._timings.get((cmd, stage))
+        if not timings: return None
+        ordered: list[float] = sorted(timings)
+        n: int = len(ordered)
+        return n, ordered[int(n * 0.5)], ordered[min(n-1, int(n * 0.95))], ordered[min(n-1, int(n * 0.99))]
+
+    def summary(self) -> str:
+        """Table of p50/p95/p99 latencies for every command, along with the stage that is slowest at p95
+
+        Returns:
+            str: The table, as plain text
+        """
+        cmds: list[str] = sorted({cmd for cmd, stage in self._timings if stage=="total"})
+        rows: list[str] = [f"{'command':<12}{'n':>6}{'p50':>9}{'p95':>9}{'p99':>9}  slowest stage (p95)"]
+        for cmd in cmds:
+            n, p50, p95, p99 = self.percentiles(cmd)
+            stages: list[tuple[float, str]] = [(self.percentiles(cmd, stage)[2], stage) for c, stage in self._timings if c==cmd and stage!="total"]
+            slowest: str = f"{max(stages)[1]} {max(stages)[0]*1000:.0f}ms" if stages else ""
+            rows.append(f"{cmd:<12}{n:>6}{p50*1000:>7.0f}ms{p95*1000:>7.0f}ms{p99*1000:>7.0f}ms  {slowest}")
+        return '\n'.join(rows)
@@ -0,0 +1,82 @@
+import asyncio
+import threading
+import time
+import concurrent.futures
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+from metrics import REGISTRY, Gauge, Histogram
+
+POOL_WAIT: Histogram = REGISTRY.histogram("executor_queue_wait_seconds", "Time jobs waited for a free worker, by pool", ("pool",))
+POOL_RUN: Histogram = REGISTRY.histogram("executor_run_seconds", "Time jobs took to run once started, by pool", ("pool",))
+POOL_ACTIVE: Gauge = REGISTRY.gauge("executor_active_workers", "Workers currently running a job, by pool", ("pool",))
+POOL_QUEUED: Gauge = REGISTRY.gauge("executor_queued_jobs", "Jobs waiting for a free worker, by pool", ("pool",))
+POOL_SATURATION: Gauge = REGISTRY.gauge("executor_saturation", "Fraction of workers busy, by pool", ("pool",))
+
+class Pool:
+    """
+    Named thread pool for one kind of blocking work, so slow work of one kind can't starve the others
+    """
+    def __init__(self, name: str, max_workers: int):
+        self.name: str = name
+        self.max_workers: int = max_workers
+        self.executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers, thread_name_prefix=f"{name}-pool")
+        self.active: int = 0
+        self.queued: int = 0
+        # Jobs start and end on worker threads
+        self._lock: threading.Lock = threading.Lock()
+
+        self._wait: Histogram = POOL_WAIT.labels(name)
+        self._run: Histogram = POOL_RUN.labels(name)
+        POOL_ACTIVE.labels(name).fn = lambda: self.active
+        POOL_QUEUED.labels(name).fn = lambda: self.queued
+        POOL_SATURATION.labels(name).fn = self.saturation
+
+    def saturation(self) -> float:
+        return self.active / self.max_workers
+
+    def submit(self, fn: Callable[..., Any], *args: Any) -> asyncio.Future:
+        """Run fn(*args) on this pool. Must be called from the event loop's thread.
+
+        Returns:
+            asyncio.Future: Result of the function
+        """
+        submitted: float = time.perf_counter()
+        with self._lock: self.queued += 1
+
+        def job() -> Any:
+            started: float = time.perf_counter()
+            with self._lock:
+                self.queued -= 1
+                self.active += 1
+            self._wait.observe(started - submitted)
+            try:
+                return fn(*args)
+            finally:
+                with self._lock: self.active -= 1
+                self._run.observe(time.perf_counter() - started)
+
+        # A job cancelled before a worker picked it up never runs, so it has to leave the queue here instead
+        future: concurrent.futures.Future = self.executor.submit(job)
+        future.add_done_callback(self._on_done)
+        return asyncio.wrap_future(future)
+
+    def _on_done(self, future: concurrent.futures.Future):
+        if future.cancelled():
+            with self._lock: self.queued -= 1
+
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """Run fn(*args) on this pool and wait for the result
+        """
+        return await self.submit(fn, *args)
+
+    def stats(self) -> dict[str, float]:
+        return {'max_workers': self.max_workers, 'active': self.active, 'queued': self.queued, 'saturation': self.saturation()}
+
+# yt_dlp extractions, which can take seconds each
+EXTRACTION: Pool = Pool("extraction", 4)
+# SQLite reads and writes. Kept small since SQLite only allows one writer at a time anyway
+DATABASE: Pool = Pool("database", 2)
+# Everything else (file writes, parsing uploaded files)
+MISC: Pool = Pool("misc", 2)
+
+POOLS: dict[str, Pool] = {pool.name: pool for pool in (EXTRACTION, DATABASE, MISC)}
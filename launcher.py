@@ -0,0 +1,206 @@
+# Runs the bot as several worker processes, each owning some of the gateway shards
+#
+#   python launcher.py --workers 4 --shards 16 [token]
+#
+# Every worker runs main.py with BOT_SHARD_IDS and BOT_SHARD_COUNT set, so it only connects the shards it was given
+# and only handles the servers on them. State shared between workers (server settings, song stats, playlists, queue snapshots)
+# lives in the SQLite files and snapshot directory in the working directory.
+#
+# `--fake` runs workers that don't connect to discord at all, which is enough to try out the supervisor on one machine.
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import time
+from typing import Callable, Protocol
+
+type Worker = Worker
+
+class Process(Protocol):
+    """The parts of subprocess.Popen the launcher uses, so tests can hand it fake processes
+    """
+    def poll(self) -> int | None: ...
+    def terminate(self) -> None: ...
+    def kill(self) -> None: ...
+    def wait(self, timeout: float | None = None) -> int: ...
+
+type Spawn = Callable[[Worker], Process]
+
+def shard_of(guild_id: int, shard_count: int) -> int:
+    """Shard that discord sends a server's events to
+    """
+    return (guild_id >> 22) % shard_count
+
+class Worker:
+    """
+    One worker process and the shards it owns. The process is replaced whenever it exits
+    """
+    def __init__(self, index: int, shard_ids: list[int], shard_count: int):
+        self.index: int = index
+        self.shard_ids: list[int] = shard_ids
+        self.shard_count: int = shard_count
+        self.process: Process | None = None
+        self.started: float = 0
+        self.restarts: int = 0
+        # time.monotonic() at which a worker that exited gets started again
+        self.restart_at: float | None = None
+        self.restart_delay: float = 0
+
+    def env(self) -> dict[str, str]:
+        """Environment variables telling the worker which shards it owns
+        """
+        return {'BOT_WORKER': str(self.index), 'BOT_SHARD_IDS': ','.join(map(str, self.shard_ids)), 'BOT_SHARD_COUNT': str(self.shard_count)}
+
+class Launcher:
+    """
+    Supervises the worker processes of a sharded bot.
+
+    Shards are split between the workers, each worker is started with its shards, and workers that exit get restarted.
+    Workers that keep crashing right after starting are restarted less and less often, up to `max_restart_delay` seconds apart.
+    """
+    def __init__(self, workers: int, shard_count: int | None = None, *, spawn: Spawn | None = None,
+                 restart_delay: float = 5, max_restart_delay: float = 300, stable_after: float = 60):
+        """
+        Args:
+            workers (int): Number of worker processes
+            shard_count (int | None, optional): Total number of shards, which must be at least the number of workers. Defaults to one per worker.
+            spawn (Spawn | None, optional): Starts a worker's process. Defaults to running main.py with the worker's environment.
+            restart_delay (float, optional): Seconds before restarting a worker that exited. Defaults to 5.
+            max_restart_delay (float, optional): Most seconds before restarting a worker that keeps crashing. Defaults to 300.
+            stable_after (float, optional): Seconds a worker has to stay up for its restart delay to go back to restart_delay. Defaults to 60.
+        """
+        shard_count = shard_count if shard_count else workers
+        if workers < 1 or shard_count < workers: raise ValueError("Need at least one worker, and at least as many shards as workers")
+        self.workers: list[Worker] = [Worker(i, shard_ids, shard_count) for i, shard_ids in enumerate(Launcher.plan(shard_count, workers))]
+        self.spawn: Spawn = spawn if spawn else Launcher.spawn_main()
+        self.restart_delay: float = restart_delay
+        self.max_restart_delay: float = max_restart_delay
+        self.stable_after: float = stable_after
+        self._stopping: bool = False
+
+    def plan(shard_count: int, workers: int) -> list[list[int]]:
+        """Split shards between workers as evenly as possible, giving each worker a contiguous range of shards
+
+        Returns:
+            list[list[int]]: Shard ids of each worker
+        """
+        return [list(range(shard_count * i // workers, shard_count * (i + 1) // workers)) for i in range(workers)]
+
+    def spawn_main(command: list[str] | None = None, metrics_port: int = 0) -> Spawn:
+        """Spawn function that runs a command with the worker's shards in its environment
+
+        Args:
+            command (list[str] | None, optional): Command to run for each worker. Defaults to running main.py with this python.
+            metrics_port (int, optional): Port of the first worker's metrics server, with each worker serving on the next one. 0 turns them off. Defaults to 0.
+        """
+        command = command if command else [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')]
+        def spawn(worker: Worker) -> Process:
+            env: dict[str, str] = os.environ | worker.env()
+            env['METRICS_PORT'] = str(metrics_port + worker.index if metrics_port > 0 else 0)
+            return subprocess.Popen(command, env = env)
+        return spawn
+
+    def owner(self, guild_id: int) -> Worker:
+        """Worker that handles a server
+        """
+        shard: int = shard_of(guild_id, self.workers[0].shard_count)
+        return next(worker for worker in self.workers if shard in worker.shard_ids)
+
+    def start(self):
+        for worker in self.workers: self._start(worker)
+
+    def _start(self, worker: Worker):
+        worker.restart_at = None
+        worker.started = time.monotonic()
+        try:
+            worker.process = self.spawn(worker)
+        except Exception as e:
+            print(f"Failed to start worker {worker.index}: {e}")
+            worker.process = None
+            self._schedule_restart(worker)
+            return
+        print(f"Started worker {worker.index} with shards {worker.shard_ids} of {worker.shard_count}")
+
+    def _schedule_restart(self, worker: Worker):
+        # Workers that crash soon after starting wait twice as long each time
+        if time.monotonic() - worker.started >= self.stable_after: worker.restart_delay = self.restart_delay
+        else: worker.restart_delay = min(max(worker.restart_delay * 2, self.restart_delay), self.max_restart_delay)
+        worker.restart_at = time.monotonic() + worker.restart_delay
+
+    def poll(self):
+        """Restart workers that exited. Called regularly by run
+        """
+        now: float = time.monotonic()
+        for worker in self.workers:
+            if worker.restart_at!=None:
+                if now >= worker.restart_at and not self._stopping:
+                    worker.restarts += 1
+                    self._start(worker)
+                continue
+            code: int | None = worker.process.poll() if worker.process else None
+            if code==None or self._stopping: continue
+            self._schedule_restart(worker)
+            print(f"Worker {worker.index} exited with code {code}, restarting in {worker.restart_delay:.0f}s")
+
+    def stop(self, timeout: float = 10):
+        """Stop every worker, killing the ones that haven't exited after timeout seconds
+        """
+        self._stopping = True
+        running: list[Worker] = [worker for worker in self.workers if worker.process and worker.process.poll()==None]
+        for worker in running: worker.process.terminate()
+        deadline: float = time.monotonic() + timeout
+        for worker in running:
+            try:
+                worker.process.wait(max(deadline - time.monotonic(), 0))
+            except subprocess.TimeoutExpired:
+                print(f"Worker {worker.index} didn't stop in time, killing it")
+                worker.process.kill()
+                worker.process.wait()
+
+    def run(self, interval: float = 1):
+        """Start the workers and keep them running until the launcher gets SIGINT or SIGTERM
+        """
+        def on_signal(signum: int, frame):
+            self._stopping = True
+        signal.signal(signal.SIGINT, on_signal)
+        signal.signal(signal.SIGTERM, on_signal)
+
+        self.start()
+        while not self._stopping:
+            time.sleep(interval)
+            self.poll()
+        print("Stopping workers")
+        self.stop()
+
+def fake_worker():
+    """Stand-in for main.py that only pretends to connect its shards, for trying out the launcher without discord.
+    Exits with an error after BOT_FAKE_LIFETIME seconds if it's set, to see crashed workers get restarted
+    """
+    index: str = os.getenv('BOT_WORKER')
+    print(f"[worker {index}] Connected shards {os.getenv('BOT_SHARD_IDS')} of {os.getenv('BOT_SHARD_COUNT')}")
+    lifetime: float = float(os.getenv('BOT_FAKE_LIFETIME', '0'))
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        time.sleep(lifetime if lifetime > 0 else 1e9)
+    except KeyboardInterrupt:
+        sys.exit(0)
+    print(f"[worker {index}] Lost the gateway connection")
+    sys.exit(1)
+
+if __name__ == '__main__':
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(description = "Run the bot as several worker processes, each owning some of the gateway shards")
+    parser.add_argument('token', nargs = '?', help = "Bot token. Defaults to the BOT_TOKEN environment variable")
+    parser.add_argument('--workers', type = int, default = os.cpu_count() or 1, help = "Number of worker processes. Defaults to the number of cores")
+    parser.add_argument('--shards', type = int, default = None, help = "Total number of shards. Defaults to one per worker")
+    parser.add_argument('--metrics-port', type = int, default = int(os.getenv('METRICS_PORT', '9108')), help = "Metrics port of the first worker, with each worker on the next port. 0 turns them off")
+    parser.add_argument('--fake', action = 'store_true', help = "Run workers that don't connect to discord, to try out the launcher")
+    parser.add_argument('--fake-worker', action = 'store_true', help = argparse.SUPPRESS)
+    args: argparse.Namespace = parser.parse_args()
+
+    if args.fake_worker:
+        fake_worker()
+
+    if args.token: os.environ['BOT_TOKEN'] = args.token
+    command: list[str] | None = [sys.executable, os.path.abspath(__file__), '--fake-worker'] if args.fake else None
+    Launcher(args.workers, args.shards, spawn = Launcher.spawn_main(command, args.metrics_port)).run()
@@ -0,0 +1,111 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from types import FrameType
+from metrics import REGISTRY, Counter, Gauge, Histogram
+
+LOOP_LAG: Histogram = REGISTRY.histogram("event_loop_lag_seconds", "How late the event loop ran a callback scheduled to run right away",
+                                         buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+LOOP_BLOCKED: Counter = REGISTRY.counter("event_loop_blocked_total", "Times a single callback blocked the event loop for longer than the threshold", ("command",))
+LOOP_LAG_MAX: Gauge = REGISTRY.gauge("event_loop_lag_max_seconds", "Worst event loop lag seen since the bot started")
+
+logger: logging.Logger = logging.getLogger("loop_monitor")
+
+class LoopMonitor:
+    """
+    Measures how late the event loop is in running its callbacks,
+    and captures the stack of whatever is blocking the loop when it gets stuck for longer than a threshold.
+
+    A task on the loop checks in every `interval` seconds, while a watchdog thread watches for check-ins that stop coming.
+    """
+    def __init__(self, interval: float = 0.25, threshold: float = 0.25):
+        """
+        Args:
+            interval (float, optional): Seconds between lag samples. Defaults to 0.25.
+            threshold (float, optional): Seconds the loop can be stuck on one callback before its stack is captured. Defaults to 0.25.
+        """
+        self.interval: float = interval
+        self.threshold: float = threshold
+        self._heartbeat: float = time.monotonic()
+        self._loop_thread: int | None = None
+        self._task: asyncio.Task | None = None
+        self._thread: threading.Thread | None = None
+        self._stopped: threading.Event = threading.Event()
+        # Heartbeat of the stall that was already captured, so each stall only gets captured once
+        self._captured: float = 0
+        self.max_lag: float = 0
+        # (time, command, stack) of the latest stalls
+        self.stalls: list[tuple[float, str, str]] = []
+
+    def start(self):
+        """Start monitoring the running event loop. Must be called from the loop's thread.
+        """
+        if self._task and not self._task.done(): return
+        self._loop_thread = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.get_running_loop().create_task(self._sample())
+        self._thread = threading.Thread(target=self._watch, name="loop-monitor", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._task: self._task.cancel()
+
+    async def _sample(self):
+        while True:
+            start: float = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now: float = time.monotonic()
+            self._heartbeat = now
+            lag: float = max(0, now - start - self.interval)
+            LOOP_LAG.observe(lag)
+            if lag > self.max_lag:
+                self.max_lag = lag
+                LOOP_LAG_MAX.set(lag)
+
+    def _watch(self):
+        while not self._stopped.wait(self.threshold / 2):
+            heartbeat: float = self._heartbeat
+            # The next check in is due `interval` seconds after the last one, so only the time past that counts as blocked
+            blocked: float = time.monotonic() - heartbeat - self.interval
+            if blocked < self.threshold or self._captured==heartbeat: continue
+            self._captured = heartbeat
+            # Anything going wrong here would otherwise end the thread, and with it the monitoring
+            try:
+                self._capture(blocked)
+            except Exception as e:
+                logger.exception("Failed to capture blocked event loop: %s", e)
+
+    def _capture(self, blocked: float):
+        frame: FrameType | None = sys._current_frames().get(self._loop_thread)
+        if frame==None: return
+        stack: list[FrameType] = []
+        while frame:
+            stack.append(frame)
+            frame = frame.f_back
+        command: str = LoopMonitor._find_command(stack)
+        text: str = ''.join(traceback.format_stack(stack[0]))
+
+        LOOP_BLOCKED.labels(command).inc()
+        self.stalls = self.stalls[-19:] + [(time.time(), command, text)]
+        logger.warning("Event loop blocked for at least %.0fms (command: %s)\n%s", blocked * 1000, command, text)
+
+    def _find_command(stack: list[FrameType]) -> str:
+        """Find the command being run by the blocking code, by looking for a CmdContext in the blocked stack
+        """
+        for frame in stack:
+            try:
+                ctx: object = frame.f_locals.get('ctx')
+            except Exception:
+                continue
+            message: object = getattr(ctx, 'message', None)
+            content: object = getattr(message, 'content', None)
+            if type(content)==str and len(content) > 0:
+                # A prefix followed by nothing but whitespace has no command name
+                parts: list[str] = content[1:].split(None, 1)
+                return parts[0] if len(parts) > 0 else content
+        return "none"
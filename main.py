@@ -9,21 +9,67 @@ Created on Sun Sep 19 17:22:34 2021
 @author: irawi
 """ 
 import discord
+import asyncio
+import io
 import os
 import sys
+from typing import Any
 
 from cmd_manager import setup_runner, CmdRunner, CmdContext, CmdResult
-from music_bot import MusicBot, MusicBotClient, QueuedSong
+from music_bot import MusicBot, MusicBotClient, QueuedSong, CooccurrenceIndex
 from misc_cmds import add_misc_cmds
 import song_logger
+import executors
+from metrics import REGISTRY
+from loop_monitor import LoopMonitor
+from presence import PresenceManager
 
 
-intents: discord.Intents = discord.Intents.all()
-client: discord.Client = discord.Client(intents=intents)
+# BOT_GATEWAY_MODE=lean only subscribes to the events the bot uses, and doesn't fetch or cache every server's member list.
+# Anything else subscribes to everything, which needs the bot's privileged intents turned on
+GATEWAY_MODE: str = os.getenv('BOT_GATEWAY_MODE', 'full')
 
-bot: CmdRunner = setup_runner(client, on_success = lambda ctx: ctx.message.add_reaction("👍"), on_fail = lambda ctx: ctx.message.add_reaction("👎"))
+def lean_intents() -> discord.Intents:
+    """Intents for commands, voice, and knowing which servers the bot is in. No presences or member lists
+    """
+    intents: discord.Intents = discord.Intents.none()
+    intents.guilds = True
+    intents.guild_messages = True
+    intents.message_content = True
+    intents.voice_states = True
+    return intents
+
+# Set by launcher.py when the bot runs as several worker processes: the shards this process connects, out of how many in total
+SHARD_IDS: list[int] | None = [int(shard) for shard in os.getenv('BOT_SHARD_IDS').split(',')] if os.getenv('BOT_SHARD_IDS') else None
+SHARD_COUNT: int | None = int(os.getenv('BOT_SHARD_COUNT')) if os.getenv('BOT_SHARD_COUNT') else None
+client_cls: type[discord.Client] = discord.AutoShardedClient if SHARD_IDS!=None else discord.Client
+sharding: dict[str, Any] = {'shard_ids': SHARD_IDS, 'shard_count': SHARD_COUNT} if SHARD_IDS!=None else {}
+
+if GATEWAY_MODE=="lean":
+    intents: discord.Intents = lean_intents()
+    client: discord.Client = client_cls(
+        **sharding,
+        intents = intents,
+        chunk_guilds_at_startup = False,
+        # Only members in voice channels are cached, which is all the voice channel checks need
+        member_cache_flags = discord.MemberCacheFlags.from_intents(intents),
+        # Nothing reads old messages back from the cache
+        max_messages = 100)
+else:
+    intents: discord.Intents = discord.Intents.all()
+    client: discord.Client = client_cls(intents=intents, **sharding)
+
+bot: CmdRunner = setup_runner(client, saved_servers_file = 'server_data.db', on_success = lambda ctx: ctx.message.add_reaction("👍"), on_fail = lambda ctx: ctx.message.add_reaction("👎"))
+
+# Autoplay picks songs based on which songs have followed each other before, saved in the song log
+autoplay_index: CooccurrenceIndex = CooccurrenceIndex(on_record = lambda prev_url, url, name: executors.DATABASE.submit(song_logger.incr_transition_counter, prev_url, url, name))
+autoplay_index.load(song_logger.get_transitions())
+
+music_bot: MusicBot = MusicBot(bot, autoplay_index = autoplay_index)
 
-music_bot: MusicBot = MusicBot(bot)
+# Servers whose currently playing song gets shown as the bot's status
+PRESENCE_GUILDS: set[int] = {462469935436922880}
+presence: PresenceManager = PresenceManager(client)
 
 # Link miscellaneous commands
 add_misc_cmds(bot)
@@ -41,59 +87,83 @@ def split_any(string: str, delims: list[str], start: int = 0) -> tuple[str, str]
 async def on_play(song: QueuedSong, music_client: MusicBotClient):
     await music_bot._default_on_play(song, music_client)
     
-    if type(music_client.msg_channel)==discord.TextChannel and music_client.guild.id==462469935436922880:
+    if type(music_client.msg_channel)==discord.TextChannel and music_client.guild.id in PRESENCE_GUILDS:
         song_details = split_any(song.name, [':', '-', '–', '—', '‒', '﹘', '|', '.', '(', '/', '\\', ';'], 3)
-        await client.change_presence(
-            activity = discord.Activity(
+        presence.set_playing(music_client.guild.id, 
+            discord.Activity(
                 type = discord.ActivityType.playing, 
                 name = song_details[0], 
                 state = song_details[1]
                 # emoji = discord.PartialEmoji(name = '🎶'),
                 # timestamps = {'start': int(time.time() * 1000)}
                 ),
-            status = discord.Status.online)
-        await music_client.loop.run_in_executor(None, song_logger.incr_music_counter, song.url, song.name)
+            discord.Status.online)
+        await executors.DATABASE.run(song_logger.incr_music_counter, song.url, song.name)
 
 # Reset the status of the bot once it stops playing music
 async def on_disconnect(music_client: MusicBotClient, reason: str | None):
     await music_bot._default_on_dc(music_client, reason)
     
-    if music_client.guild.id==462469935436922880:
-        await client.change_presence(status=discord.Status.idle)
+    if music_client.guild.id in PRESENCE_GUILDS:
+        presence.clear(music_client.guild.id)
+        presence.set_default(None, discord.Status.idle)
 
 music_bot.set_on_play(on_play)
 music_bot.set_on_disconnect(on_disconnect)
 
 # Added functionality for my (friends) server's music bot to save number of times a song is played
 async def send_music_counts(ctx: CmdContext):
-    data: list[tuple[str, int, str]] = await ctx.client.loop.run_in_executor(None, song_logger.get_music_counts, 20)
+    ctx.handoff()
+    data: list[tuple[str, int, str]] = await executors.DATABASE.run(song_logger.get_music_counts, 20)
     await ctx.message.channel.send('```'+'\n'.join([f"{name}: {count}" for _, name, count in data])+'```')
 bot["rewind"] = send_music_counts
 
+# Dump all metrics, for server admins only
+async def send_metrics(ctx: CmdContext) -> CmdResult:
+    if not ctx.message.author.guild_permissions.administrator:
+        return CmdResult.err("Only server admins can see metrics")
+    text: str = '\n'.join(line for line in REGISTRY.render().splitlines() if not line.startswith('#') and not '_bucket{' in line)
+    await ctx.message.channel.send(file=discord.File(io.BytesIO(text.encode()), filename="metrics.txt"))
+    return CmdResult.ok(None)
+bot["metrics"] = send_metrics
+
+metrics_server: asyncio.Server | None = None
+
+# Catches anything that blocks the event loop for long enough to risk missing gateway heartbeats
+loop_monitor: LoopMonitor = LoopMonitor()
+
 @client.event
 async def on_ready():
     # global prev_plant
-    print('We have logged in as {0.user}'.format(client))
-    await client.change_presence(activity=discord.Game("RIP groovy and rythmn :sob:"))
+    print('We have logged in as {0.user}'.format(client) + (f" with shards {SHARD_IDS} of {SHARD_COUNT}" if SHARD_IDS!=None else ""))
+    presence.set_default(discord.Game("RIP groovy and rythmn :sob:"))
+    presence.start()
+    loop_monitor.start()
+    
+    # Rejoin voice channels and restore queues from before the bot restarted
+    await music_bot.restore(client)
+    
+    # Serve metrics locally (set METRICS_PORT=0 to turn off)
+    global metrics_server
+    port: int = int(os.getenv('METRICS_PORT', '9108'))
+    if metrics_server==None and port > 0:
+        metrics_server = await REGISTRY.serve(port = port)
         
 @client.event
 async def on_message(message: discord.Message):
-    # Runner for Bot commands
+    # Runner for Bot commands. Failed commands already got their error message sent by the runner
     cmd_result: CmdResult | None = await bot.on_message(message)
-    
-    # Check the result and send an error message if the command failed
-    if cmd_result:
-        if cmd_result.is_err() and cmd_result.err_msg() and len(cmd_result.err_msg()) > 0:
-            await message.channel.send(cmd_result.err_msg())
-        return
+    if cmd_result: return
     
     # Ignore messages sent by bots (including ourselves)
     if message.author.bot: return
     
-    if client.user in message.mentions:
+    # Mentions are read straight from the message, so they work without the mentioned members being cached
+    if client.user.id in message.raw_mentions:
         await message.channel.send(f"<@{message.author.id}>")
-    elif len(message.mentions) > 0 and message.content.upper().endswith("WAKE UP"):
-        for _ in range(3): await message.channel.send(f"<@{message.mentions[0].id}> wake up")
+    elif len(message.raw_mentions) > 0 and message.content.upper().endswith("WAKE UP"):
+        # One message with three lines instead of three messages
+        await message.channel.send('\n'.join([f"<@{message.raw_mentions[0]}> wake up"] * 3))
         
 @client.event
 async def on_voice_state_update(member: discord.Member, before: discord.VoiceState, after: discord.VoiceState):
@@ -103,13 +173,25 @@ async def on_voice_state_update(member: discord.Member, before: discord.VoiceSta
             await music_bot[member.guild].disconnect(reason="Moved to afk channel")
     
     # Disconnect the bot if the vc it's in is empty
-    elif after.channel==None and before.channel!=None and len(before.channel.members)==1 and client.user in before.channel.members:
+    # Voice states are always cached, unlike members, so they're used to check who is left in the channel
+    elif after.channel==None and before.channel!=None and len(before.channel.voice_states)==1 and client.user.id in before.channel.voice_states:
         await music_bot[member.guild].disconnect(reason="Voice channel is empty")
 
+async def run(token: str):
+    try:
+        async with client:
+            await client.start(token)
+    finally:
+        # Save what hasn't been written yet and close what outlives the discord client, before the event loop goes away
+        await bot.close()
+        await music_bot.close()
+
+# Same log output as client.run
+discord.utils.setup_logging()
 # Log in with token passed from command line (for testing)
 if len(sys.argv) == 2:
-    client.run(sys.argv[1])
+    asyncio.run(run(sys.argv[1]))
 # Otherwise use environment variable
 else:
     # os.getenv('BOT_TOKEN')
-    client.run(os.getenv('BOT_TOKEN'))
+    asyncio.run(run(os.getenv('BOT_TOKEN')))
@@ -0,0 +1,210 @@
+import asyncio
+from bisect import bisect_left
+from typing import Callable
+
+type Metric = Counter | Gauge | Histogram
+type Counter = Counter
+type Gauge = Gauge
+type Histogram = Histogram
+type _Labeled = _Labeled
+
+# Default histogram buckets, in seconds
+DEFAULT_BUCKETS: tuple[float, ...] = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _fmt_labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    parts: list[str] = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra: parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _fmt_value(value: float) -> str:
+    return "+Inf" if value==float('inf') else repr(float(value)) if type(value)==float else str(value)
+
+class _Labeled:
+    """
+    Metric that may be split into children by label values
+    """
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name: str = name
+        self.help: str = help
+        self.label_names: tuple[str, ...] = labels
+        self._children: dict[tuple[str, ...], _Labeled] = {}
+
+    def labels(self, *values: str):
+        """Get the child of this metric for the given label values (in the same order as the label names)
+        """
+        child = self._children.get(values)
+        if child==None:
+            if len(values)!=len(self.label_names): raise ValueError(f"{self.name} takes labels {self.label_names}")
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _series(self) -> list[tuple[tuple[str, ...], _Labeled]]:
+        return list(self._children.items()) if self.label_names else [((), self)]
+
+class Counter(_Labeled):
+    """
+    Value that only goes up
+    """
+    kind: str = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        super().__init__(name, help, labels)
+        self.value: float = 0
+
+    def _new_child(self) -> Counter:
+        return Counter(self.name, self.help)
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def render(self) -> list[str]:
+        return [f"{self.name}{_fmt_labels(self.label_names, values)} {_fmt_value(child.value)}" for values, child in self._series()]
+
+class Gauge(_Labeled):
+    """
+    Value that can go up and down, or that gets read from a function whenever the metrics are collected
+    """
+    kind: str = "gauge"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = (), fn: Callable[[], float] | None = None):
+        super().__init__(name, help, labels)
+        self.value: float = 0
+        self.fn: Callable[[], float] | None = fn
+
+    def _new_child(self) -> Gauge:
+        return Gauge(self.name, self.help)
+
+    def set(self, value: float):
+        self.value = value
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.value -= amount
+
+    def get(self) -> float:
+        if self.fn==None: return self.value
+        try:
+            return self.fn()
+        except Exception:
+            return float('nan')
+
+    def render(self) -> list[str]:
+        return [f"{self.name}{_fmt_labels(self.label_names, values)} {_fmt_value(child.get())}" for values, child in self._series()]
+
+class Histogram(_Labeled):
+    """
+    Counts of observed values in fixed buckets, along with their sum
+    """
+    kind: str = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets: tuple[float, ...] = buckets
+        # The last count is for everything above the last bucket
+        self.counts: list[int] = [0] * (len(buckets) + 1)
+        self.count: int = 0
+        self.sum: float = 0
+
+    def _new_child(self) -> Histogram:
+        return Histogram(self.name, self.help, buckets=self.buckets)
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """Estimate a quantile, as the upper bound of the bucket it falls in
+        """
+        if self.count==0: return 0
+        target: float = q * self.count
+        seen: int = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= target: return self.buckets[i] if i < len(self.buckets) else float('inf')
+        return float('inf')
+
+    def render(self) -> list[str]:
+        lines: list[str] = []
+        for values, child in self._series():
+            cumulative: int = 0
+            for bound, c in zip((*child.buckets, float('inf')), child.counts):
+                cumulative += c
+                lines.append(f"{self.name}_bucket{_fmt_labels(self.label_names, values, f'le="{_fmt_value(bound)}"')} {cumulative}")
+            lines.append(f"{self.name}_sum{_fmt_labels(self.label_names, values)} {_fmt_value(child.sum)}")
+            lines.append(f"{self.name}_count{_fmt_labels(self.label_names, values)} {child.count}")
+        return lines
+
+class Registry:
+    """
+    Holds every metric in the process, and renders them in the Prometheus text format
+    """
+    def __init__(self):
+        self.metrics: dict[str, Metric] = {}
+
+    def _register(self, metric: Metric) -> Metric:
+        existing: Metric | None = self.metrics.get(metric.name)
+        if existing:
+            # Registering the same metric twice (ie one metric per MusicBot instance) keeps the first one
+            if type(existing)!=type(metric): raise ValueError(f"Metric {metric.name} already registered as a {existing.kind}")
+            if isinstance(metric, Gauge) and metric.fn: existing.fn = metric.fn
+            return existing
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: tuple[str, ...] = (), fn: Callable[[], float] | None = None) -> Gauge:
+        return self._register(Gauge(name, help, labels, fn))
+
+    def histogram(self, name: str, help: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, labels, buckets))
+
+    def render(self) -> str:
+        """Every metric in the Prometheus text exposition format
+        """
+        lines: list[str] = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 9108) -> asyncio.Server:
+        """Serve the metrics over HTTP, so they can be scraped locally
+
+        Args:
+            host (str, optional): Address to listen on. Defaults to "127.0.0.1".
+            port (int, optional): Port to listen on. Defaults to 9108.
+
+        Returns:
+            asyncio.Server: The running server
+        """
+        async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+            try:
+                request_line: bytes = await asyncio.wait_for(reader.readline(), 5)
+                # Skip the rest of the request headers
+                while (await asyncio.wait_for(reader.readline(), 5)) not in (b"\r\n", b"\n", b""): pass
+
+                parts: list[str] = request_line.decode('latin-1').split()
+                if len(parts) >= 2 and parts[0]=="GET" and parts[1].split('?')[0] in ("/", "/metrics"):
+                    status, body = "200 OK", self.render().encode()
+                else:
+                    status, body = "404 Not Found", b"Not Found\n"
+                writer.write(f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+                await writer.drain()
+            except (asyncio.TimeoutError, ConnectionError):
+                pass
+            finally:
+                writer.close()
+
+        return await asyncio.start_server(handle, host, port)
+
+# Process-wide registry that every module records its metrics to
+REGISTRY: Registry = Registry()
@@ -3,6 +3,7 @@ import discord
 from dataclasses import dataclass
 
 from cmd_manager import CmdContext, CmdResult
+from executors import MISC
 
 SECOND_MS = 1000
 MIN_MS = 60 * SECOND_MS
@@ -67,12 +68,15 @@ async def show_splits(ctx: CmdContext) -> CmdResult:
         Returns:
             CmdResult: Result of running the splits command
     """
+    # Doesn't touch anything other commands depend on
+    ctx.handoff()
     if len(ctx.message.attachments) == 0:
         await ctx.message.reply("Please attach a splits json file")
     attachment = ctx.message.attachments[0]
     file_bytes = await attachment.read()
     try:
-        run_dict = _parse_json(file_bytes)
+        # Uploaded files can be large, so parse them off the event loop
+        run_dict = await MISC.run(_parse_json, file_bytes)
         if run_dict['category'] != "ANY" or run_dict['version'] != '1.16.1':
             await ctx.message.channel.send("This tool is focused on 1.16.1 Any%, other versions / categories may produce unpredictable results")
         segments: list[Segment] = run_dict['segments']
@@ -127,4 +131,4 @@ def _format_time (ms: int) -> str:
         hour_str = f"{hours}:"
         min_str = min_str.rjust(3, "0")
 
-    return f"{hour_str}{min_str}{second_str}{centisecond_str}"
\ No newline at end of file
+    return f"{hour_str}{min_str}{second_str}{centisecond_str}"
\ No newline at end of file
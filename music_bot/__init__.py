@@ -1,2 +1,13 @@
 from .bot import MusicBot
-from .client import MusicBotClient, QueuedSong
\ No newline at end of file
+from .client import MusicBotClient, QueuedSong, DetachedSession
+from .autoplay import CooccurrenceIndex
+from .playlists import PlaylistStore
+from .snapshots import QueueSnapshots
+from .timers import TimerWheel, TIMERS
+from .play_trace import PlayTrace, PlayStats, PLAY_STATS
+from .fetch import HttpClient
+from .extractor import Extractor
+from .outbox import Outbox, Notice
+from .queue_view import QueuePages, QueueView
+from .streams import StreamUrls, STREAM_URLS
+from .duration_index import DurationIndex
@@ -0,0 +1,88 @@
+import random
+from typing import Any, Callable, Iterable
+
+class CooccurrenceIndex:
+    """
+    Song-to-song co-occurrence index built from play history.
+
+    Every time a song follows another song within the same voice session, the transition (previous url -> url) gets counted.
+    Autoplay then picks the most common follow-up of the last played song, without needing to search for anything.
+    """
+    def __init__(self, on_record: Callable[[str, str, str], Any] | None = None):
+        """
+        Args:
+            on_record (Callable[[str, str, str], Any] | None, optional): Function called with (previous url, url, name)
+            every time a new transition is recorded, ie to persist it. Defaults to None.
+        """
+        # prev url -> {next url: count}
+        self.counts: dict[str, dict[str, int]] = {}
+        # prev url -> list of next urls, used for O(1) random picks
+        self._successors: dict[str, list[str]] = {}
+        # prev url -> most common next url
+        self._best: dict[str, str] = {}
+        # url -> song name
+        self.names: dict[str, str] = {}
+        self._on_record: Callable[[str, str, str], Any] | None = on_record
+
+    def load(self, rows: Iterable[tuple[str, str, int, str]]):
+        """Load saved transitions into the index
+
+        Args:
+            rows (Iterable[tuple[str, str, int, str]]): (previous url, url, count, name) for every saved transition
+        """
+        for prev_url, url, count, name in rows:
+            self._add(prev_url, url, count, name)
+
+    def record(self, prev_url: str | None, url: str | None, name: str):
+        """Record that the song at url was played right after the song at prev_url. O(1)
+
+        Args:
+            prev_url (str | None): Url of the previously played song, None if this is the first song of the session
+            url (str | None): Url of the song that just started playing
+            name (str): Name of the song that just started playing
+        """
+        if prev_url==None or url==None or prev_url==url: return
+        self._add(prev_url, url, 1, name)
+        if self._on_record: self._on_record(prev_url, url, name)
+
+    def pick(self, url: str, exclude: set[str] | None = None) -> tuple[str, str] | None:
+        """Pick the song that should be played after the song at url. O(1)
+
+        Returns the most common follow-up, or a random known follow-up if the most common one is excluded
+
+        Args:
+            url (str): Url of the song that was last played
+            exclude (set[str] | None, optional): Urls that should not be picked, ie songs that were just played. Defaults to None.
+
+        Returns:
+            tuple[str, str] | None: (url, name) of the picked song, or None if no song could be picked
+        """
+        best: str | None = self._best.get(url)
+        if best==None: return None
+        if not exclude or best not in exclude:
+            return best, self.names.get(best, best)
+
+        # Try a few random follow-ups instead of scanning all of them
+        successors: list[str] = self._successors[url]
+        for _ in range(min(len(successors), 4)):
+            choice: str = successors[random.randrange(len(successors))]
+            if choice not in exclude: return choice, self.names.get(choice, choice)
+        return None
+
+    def _add(self, prev_url: str, url: str, count: int, name: str):
+        following: dict[str, int] | None = self.counts.get(prev_url)
+        if following==None:
+            following = self.counts[prev_url] = {}
+            self._successors[prev_url] = []
+        if url not in following:
+            following[url] = 0
+            self._successors[prev_url].append(url)
+        following[url] += count
+        if name: self.names[url] = name
+
+        best: str | None = self._best.get(prev_url)
+        if best==None or following[url] > following[best]:
+            self._best[prev_url] = url
+
+    def __len__(self) -> int:
+        return len(self.counts)
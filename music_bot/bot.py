@@ -1,8 +1,18 @@
 import discord
 import time
-from typing import Callable, Awaitable
-from cmd_manager import CmdRunner, CmdContext, CmdResult
-from .client import MusicBotClient, QueuedSong
+from typing import Callable, Awaitable, Any
+from cmd_manager import CmdRunner, CmdContext, CmdResult, RateLimit
+from .client import MusicBotClient, QueuedSong, DetachedSession, EXTRACTOR, METADATA_EXTRACTOR, MAX_QUEUE_SIZE, HTTP_CLIENT
+from .autoplay import CooccurrenceIndex
+from .playlists import PlaylistStore
+from .snapshots import QueueSnapshots
+from .play_trace import PlayTrace, PLAY_STATS
+from .timers import TIMERS
+from .streams import STREAM_URLS
+from .outbox import Outbox, Notice
+from .queue_view import QueuePages, QueueView
+from metrics import REGISTRY
+from executors import DATABASE, MISC
 
 import traceback
 
@@ -11,9 +21,36 @@ class MusicBot:
                  on_play: Callable[[QueuedSong, MusicBotClient], Awaitable[None]] | None = None,
                  on_queue: Callable[[QueuedSong, MusicBotClient], Awaitable[None]] | None = None,
                  on_dc: Callable[[MusicBotClient, str | None], Awaitable[None]] | None = None,
-                 show_queue: Callable[[CmdContext, list[QueuedSong], int], Awaitable[None]] | None = None):
+                 show_queue: Callable[[CmdContext, list[QueuedSong], int], Awaitable[None]] | None = None,
+                 autoplay_index: CooccurrenceIndex | None = None,
+                 playlist_store: PlaylistStore | None = None,
+                 snapshots: QueueSnapshots | None = None,
+                 resume_grace_period: float = 120,
+                 outbox_window: float = 1.0):
         self.clients: dict[int, MusicBotClient] = {}
         
+        # Queued and now playing messages sent within outbox_window seconds of each other get merged
+        self.outbox: Outbox = Outbox(outbox_window)
+        # guild id -> rendered pages of the guild's queue
+        self._queue_pages: dict[int, QueuePages] = {}
+        
+        # Shared between all clients, so every server's play history feeds autoplay
+        self.autoplay_index: CooccurrenceIndex = autoplay_index if autoplay_index else CooccurrenceIndex()
+        self.playlist_store: PlaylistStore = playlist_store if playlist_store else PlaylistStore()
+        self.snapshots: QueueSnapshots = snapshots if snapshots else QueueSnapshots()
+        self._restored: bool = False
+        
+        # Sessions of clients that lost their connection, which get resumed if the bot rejoins within the grace period
+        self.resume_grace_period: float = resume_grace_period
+        self._detached: dict[int, DetachedSession] = {}
+        
+        REGISTRY.gauge("music_bot_clients", "Voice clients currently connected", fn = lambda: len(self.clients))
+        REGISTRY.gauge("music_bot_queued_songs", "Songs in the queues of all connected clients", fn = lambda: sum(len(c.queue) for c in self.clients.values()))
+        REGISTRY.gauge("music_bot_ffmpeg_processes", "FFmpeg processes currently playing audio", fn = lambda: sum(1 for c in self.clients.values() if c.is_playing() or c.is_paused()))
+        REGISTRY.gauge("music_bot_detached_sessions", "Sessions kept around to resume after a lost connection", fn = lambda: len(self._detached))
+        REGISTRY.gauge("music_bot_pending_timers", "Timers armed in the shared timer wheel", fn = lambda: len(TIMERS))
+        REGISTRY.gauge("music_bot_stream_urls", "Stream urls kept for songs that are about to play", fn = lambda: len(STREAM_URLS))
+        
         self._on_play: Callable[[QueuedSong, MusicBotClient], Awaitable[None]] = on_play if on_play else self._default_on_play
         self._on_queue: Callable[[QueuedSong, MusicBotClient], Awaitable[None]] = on_queue if on_queue else self._default_on_queue
         self._custom_on_dc: Callable[[MusicBotClient, str | None], Awaitable[None]] = on_dc if on_dc else self._default_on_dc
@@ -45,26 +82,8 @@ class MusicBot:
             
             # Connect the client if one does not exist for this server
             if client==None:
-                client: MusicBotClient = await vc.connect(timeout=60.0, self_deaf=True, cls=MusicBotClient)
-                
-                # Should remove client from clients list when the bot disconnects
-                client.set_on_disconnect(self._on_dc)
-                
-                # Should print song when it gets queued
-                client.set_on_play(self._on_play)
-                
                 # Bot should send updates regarding what song is playing to the channel it was summoned from
-                # This command is used to set that up
-                client.set_msg_channel(ctx.message.channel)
-                
-                # Print errors and send them to the discord channel as well
-                async def log_err(client: MusicBotClient, e: Exception):
-                    print('```'+''.join(traceback.extract_tb(e.__traceback__).format())+'```')
-                    await client.msg_channel.send('```'+''.join(traceback.extract_tb(e.__traceback__).format())+'```')
-                    
-                client.set_on_err(log_err)
-                
-                self.clients[ctx.guild.id] = client
+                client = await self._connect(vc, ctx.message.channel)
             # If a voice client for this server already exists, then -move should be explicitly called to move voice channels
             else: 
                 if client.channel==vc:
@@ -75,6 +94,89 @@ class MusicBot:
         else:
             return CmdResult.err("You must be in a voice channel!")
     
+    async def _connect(self, vc: discord.VoiceChannel, msg_channel: discord.abc.Messageable) -> MusicBotClient:
+        """Connect to a voice channel and set up the new MusicBotClient
+
+        Args:
+            vc (discord.VoiceChannel): Voice channel to connect to
+            msg_channel (discord.abc.Messageable): Channel the client sends play and queue updates to
+
+        Returns:
+            MusicBotClient: The connected client
+        """
+        client: MusicBotClient = await vc.connect(timeout=60.0, self_deaf=True, cls=MusicBotClient)
+        
+        # Should remove client from clients list when the bot disconnects
+        client.set_on_disconnect(self._on_dc)
+        
+        # Should print song when it gets queued
+        client.set_on_play(self._on_play)
+        
+        client.set_msg_channel(msg_channel)
+        
+        # Print errors and send them to the discord channel as well
+        async def log_err(client: MusicBotClient, e: Exception):
+            print('```'+''.join(traceback.extract_tb(e.__traceback__).format())+'```')
+            await client.msg_channel.send('```'+''.join(traceback.extract_tb(e.__traceback__).format())+'```')
+            
+        client.set_on_err(log_err)
+        
+        client.set_autoplay_index(self.autoplay_index)
+        
+        self.clients[vc.guild.id] = client
+        
+        # Pick up where we left off if the last connection in this server was lost recently
+        session: DetachedSession | None = self._detached.pop(vc.guild.id, None)
+        if session and not session.expired(self.resume_grace_period) and len(session.queue) > 0:
+            client.resume(session)
+        return client
+    
+    async def restore(self, discord_client: discord.Client):
+        """Rejoin the voice channels the bot was in before it restarted, and restore their queues from the saved snapshots.
+        Only does anything the first time it is called, so it is safe to call from on_ready. 
+        
+        Also starts saving snapshots of the queues from then on.
+
+        Args:
+            discord_client (discord.Client): The bot's discord client, once it is ready
+        """
+        if self._restored: return
+        self._restored = True
+        
+        states: list[dict[str, Any]] = await MISC.run(self.snapshots.load_all)
+        for state in states:
+            # Snapshots of servers on another worker's shards are left for that worker
+            if not MusicBot.owns_guild(discord_client, state['guild']): continue
+            vc: discord.abc.GuildChannel | None = discord_client.get_channel(state['channel'])
+            if vc==None or not isinstance(vc, discord.VoiceChannel) or vc.guild.id in self.clients or len(state['queue'])==0:
+                await self.snapshots.discard(state['guild'])
+                continue
+            
+            msg_channel: discord.abc.GuildChannel | None = discord_client.get_channel(state['msg_channel']) if state['msg_channel'] else None
+            try:
+                client: MusicBotClient = await self._connect(vc, msg_channel if msg_channel else vc)
+            except Exception as e:
+                print(f"Could not rejoin {vc}: {e}")
+                continue
+            
+            # Songs get their video players once they are about to play, so nothing gets searched for here
+            client.load_state(state)
+            if state['active']: client.play_next()
+        
+        self.snapshots.start(self.clients)
+    
+    async def close(self):
+        """Close the connections shared by every client. Call this while shutting down, before the event loop closes
+        """
+        await HTTP_CLIENT.close()
+    
+    def owns_guild(discord_client: discord.Client, guild_id: int) -> bool:
+        """Whether a server's events go to this process, ie when the bot runs as several processes that each connect some of its shards
+        """
+        shard_ids: list[int] | None = getattr(discord_client, 'shard_ids', None)
+        if shard_ids==None or not discord_client.shard_count: return True
+        return (guild_id >> 22) % discord_client.shard_count in shard_ids
+    
     async def disconnect(self, ctx: CmdContext) -> CmdResult:
         """Disconnect the bot from its voice channel
 
@@ -126,6 +228,9 @@ class MusicBot:
         Returns:
             CmdResult: Result of running the play command
         """
+        # Time every stage between this command and hearing the song
+        trace: PlayTrace = PlayTrace()
+        
         # Get the bot's voice client instance for this server
         client: MusicBotClient | None = self.clients.get(ctx.guild.id)
         
@@ -134,13 +239,18 @@ class MusicBot:
             join_result: CmdResult = await self.join(ctx)
             if join_result.is_err(): return join_result
             else: client = join_result.unwrap()
+        trace.mark("join")
         
         # Updates the channel that the bot should send messages to
         client.set_msg_channel(ctx.message.channel)
         
         # Add the song to the queue
-        song: QueuedSong | Exception | None = await client.enqueue(ctx.arg)
+        # enqueue reserves the song's spot in the queue before searching, so other commands can run during the search
+        ctx.handoff()
+        song: QueuedSong | Exception | None = await client.enqueue(ctx.arg, trace = trace)
         if song and type(song)==QueuedSong:
+            # Only songs that start playing right away say anything about how long it takes to hear a song
+            if client.is_active(): song.trace = None
             await self._on_queue(song, client)
             if not client.is_active():
                 client.play_next()
@@ -213,6 +323,114 @@ class MusicBot:
         
         return CmdResult.ok(None)
     
+    async def autoplay(self, ctx: CmdContext) -> CmdResult:
+        """Toggles autoplay for the bot, which keeps playing songs picked from play history once the queue runs out
+
+        Args:
+            ctx (CmdContext): Context given to the autoplay command
+
+        Returns:
+            CmdResult: Result of running the command
+        """
+        # Get the bot's voice client instance for this server
+        client: MusicBotClient | None = self.clients.get(ctx.guild.id)
+
+        if client==None: return CmdResult.err("Bot is not connected to a voice channel!")
+        
+        if client.toggle_autoplay():
+            await ctx.message.channel.send("Autoplay enabled")
+            # Start playing right away if the queue already ran out
+            if not client.is_active(): client.play_next()
+        else:
+            await ctx.message.channel.send("Autoplay disabled")
+        
+        return CmdResult.ok(None)
+    
+    async def play_stats(self, ctx: CmdContext) -> CmdResult:
+        """Shows how long each stage between sending -play and hearing the song takes
+
+        Args:
+            ctx (CmdContext): Context given to this command
+
+        Returns:
+            CmdResult: Result of running the command
+        """
+        lines: list[str] = []
+        for extractor in (METADATA_EXTRACTOR, EXTRACTOR):
+            stats: dict[str, float] = extractor.stats()
+            lines.append(f"{extractor.name}: hedged {stats['hedged']} of {stats['requests']} extractions ({stats['hedges_won']} won), hedging after {stats['hedge_delay']:.1f}s")
+        # Both extractors share a breaker
+        stats: dict[str, float] = EXTRACTOR.stats()
+        lines.append(f"Extraction breaker {stats['breaker']}" + (f", retrying in {stats['retry_in']:.0f}s" if stats['retry_in'] else ""))
+        await ctx.message.channel.send('```' + PLAY_STATS.summary() + '\n\n' + '\n'.join(lines) + '```')
+        return CmdResult.ok(None)
+    
+    async def save(self, ctx: CmdContext) -> CmdResult:
+        """Saves the current queue as a playlist for this server
+
+        Args:
+            ctx (CmdContext): Context given to this command
+
+        Returns:
+            CmdResult: Result of running the save command
+        """
+        if not ctx.arg: return CmdResult.err("Must provide a name to save the playlist as!")
+        
+        # Get the bot's voice client instance for this server
+        client: MusicBotClient | None = self.clients.get(ctx.guild.id)
+        
+        if client==None: return CmdResult.err("Bot is not connected to a voice channel!")
+        if len(client.queue)==0: return CmdResult.err("Queue is empty!")
+        
+        songs: list[QueuedSong] = list(client.queue)
+        ctx.handoff()
+        await DATABASE.run(self.playlist_store.save, ctx.guild.id, ctx.arg, songs)
+        await ctx.message.channel.send(f"Saved {len(songs)} songs as `{ctx.arg}`")
+        return CmdResult.ok(None)
+    
+    async def load(self, ctx: CmdContext) -> CmdResult:
+        """Adds a saved playlist to the queue. Lists the saved playlists if no name is given.
+
+        Args:
+            ctx (CmdContext): Context given to this command
+
+        Returns:
+            CmdResult: Result of running the load command
+        """
+        if not ctx.arg:
+            ctx.handoff()
+            names: list[str] = await DATABASE.run(self.playlist_store.names, ctx.guild.id)
+            await ctx.message.channel.send(("Saved playlists:\n" + '\n'.join([f"`{name}`" for name in names])) if names else "No saved playlists!")
+            return CmdResult.ok(None)
+        
+        songs: list[QueuedSong] | None = await DATABASE.run(self.playlist_store.load, ctx.guild.id, ctx.arg)
+        if not songs: return CmdResult.err(f"No playlist named `{ctx.arg}`")
+        
+        # Get the bot's voice client instance for this server
+        client: MusicBotClient | None = self.clients.get(ctx.guild.id)
+        
+        # If the client is not connected to a vc, join the vc
+        if client==None:
+            join_result: CmdResult = await self.join(ctx)
+            if join_result.is_err(): return join_result
+            else: client = join_result.unwrap()
+        
+        client.set_msg_channel(ctx.message.channel)
+        
+        # A queue only holds so many songs, so the rest of a long playlist would just push the first ones back out
+        skipped: int = max(len(songs) - MAX_QUEUE_SIZE, 0)
+        songs = songs[:MAX_QUEUE_SIZE]
+        
+        # The saved songs already have all their info, so queueing them doesn't need to search for anything
+        song: QueuedSong | Exception | None = await client.enqueue((ctx.arg, songs))
+        if song and type(song)==QueuedSong:
+            await self._on_queue(song, client)
+            if skipped > 0: await ctx.message.channel.send(f"Only loaded the first {MAX_QUEUE_SIZE} songs of `{ctx.arg}`, {skipped} songs didn't fit in the queue")
+            if not client.is_active():
+                client.play_next()
+            return CmdResult.ok(None)
+        return CmdResult.err(f"Could not load playlist\n`{song}`" if song else None)
+    
     async def remove(self, ctx: CmdContext) -> CmdResult:
         """Removes a song from the queue
 
@@ -271,6 +489,16 @@ class MusicBot:
         bot[['remove', 'rm']] = self.remove
         bot['loop'] = self.loop
         bot['clear'] = self.clear
+        bot[['autoplay', 'radio']] = self.autoplay
+        bot['playstats'] = self.play_stats
+        bot['save'] = self.save
+        bot['load'] = self.load
+        
+        # Searching for songs is slow, so limit how often it can happen
+        # Repeated skips or plays of the same song in a server only run once
+        bot.set_limits(['play', 'p'], user = RateLimit(3, 10), guild = RateLimit(8, 10), coalesce = 3)
+        bot.set_limits(['load'], user = RateLimit(2, 30), coalesce = 3)
+        bot.set_limits(['skip'], coalesce = 1)
     
     def set_on_play(self, on_play: Callable[[QueuedSong, MusicBotClient], Awaitable[None]]):
         self._on_play: Callable[[QueuedSong, MusicBotClient]] = on_play
@@ -292,35 +520,52 @@ class MusicBot:
     ##### Private functions #####
     
     # Callbacks
+    # Status updates go through the outbox, which merges bursts of them into a single message
     async def _default_on_play(self, song: QueuedSong, client: MusicBotClient):
-        await client.msg_channel.send(embed=discord.Embed(title = "Now Playing", description = f"{song.name} [{song.duration}]\n<t:{int(time.time())}:R>", url=song.url)
-                                      .set_thumbnail(url = song.thumbnail))
+        self.outbox.post(client.msg_channel, Notice(Notice.NOW_PLAYING, "Now Playing", f"{song.name} [{song.duration}]\n<t:{int(time.time())}:R>", song.url, song.thumbnail))
         
     async def _default_on_queue(self, song: QueuedSong, client: MusicBotClient):
         if client.is_active():
-            await client.msg_channel.send(embed=discord.Embed(title = "Queued", description = f"{song.name} [{song.duration}]", url=song.url)
-                                          .set_thumbnail(url = song.thumbnail))
+            line: str = f"{song.name} [{song.duration}]"
+            eta: tuple[float, bool] | None = client.eta(client.index_of(song))
+            if eta: line += f"\nPlays <t:{int(time.time() + eta[0])}:R>" + ("" if eta[1] else " or later")
+            self.outbox.post(client.msg_channel, Notice(Notice.QUEUED, "Queued", line, song.url, song.thumbnail))
     
     async def _on_dc(self, client: MusicBotClient, reason: str | None = None):
         # This must run when the bot disconnects
         temp: MusicBotClient = self.clients.get(client.guild.id)
         if temp: self.clients.pop(client.guild.id)
+        self._queue_pages.pop(client.guild.id, None)
+        
+        # Disconnects without a reason weren't asked for (lost connection, bot shutting down), so keep the snapshot to restore later
+        # and keep the session around in case the bot gets reconnected soon
+        if reason!=None: 
+            await self.snapshots.discard(client.guild.id)
+        else:
+            self._detached = {guild_id: session for guild_id, session in self._detached.items() if not session.expired(self.resume_grace_period)}
+            self._detached[client.guild.id] = client.detach()
         
         # User may define a custom function that runs when the bot disconnects from a voice channel. 
         # For example: a disconnect message. 
         await self._custom_on_dc(client, reason)
         
     async def _default_on_dc(self, client: MusicBotClient, reason: str | None = None):
+        await self.outbox.flush(client.msg_channel)
         await client.msg_channel.send(embed=discord.Embed(title="Disconnected", description=reason))
         
     async def _default_show_queue(self, ctx: CmdContext, queue: list[QueuedSong], curr_idx: int):
-        if len(queue) > 0:
-            for page in range((len(queue)-1)//8+1):
-                start: int = page*8
-                embed: discord.Embed = discord.Embed(
-                    title="Queue" + (f" {page+1}" if len(queue) > 8 else ""),
-                    description='\n'.join([f"{i+1+start}. "+(f"🎶 **{s.name}**" if i+start==curr_idx else s.name) + f" [[{s.duration}]({s.url})]" for i,s in enumerate(queue[start:start+9])]))
-                await ctx.message.channel.send(embed=embed)
+        client: MusicBotClient | None = self.clients.get(ctx.guild.id)
+        if len(queue) > 0 and client:
+            # One message, with buttons to flip through the pages if there is more than one
+            # Pages stay cached between -queue commands, for as long as the queue doesn't change
+            pages: QueuePages | None = self._queue_pages.get(ctx.guild.id)
+            if pages==None or pages.client is not client: pages = self._queue_pages[ctx.guild.id] = QueuePages(client)
+            page: int = pages.page_of(curr_idx)
+            if pages.page_count()==1:
+                await ctx.message.channel.send(embed=pages.get(page))
+                return
+            view: QueueView = QueueView(pages, page)
+            view.message = await ctx.message.channel.send(embed=pages.get(page), view=view)
         else:
             await ctx.message.channel.send("Queue is empty!")
                 
@@ -1,18 +1,30 @@
 import discord
 import asyncio
-from urllib import request
+import time
 import json
+import sys
+import itertools
+import re
 from typing import Callable, Awaitable, Coroutine, SupportsIndex, Any
-import yt_dlp
+from .autoplay import CooccurrenceIndex
+from .timers import TIMERS
+from .play_trace import PlayTrace, TracedSource
+from metrics import REGISTRY, Counter
+from executors import MISC
+from .fetch import HttpClient
+from .streams import STREAM_URLS
+from .duration_index import DurationIndex
+from .extractor import Extractor
 
 type QueuedSong = QueuedSong
 type QueuedPlaylist = tuple[str, list[QueuedSong]]
 type MusicBotClient = MusicBotClient
+type DetachedSession = DetachedSession
 
+# Accept-Encoding is set by HttpClient, based on which compressions it can decode
 HEADER = {'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.11 (KHTML, like Gecko) Chrome/23.0.1271.64 Safari/537.11',
        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
        'Accept-Charset': 'ISO-8859-1,utf-8;q=0.7,*;q=0.3',
-       'Accept-Encoding': 'none',
        'Accept-Language': 'en-US,en;q=0.8',
        'Connection': 'keep-alive'}
 
@@ -24,7 +36,8 @@ YTDL_FORMAT_OPTIONS = {
     'default_search': 'auto',
     'noplaylist': True,
     'nocheckcertificate': True,
-    'ignoreerrors': True,
+    # Errors are raised so the extractor can tell rate limits apart from missing videos
+    'ignoreerrors': False,
     'logtostderr': False, 
     'quiet': True, # update
     'no_warnings': True,
@@ -37,66 +50,228 @@ YTDL_FORMAT_OPTIONS = {
     "forceurl": True,
 }
 
+YT_WATCH_URL = "https://www.youtube.com/watch?v="
+YT_THUMBNAIL_URL = "https://i.ytimg.com/vi/"
+# Youtube video ids, to tell them apart from searches in saved songs
+YT_VIDEO_ID = re.compile(r"[A-Za-z0-9_-]{11}")
+# Stream keys of songs without a url
+_STREAM_TOKENS: itertools.count = itertools.count()
+
+# Seconds the bot can stay inactive before disconnecting
+INACTIVITY_TIMEOUT = 300
+
+# Most songs kept in a queue. Once it's full, the oldest songs get dropped
+MAX_QUEUE_SIZE = 32
+
 FFMPEG_OPTIONS = {'before_options': '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5','options': '-vn -filter:a "volume=0.25"'}
 
-YTDL = yt_dlp.YoutubeDL(YTDL_FORMAT_OPTIONS)
+# Only asks for what's needed to show a song in the queue, without resolving any formats.
+# Searches return the top result as a flat entry, without visiting the video's page at all
+YTDL_METADATA_OPTIONS = {
+    'skip_download': True,
+    'default_search': 'auto',
+    'noplaylist': True,
+    'nocheckcertificate': True,
+    'ignoreerrors': False,
+    'logtostderr': False,
+    'quiet': True,
+    'no_warnings': True,
+    'extract_flat': 'in_playlist',
+    'extractor_args': {'youtube': {'skip': ['dash', 'hls']}},
+    "simulate": True,
+}
+
+DEFAULT_THUMBNAIL = "https://redthread.uoregon.edu/files/original/affd16fd5264cab9197da4cd1a996f820e601ee4.png"
+
+# Slow extractions get a second attempt on another worker once they run past the usual p95
+EXTRACTOR: Extractor = Extractor(YTDL_FORMAT_OPTIONS, hedge = True)
+# Both extractors hit youtube, so they share a circuit breaker
+METADATA_EXTRACTOR: Extractor = Extractor(YTDL_METADATA_OPTIONS, name = "metadata", hedge = True, breaker = EXTRACTOR.breaker)
+
+# Shared by every page download, so connections to youtube get reused
+HTTP_CLIENT: HttpClient = HttpClient(headers = HEADER)
+
+FFMPEG_SPAWNS: Counter = REGISTRY.counter("music_bot_ffmpeg_spawns_total", "FFmpeg processes started to play songs")
 
 class QueuedSong:
     """
     Represents a song in the queue. Contains the URL, name, duration, and thumbnail of the queued video. 
     
     Additionally, has functions for searching for videos using youtube's search bar.
+    
+    Playlists can queue thousands of songs, so songs are kept small: youtube urls are stored as just the video id, 
+    durations as seconds, youtube thumbnails as just the (interned) file name, and video players in STREAM_URLS instead of in the song.
     """
-    def __init__(self, url: str | None, name: str, dur: str, thumbnail: str, player: str | None = None):
+    __slots__ = ('name', '_ref', '_vid', '_token', '_seconds', '_thumb', 'trace', 'autoplayed')
+    
+    def __init__(self, url: str | None, name: str, dur: str | int | None, thumbnail: str | None, player: str | None = None):
         self.name: str = name
-        self.url: str | None = url
-        self.duration: str = dur
-        self.thumbnail: str = thumbnail
-        self.player: str | None = player
-        self.generating_player: bool = False
+        # Whether _ref is a youtube video id. Only watch urls get stripped down to the id, anything else is kept as given
+        self._vid: bool = bool(url and url.startswith(YT_WATCH_URL) and YT_VIDEO_ID.fullmatch(url[len(YT_WATCH_URL):]))
+        # Video id for youtube videos, otherwise the full url
+        self._ref: str | None = url[len(YT_WATCH_URL):] if self._vid else url
+        # Key of the video player of songs without a url. Unlike id(self), never reused by a later song
+        self._token: int | None = next(_STREAM_TOKENS) if not self._ref else None
+        # -1 if unknown
+        self._seconds: int = QueuedSong.parse_duration(dur)
+        self._thumb: str | None = None
+        self.thumbnail = thumbnail
+        # Set while the song is being traced from the -play command to the first packet of audio
+        self.trace: PlayTrace | None = None
+        # Whether autoplay picked this song rather than someone asking for it
+        self.autoplayed: bool = False
+        if player: self.player = player
+    
+    @property
+    def url(self) -> str | None:
+        vid: str | None = self.video_id()
+        return YT_WATCH_URL + vid if vid else self._ref
+    
+    @property
+    def seconds(self) -> int | None:
+        """Duration of the song in seconds, or None if unknown
+        """
+        return self._seconds if self._seconds >= 0 else None
+    
+    @property
+    def duration(self) -> str:
+        return QueuedSong.format_duration(self.seconds)
+    
+    @property
+    def thumbnail(self) -> str:
+        vid: str | None = self.video_id()
+        if vid and self._thumb and not "://" in self._thumb: return f"{YT_THUMBNAIL_URL}{vid}/{self._thumb}"
+        return self._thumb if self._thumb else DEFAULT_THUMBNAIL
+    
+    @thumbnail.setter
+    def thumbnail(self, thumbnail: str | None):
+        vid: str | None = self.video_id()
+        prefix: str = f"{YT_THUMBNAIL_URL}{vid}/"
+        if vid and thumbnail and thumbnail.startswith(prefix):
+            # Youtube thumbnails only differ by file name (the query is just for resizing), so the same few names get shared
+            thumbnail = sys.intern(thumbnail[len(prefix):].split('?', 1)[0])
+        self._thumb = thumbnail if thumbnail!=DEFAULT_THUMBNAIL else None
+    
+    def _stream_key(self) -> str | int:
+        # Songs of the same video share a video player
+        return self._ref if self._ref else self._token
+    
+    @property
+    def player(self) -> str | None:
+        return STREAM_URLS.get(self._stream_key())
+    
+    @player.setter
+    def player(self, player: str | None):
+        STREAM_URLS.set(self._stream_key(), player)
+    
+    @property
+    def generating_player(self) -> bool:
+        return self._stream_key() in STREAM_URLS.resolving
+    
+    @generating_player.setter
+    def generating_player(self, generating: bool):
+        if generating: STREAM_URLS.resolving.add(self._stream_key())
+        else: STREAM_URLS.resolving.discard(self._stream_key())
+    
+    def parse_duration(dur: str | int | float | None) -> int:
+        """Parses a duration like 3:07 or 1:02:03 into seconds
+
+        Returns:
+            int: The duration in seconds, or -1 if it's unknown
+        """
+        if dur==None: return -1
+        if type(dur)!=str: return int(dur)
+        seconds: int = 0
+        for part in dur.split(':'):
+            if not part.isdigit(): return -1
+            seconds = seconds * 60 + int(part)
+        return seconds
     
-    async def create(query: str) -> QueuedSong | Exception | None:
+    async def create(query: str, with_player: bool = False) -> QueuedSong | Exception | None:
         """Creates a QueuedSong, searching for video data if necessary. 
+        
+        Usually only the song's metadata is looked up, which is enough to queue it,
+        and the video player is resolved separately with add_player once the song is about to be played.
+        Songs that are going to play right away get their video player from the same search instead, 
+        since a metadata search followed by a full search would only delay the first audio.
 
         Args:
             query (str): A video name or url
+            with_player (bool, optional): Whether to do the full search, which also finds the video player. Defaults to False.
 
         Returns:
-            None | QueuedSong: Instance of a QueuedSong containing video information
+            None | QueuedSong: Instance of a QueuedSong containing video information, with a video player if with_player was set
             If the video failed to be found, then returns None. 
         """
-        data: dict[str, Any] | None = await QueuedSong.get_video(query)
-        if data == None or type(data) == Exception: return data
-        
-        name: str = data.get('title', query)
-        url: str = data.get('webpage_url', query)
-        duration: str = data.get('duration_string', "??:??")
-        thumbnail: str = data.get('thumbnail', "https://redthread.uoregon.edu/files/original/affd16fd5264cab9197da4cd1a996f820e601ee4.png")
-        player: str | None = data.get('url')
-        
-        return QueuedSong(url, name, duration, thumbnail, player)
+        data: dict[str, Any] | Exception | None = await (QueuedSong.get_video(query) if with_player else QueuedSong.get_metadata(query))
+        if data == None or isinstance(data, Exception): return data
+        
+        name: str = data.get('title') or query
+        # Flat search results only have the watch url, under 'url'. Full results have the video player there instead
+        url: str = data.get('webpage_url') or (data.get('url') if not with_player else None) or \
+            (YT_WATCH_URL + data['id'] if data.get('id') and data.get('ie_key', data.get('extractor_key'))=='Youtube' else None) or query
+        duration: float | str | None = data.get('duration') if data.get('duration')!=None else data.get('duration_string')
+        thumbnails: list[dict[str, Any]] | None = data.get('thumbnails')
+        thumbnail: str = data.get('thumbnail') or (thumbnails[-1].get('url') if thumbnails else None) or DEFAULT_THUMBNAIL
+        
+        return QueuedSong(url, name, duration, thumbnail, data.get('url') if with_player else None)
+    
+    def format_duration(seconds: float | None) -> str:
+        """Formats a duration the same way yt_dlp's duration_string does, ie 3:07 or 1:02:03
+        """
+        if seconds == None: return "??:??"
+        minutes, secs = divmod(int(seconds), 60)
+        hours, minutes = divmod(minutes, 60)
+        return f"{hours}:{minutes:02d}:{secs:02d}" if hours else f"{minutes}:{secs:02d}"
     
     def has_player(self) -> bool:
         return self.player != None
     
-    def get_video_info(query: str) -> dict[str, Any] | Exception | None:
-        try:
-            return YTDL.extract_info(query, download=False)
-        except Exception as e:
-            return e
+    def video_id(self) -> str | None:
+        """Returns the youtube video id of this song, or None if the url isn't a youtube video
+        """
+        return self._ref if self._vid else None
+    
+    def to_record(self) -> list[str | None]:
+        """Compact representation of this song that can be saved and turned back into a QueuedSong using QueuedSong.from_record
+
+        Youtube urls are stored as just the video id, and youtube thumbnails as just the part after the video id.
+        Video players are not saved, as they expire.
+
+        Returns:
+            list[str | None]: [video id or url, name, duration, thumbnail]
+        """
+        return [self._ref, self.name, self.duration, self._thumb if self._thumb else DEFAULT_THUMBNAIL]
     
-    async def get_video(query: str) -> dict[str, Any] | Exception | None:
+    def from_record(record: list[str | None]) -> QueuedSong:
+        """Creates a QueuedSong from a record created with QueuedSong.to_record, without searching for anything
+
+        Args:
+            record (list[str | None]): [video id or url, name, duration, thumbnail]. The thumbnail may be None or left out
+
+        Returns:
+            QueuedSong: The saved song, without a video player
+        """
+        vid, name, duration = record[:3]
+        thumbnail: str | None = (record[3] if len(record) > 3 else None) or DEFAULT_THUMBNAIL
+        if vid and YT_VIDEO_ID.fullmatch(vid):
+            if not "://" in thumbnail: thumbnail = f"{YT_THUMBNAIL_URL}{vid}/{thumbnail}"
+            vid = YT_WATCH_URL + vid
+        return QueuedSong(vid, name, duration, thumbnail)
+    
+    async def get_video(query: str, prefetch: bool = False) -> dict[str, Any] | Exception | None:
         """Searches for a video given a URL or query
 
         Args:
             url (str): URL or query to search for
+            prefetch (bool, optional): Whether the video is only being fetched ahead of time, so the search can be refused when youtube is struggling. Defaults to False.
 
         Returns:
             dict | list[dict]: Dictionary containing some of the video's information. 
             If the query was a playlist, then this will contain a list of dictionaries with each video's information. 
         """
         # Get the video info
-        data: dict[str, Any] | Exception | None = await asyncio.get_event_loop().run_in_executor(None, lambda: QueuedSong.get_video_info(query))
+        data: dict[str, Any] | Exception | None = await EXTRACTOR.extract(query, prefetch)
         
         # Playlist urls or youtube searches may return multiple results, in which case we just want the top result
         if data and type(data) == dict and 'entries' in data:
@@ -105,11 +280,32 @@ class QueuedSong:
             
         return data
     
-    async def add_player(self) -> bool:
+    async def get_metadata(query: str) -> dict[str, Any] | Exception | None:
+        """Searches for a video's title, url, duration, and thumbnail given a URL or query, without resolving its video player
+
+        Args:
+            query (str): URL or query to search for
+
+        Returns:
+            dict[str, Any] | Exception | None: The video's metadata, what went wrong, or None if nothing was found
+        """
+        data: dict[str, Any] | Exception | None = await METADATA_EXTRACTOR.extract(query)
+        if data and type(data) == dict and 'entries' in data:
+            entries: list[dict[str, Any]] = list(data['entries'])
+            if len(entries)==0: return None
+            data = entries[0]
+        return data
+    
+    async def add_player(self, prefetch: bool = False) -> bool:
         self.generating_player = True
-        data: dict[str, Any] | Exception | None = await QueuedSong.get_video(self.url)
-        self.player = data.get('url')
-        return True if self.player else False
+        try:
+            data: dict[str, Any] | Exception | None = await QueuedSong.get_video(self.url, prefetch)
+            # Let the song try again when it gets played
+            if type(data)!=dict: return False
+            self.player = data.get('url')
+            return True if self.player else False
+        finally:
+            self.generating_player = False
     
     async def get_playlist(playlist_url: str) -> QueuedPlaylist | Exception | None:
         """Get a list of QueuedSong from a playlist
@@ -124,7 +320,9 @@ class QueuedSong:
         """
         if not "www.youtube.com/playlist?list=" in playlist_url: return None
         try:
-            results: QueuedPlaylist = await asyncio.get_event_loop().run_in_executor(None, lambda: QueuedSong._playlist_query_result(playlist_url))
+            page: str = await HTTP_CLIENT.get_text(playlist_url)
+            # Playlist pages are large, so parse them off the event loop
+            results: QueuedPlaylist = await MISC.run(QueuedSong._parse_playlist_page, page)
             return results
         except Exception as e:
             return e
@@ -151,18 +349,15 @@ class QueuedSong:
                 return start+i
         return len(string)
     
-    def _playlist_query_result(url: str) -> QueuedPlaylist:
-        """Searches for videos using a given youtube playlist URL
+    def _parse_playlist_page(page: str) -> QueuedPlaylist:
+        """Finds the videos in a downloaded youtube playlist page
 
         Args:
-            url (str): URL to search videos for
+            page (str): HTML of the playlist page
 
         Returns:
-            dict[str, dict[str, dict]]: Dictionary containing some of the video's information. 
+            QueuedPlaylist: Title of the playlist, and the videos in it
         """
-        req: request.Request = request.Request(url, headers=HEADER)
-        page: str = request.urlopen(req).read().decode("utf-8")
-        
         playlist_info_start: int = page.index("\"pageHeaderRenderer\"")
         playlist_info_end: int = QueuedSong._find_closing_brace(page[playlist_info_start:], "{", "}")
         playlist_info: dict[str, str | dict] = json.loads(page[playlist_info_start+21:playlist_info_start+playlist_info_end+1])
@@ -172,7 +367,7 @@ class QueuedSong:
         end: int = start + QueuedSong._find_closing_brace(page[start:], "[", "]")
         
         video_info: list[dict[str, Any]] = [video['playlistVideoRenderer'] for video in json.loads(page[start+11:end+1])]
-        return playlist_title, [QueuedSong(f"https://www.youtube.com/watch?v={info['videoId']}", 
+        return playlist_title, [QueuedSong(f"{YT_WATCH_URL}{info['videoId']}", 
                     info['title']['runs'][0]['text'], 
                     info['lengthText']['simpleText'], 
                     info['thumbnail']['thumbnails'][0]['url']) 
@@ -180,15 +375,51 @@ class QueuedSong:
             
     
 
+class DetachedSession:
+    """
+    State of a MusicBotClient that lost its voice connection, kept around so a new connection can resume playback. 
+    """
+    def __init__(self, client: MusicBotClient):
+        self.guild_id: int = client.guild.id
+        self.channel_id: int = client.channel.id
+        self.queue: list[QueuedSong] = client.queue
+        self.loop_queue: bool = client.loop_queue
+        self.autoplay: bool = client.autoplay
+        
+        # The song that was playing gets played again once resumed, so the queue position is moved back to it
+        song, index = client.curr_song()
+        self.song: QueuedSong | None = song
+        self.next_in_queue: int = index + 1 if song else client.next_in_queue
+        self.offset: float = client.playback_offset()
+        self.detached_at: float = time.monotonic()
+    
+    def expired(self, grace_period: float) -> bool:
+        return time.monotonic() - self.detached_at > grace_period
+
 class MusicBotClient(discord.VoiceClient):
     def __init__(self, client: discord.Client, channel: discord.abc.Connectable):
         # song queue
         self.queue: list[QueuedSong] = []
         self.next_in_queue: int = 0
+        # Durations of the songs in the queue, in the same order, for working out when songs will play
+        self.durations: DurationIndex = DurationIndex()
+        # Incremented every time the queue, the position in the queue, or the loop setting changes
+        self.version: int = 0
         
         self.loop_queue: bool = False
         self._active: bool = False
-        self._timeout_task: asyncio.Task | None = None
+        
+        # Autoplay picks a song from the co-occurrence index once the queue runs dry
+        self.autoplay: bool = False
+        self._autoplay_index: CooccurrenceIndex | None = None
+        self._last_played: QueuedSong | None = None
+        
+        # time.monotonic() at which the current song would have started if it had played from the beginning
+        self._song_started: float = 0
+        # Offset into the current song when the bot disconnected
+        self._dc_offset: float | None = None
+        # Key of this client's inactivity timer in the shared timer wheel
+        self._timeout_key: tuple[str, int] = ('inactivity', id(self))
         self._bg_tasks: set[asyncio.Task | asyncio.Future] = set()
         
         # Event that checks whether a song is currently being queried or not
@@ -211,15 +442,17 @@ class MusicBotClient(discord.VoiceClient):
         
         super().__init__(client, channel)
         self.msg_channel: discord.abc.Messageable = self.channel
+        TIMERS.start(self.loop)
         self._set_inactive()
     
-    async def enqueue(self, query: str | QueuedSong, blocking: bool = True) -> QueuedSong | Exception | None:
+    async def enqueue(self, query: str | QueuedSong | QueuedPlaylist, blocking: bool = True, trace: PlayTrace | None = None) -> QueuedSong | Exception | None:
         """Adds a song(s) to the queue
 
         Args:
-            query (str | QueuedSong): A query or QueuedSong
+            query (str | QueuedSong | QueuedPlaylist): A query, QueuedSong, or already loaded playlist
             blocking (bool): Whether the enqueue function should block until the song is actually queued. 
             If blocking is set to false, then this function will always return None
+            trace (PlayTrace | None): Trace that the queued song should carry until it starts playing
 
         Returns:
             QueuedSong | Exception | None: Song that was enqueued, Exception if the query failed, or None if the queued song is no longer available
@@ -231,6 +464,7 @@ class MusicBotClient(discord.VoiceClient):
             
         # Create an event that will be set once this enqueue request completes
         my_event: asyncio.Event = await self._wait_query()
+        if trace: trace.mark("wait_query")
         
         # If after waiting for previous queries we got disconnected, cancel the enqueue and bubble the wait events
         if self._disconnecting:
@@ -240,7 +474,9 @@ class MusicBotClient(discord.VoiceClient):
         # Search using the query and queue the song
         song: QueuedSong | QueuedPlaylist | Exception | None
         if type(query)==str:
-            self._query_task = self.loop.create_task(QueuedSong.create(query) if not "www.youtube.com/playlist?list=" in query else QueuedSong.get_playlist(query))
+            # Nothing is playing or waiting to play, so this song plays as soon as it's queued
+            plays_next: bool = not self._active and self.peek_queue()==None and not (self.loop_queue and len(self.queue) > 0)
+            self._query_task = self.loop.create_task(QueuedSong.create(query, with_player = plays_next) if not "www.youtube.com/playlist?list=" in query else QueuedSong.get_playlist(query))
             try:
                 song = await self._query_task
             except asyncio.CancelledError:
@@ -248,6 +484,7 @@ class MusicBotClient(discord.VoiceClient):
                 return Exception("Query was cancelled")
         else:
             song = query
+        if trace: trace.mark("create")
         
         # If while querying our song we got disconnected, bubble up the wait list and cancel all enqueues
         if self._disconnecting: 
@@ -258,15 +495,22 @@ class MusicBotClient(discord.VoiceClient):
         if song and type(song)==tuple:
             if len(song[1]) > 0:
                 self.queue.extend(song[1])
-                song = QueuedSong(query, song[0], '??:??', song[1][0].thumbnail)
+                self.durations.extend(s.seconds for s in song[1])
+                song = QueuedSong(query if type(query)==str else None, song[0], '??:??', song[1][0].thumbnail)
             else:
                 song = Exception("Invalid Playlist")
-        elif song and type(song)==QueuedSong: self.queue.append(song)
-        
-        # Limit queue size to 32
-        if len(self.queue) > 32: 
-            self.queue.pop(0)
-            self.next_in_queue-=1
+        elif song and type(song)==QueuedSong: 
+            song.trace = trace
+            self.queue.append(song)
+            self.durations.append(song.seconds)
+        
+        # Limit queue size, dropping the oldest songs (playlists can add many songs at once)
+        overflow: int = len(self.queue) - MAX_QUEUE_SIZE
+        if overflow > 0:
+            del self.queue[:overflow]
+            for _ in range(overflow): self.durations.remove(0)
+            self.next_in_queue = max(self.next_in_queue - overflow, 0)
+        self.version += 1
             
         my_event.set()
         
@@ -314,6 +558,7 @@ class MusicBotClient(discord.VoiceClient):
         if song: self.next_in_queue += 1
         if self.loop_queue and self.next_in_queue >= len(self.queue):
             self.next_in_queue = 0
+        self.version += 1
         return song
     
     def pop_queue(self, index: SupportsIndex = -1) -> QueuedSong | Exception:
@@ -329,15 +574,19 @@ class MusicBotClient(discord.VoiceClient):
         elif not isinstance(index, SupportsIndex): return Exception("Index for removing song must be a number")
         
         res: QueuedSong = self.queue.pop(index)
+        self.durations.remove(index)
         # Change next_in_queue only if self.queue.pop does not raise an error
         if self.next_in_queue > index and self.next_in_queue > 0: self.next_in_queue -= 1
+        self.version += 1
         return res
     
     def clear_queue(self):
         """Clears the current queue of songs
         """
         self.queue.clear()
+        self.durations.clear()
         self.next_in_queue = 0
+        self.version += 1
     
     def curr_song(self) -> tuple[QueuedSong | None, int]:
         """Returns the current QueuedSong and the song's index in the queue
@@ -368,19 +617,37 @@ class MusicBotClient(discord.VoiceClient):
         # then play it
         self._play_song(next_song)
         
-    def _play_song(self, song: QueuedSong, check_player: bool = True):
+    def _play_song(self, song: QueuedSong, check_player: bool = True, start_at: float = 0):
         # if we're at the end of the queue, return because there is nothing to play.
+        # (unless autoplay can pick something)
         if song==None:
+            if self.autoplay and self._autoplay_index and self._last_played:
+                self._run_task_threadsafe(self._autoplay_next())
+                return
             self._set_inactive()
             return
         # Otherwise, if the next song doesn't have a player, create one then play. 
         elif check_player and not song.has_player():
-            self._run_task_threadsafe(self._add_player_and_play(song))
+            self._run_task_threadsafe(self._add_player_and_play(song, start_at))
             return
         
-        # play the song
-        super().play(discord.FFmpegOpusAudio(song.player, **FFMPEG_OPTIONS), after = self.play_next)
+        # play the song, seeking to start_at seconds in if we are resuming it
+        options: dict[str, str] = FFMPEG_OPTIONS if start_at <= 0 else {**FFMPEG_OPTIONS, 'before_options': f"{FFMPEG_OPTIONS['before_options']} -ss {start_at:.2f}"}
+        trace: PlayTrace | None = song.trace
+        song.trace = None
+        if trace: trace.mark("play_song")
+        source: discord.AudioSource = discord.FFmpegOpusAudio(song.player, **options)
+        FFMPEG_SPAWNS.inc()
+        if trace:
+            trace.mark("ffmpeg_spawn")
+            source = TracedSource(source, trace)
+        super().play(source, after = self.play_next)
+        self._song_started = time.monotonic() - start_at
         self._set_active()
+        # Songs autoplay picked aren't recorded, otherwise autoplay would keep reinforcing its own picks
+        if self._autoplay_index and not song.autoplayed:
+            self.loop.call_soon_threadsafe(self._autoplay_index.record, self._last_played.url if self._last_played else None, song.url, song.name)
+        self._last_played = song
         if hasattr(self, '_on_play'): self._run_task_threadsafe(self._on_play(song, self))
         
         # setup the next song if it has no player
@@ -392,7 +659,8 @@ class MusicBotClient(discord.VoiceClient):
         if self._disconnecting:
             my_event.set()
             return False
-        self._query_task = self.loop.create_task(song.add_player())
+        # Prefetches give way to songs that are about to play when youtube starts failing
+        self._query_task = self.loop.create_task(song.add_player(prefetch = not prioritize))
         res: bool = True
         try:
             await self._query_task
@@ -403,38 +671,55 @@ class MusicBotClient(discord.VoiceClient):
         my_event.set()
         return res and song.has_player()
     
-    async def _add_player_and_play(self, song: QueuedSong):
+    async def _add_player_and_play(self, song: QueuedSong, start_at: float = 0):
         if song.has_player():
-            self._play_song(song, False)
+            self._play_song(song, False, start_at)
         
         elif song.generating_player:            
             iters: int = 0
-            while not song.has_player() and iters<10:
+            while song.generating_player and not song.has_player() and iters<10:
                 await asyncio.sleep(1)
                 iters+=1
                 
             if song.has_player():
-                self._play_song(song, False)
+                self._play_song(song, False, start_at)
+            # The prefetch was refused or failed, so search again now that the song is needed
+            elif not song.generating_player and await self._add_player_to_song(song, True):
+                self._play_song(song, False, start_at)
             else:
                 self.play_next(Exception(f"Failed to play {song.name}"))
                 
         elif await self._add_player_to_song(song, True):
-            self._play_song(song, False)
+            self._play_song(song, False, start_at)
             
         else:
             self.play_next(Exception(f"Failed to play {song.name}"))
     
+    async def _autoplay_next(self):
+        """Queue and play the song the co-occurrence index picks to follow the last played song
+        """
+        pick: tuple[str, str] | None = self._autoplay_index.pick(self._last_played.url, {s.url for s in self.queue})
+        if pick==None or self._disconnecting:
+            self._set_inactive()
+            return
+        
+        song: QueuedSong | Exception | None = await self.enqueue(pick[0])
+        if type(song)==QueuedSong:
+            song.autoplayed = True
+            self.play_next()
+        else:
+            self._set_inactive()
+            if song: await self._on_err(self, song)
+    
     def _set_active(self):
         self._active = True
-        if self._timeout_task: self._timeout_task.cancel()
+        TIMERS.disarm(self._timeout_key)
     
     def _set_inactive(self):
         self._active = False
-        if self._timeout_task and not self._timeout_task.done(): self._timeout_task.cancel()
-        self._timeout_task = self.loop.create_task(self.inactivity_timeout())
+        TIMERS.arm(self._timeout_key, INACTIVITY_TIMEOUT, self.inactivity_timeout)
     
     async def inactivity_timeout(self):
-        await asyncio.sleep(300)
         await self.disconnect(reason = "Timed out", force = False, cancel_timeout = False)
         
     async def disconnect(self, *, force: bool = False, cancel_timeout: bool = True, reason: str | None = None):
@@ -444,6 +729,7 @@ class MusicBotClient(discord.VoiceClient):
             force (bool, optional): Force the disconnect even if the bot is not connected. Defaults to False.
         """
         self._disconnecting = True
+        if self._dc_offset==None: self._dc_offset = self.playback_offset()
         
         self.stop()
         await self._connection.disconnect(force=force, wait=True, cleanup = False)
@@ -451,18 +737,144 @@ class MusicBotClient(discord.VoiceClient):
             
     def cleanup(self, *, cancel_timeout: bool = True, reason: str | None = None):
         self._disconnecting = True
+        if self._dc_offset==None: self._dc_offset = self.playback_offset()
         self.cancel_enqueue()
         
         if self.source and self.is_playing():
             self.source.cleanup()
-        if cancel_timeout and self._timeout_task:
-            self._timeout_task.cancel()
+        if cancel_timeout:
+            TIMERS.disarm(self._timeout_key)
             
         super().cleanup()
                     
         if hasattr(self, '_on_disconnect') and not self.is_connected():
             self._run_task(self._on_disconnect(self, reason))
 
+    def get_state(self) -> dict[str, Any]:
+        """Get the state of this client in a form that can be saved as json and restored using MusicBotClient.load_state
+
+        Returns:
+            dict[str, Any]: Saved queue, position in the queue, and settings
+        """
+        return {
+            'guild': self.guild.id,
+            'channel': self.channel.id,
+            'msg_channel': getattr(self.msg_channel, 'id', None),
+            'next_in_queue': self.next_in_queue,
+            'active': self._active,
+            'loop_queue': self.loop_queue,
+            'autoplay': self.autoplay,
+            'queue': [song.to_record() for song in self.queue],
+        }
+    
+    def load_state(self, state: dict[str, Any]):
+        """Restore a queue saved using MusicBotClient.get_state. 
+        The songs are restored without video players, which get added once each song is about to play.
+        
+        If a song was playing when the state was saved, then it will be the next song played
+
+        Args:
+            state (dict[str, Any]): State saved by MusicBotClient.get_state
+        """
+        self.queue = [QueuedSong.from_record(record) for record in state['queue']]
+        self.durations.rebuild(song.seconds for song in self.queue)
+        self.next_in_queue = min(max(state['next_in_queue'] - (1 if state['active'] else 0), 0), len(self.queue))
+        self.loop_queue = state['loop_queue']
+        self.autoplay = state.get('autoplay', False)
+        self.version += 1
+    
+    def playback_offset(self) -> float:
+        """How far into the current song the bot is
+
+        Returns:
+            float: Seconds since the start of the current song, or 0 if nothing is playing
+        """
+        if self._dc_offset!=None: return self._dc_offset
+        return time.monotonic() - self._song_started if self._active else 0
+    
+    def index_of(self, song: QueuedSong) -> int:
+        """Index of a song in the queue, searching from the end since songs are usually looked up right after being queued
+
+        Returns:
+            int: Index of the song, or -1 if it isn't in the queue
+        """
+        for i in range(len(self.queue) - 1, -1, -1):
+            if self.queue[i] is song: return i
+        return -1
+    
+    def eta(self, index: int) -> tuple[float, bool] | None:
+        """How long until the song at an index of the queue starts playing, in O(log n)
+
+        Args:
+            index (int): Index of the song in the queue
+
+        Returns:
+            tuple[float, bool] | None: Seconds until the song plays, and whether every song before it had a known duration. 
+            None if the song won't play again (or the index is out of bounds)
+        """
+        if index < 0 or index >= len(self.queue): return None
+        
+        wait: float = 0
+        exact: bool = True
+        curr, curr_idx = self.curr_song()
+        if curr:
+            if index==curr_idx: return 0, True
+            if curr.seconds==None: exact = False
+            else: wait += max(0, curr.seconds - self.playback_offset())
+        
+        if index >= self.next_in_queue:
+            secs, known = self.durations.seconds_between(self.next_in_queue, index)
+        elif self.loop_queue:
+            secs, known = self.durations.seconds_between(self.next_in_queue, len(self.queue))
+            wrapped_secs, wrapped_known = self.durations.seconds_between(0, index)
+            secs, known = secs + wrapped_secs, known and wrapped_known
+        else:
+            return None
+        return wait + secs, exact and known
+    
+    def remaining(self) -> tuple[float, bool]:
+        """How long until the queue finishes playing, ignoring looping
+
+        Returns:
+            tuple[float, bool]: Seconds left in the queue, and whether every song left had a known duration
+        """
+        secs, exact = self.durations.seconds_between(self.next_in_queue, len(self.queue))
+        curr: QueuedSong | None = self.curr_song()[0]
+        if curr:
+            if curr.seconds==None: exact = False
+            else: secs += max(0, curr.seconds - self.playback_offset())
+        return secs, exact
+    
+    def detach(self) -> DetachedSession:
+        """Save everything needed to pick playback back up on a new connection, using MusicBotClient.resume
+
+        Returns:
+            DetachedSession: The queue, position in the queue and current song, and the offset into the current song
+        """
+        return DetachedSession(self)
+    
+    def resume(self, session: DetachedSession):
+        """Continue from a session saved using MusicBotClient.detach, 
+        picking the song that was playing back up from where it left off. 
+
+        Songs keep the video players they already had, so nothing needs to be searched for again if they haven't expired.
+
+        Args:
+            session (DetachedSession): Session saved when the previous client disconnected
+        """
+        self.queue = session.queue
+        self.durations.rebuild(song.seconds for song in self.queue)
+        self.next_in_queue = session.next_in_queue
+        self.loop_queue = session.loop_queue
+        self.autoplay = session.autoplay
+        self._last_played = session.song
+        self.version += 1
+        
+        if session.song:
+            # Counts as active right away, even if the song's player still has to be generated
+            self._set_active()
+            self._play_song(session.song, start_at = session.offset)
+    
     def get_queue(self) -> tuple[int, list[QueuedSong]]:
         """Get the queue and the current song index
 
@@ -478,8 +890,27 @@ class MusicBotClient(discord.VoiceClient):
             bool: what the loop was set to 
         """
         self.loop_queue = not self.loop_queue
+        self.version += 1
         return self.loop_queue
         
+    def toggle_autoplay(self) -> bool:
+        """Toggles whether the bot should pick songs to play by itself once the queue runs out
+
+        Returns:
+            bool: what autoplay was set to 
+        """
+        self.autoplay = not self.autoplay
+        self.version += 1
+        return self.autoplay
+    
+    def set_autoplay_index(self, index: CooccurrenceIndex | None):
+        """Set the co-occurrence index that autoplay picks songs from, and that played songs get recorded to
+
+        Args:
+            index (CooccurrenceIndex | None): The index to use
+        """
+        self._autoplay_index = index
+        
     def is_active(self) -> bool:
         """Indicates if the bot is playing music or if there are songs still left in the queue
 
@@ -0,0 +1,125 @@
+from typing import Iterable
+
+class DurationIndex:
+    """
+    Durations of the songs in a queue, kept in Fenwick trees so the total length of any range of the queue takes O(log n).
+
+    Songs get slots in the order they're added. Removing a song empties its slot instead of shifting every slot after it,
+    and a queue index is mapped to its slot by searching a second tree that counts the filled slots.
+    Once the slots run out, the filled ones are packed back together (or the trees grow), which is O(n) but only happens every O(n) appends.
+    """
+    def __init__(self, seconds: Iterable[int | None] = ()):
+        """
+        Args:
+            seconds (Iterable[int | None], optional): Durations of the songs already in the queue, None for unknown durations. Defaults to ().
+        """
+        self.rebuild(seconds)
+
+    def rebuild(self, seconds: Iterable[int | None]):
+        """Replace every duration in the index, ie after the whole queue was replaced
+        """
+        values: list[int | None] = list(seconds)
+        self._len: int = len(values)
+        self._used: int = len(values)
+        self._cap: int = max(16, 1 << (len(values) * 2 - 1).bit_length()) if values else 16
+        # Slot values, so a slot can be emptied without knowing what was in it. -1 for empty slots
+        self._slots: list[int | None] = [-1] * self._cap
+        self._count: list[int] = [0] * (self._cap + 1)
+        self._secs: list[int] = [0] * (self._cap + 1)
+        self._unknown: list[int] = [0] * (self._cap + 1)
+        for i, value in enumerate(values):
+            self._slots[i] = value if value!=None and value >= 0 else None
+            self._count[i+1] = 1
+            self._secs[i+1] = value if value!=None and value >= 0 else 0
+            self._unknown[i+1] = 0 if value!=None and value >= 0 else 1
+        # Build the trees in O(n) by pushing every node's sum up to its parent
+        for tree in (self._count, self._secs, self._unknown):
+            for i in range(1, self._cap + 1):
+                parent: int = i + (i & -i)
+                if parent <= self._cap: tree[parent] += tree[i]
+
+    def __len__(self) -> int:
+        return self._len
+
+    def _add(self, slot: int, count: int, secs: int, unknown: int):
+        i: int = slot + 1
+        while i <= self._cap:
+            self._count[i] += count
+            self._secs[i] += secs
+            self._unknown[i] += unknown
+            i += i & -i
+
+    def _prefix(self, slot: int) -> tuple[int, int]:
+        """Total seconds and unknown durations in slots [0, slot)
+        """
+        secs: int = 0
+        unknown: int = 0
+        i: int = slot
+        while i > 0:
+            secs += self._secs[i]
+            unknown += self._unknown[i]
+            i -= i & -i
+        return secs, unknown
+
+    def _slot_of(self, index: int) -> int:
+        """Slot of the song at a queue index, found by walking down the count tree
+        """
+        pos: int = 0
+        remaining: int = index + 1
+        step: int = 1 << (self._cap.bit_length() - 1)
+        while step:
+            if pos + step <= self._cap and self._count[pos + step] < remaining:
+                pos += step
+                remaining -= self._count[pos]
+            step >>= 1
+        return pos
+
+    def append(self, seconds: int | None):
+        """Add the duration of a song added to the end of the queue
+        """
+        if self._used==self._cap: self._compact()
+        slot: int = self._used
+        known: bool = seconds!=None and seconds >= 0
+        self._slots[slot] = seconds if known else None
+        self._add(slot, 1, seconds if known else 0, 0 if known else 1)
+        self._used += 1
+        self._len += 1
+
+    def extend(self, seconds: Iterable[int | None]):
+        for value in seconds: self.append(value)
+
+    def remove(self, index: int):
+        """Remove the duration of the song at a queue index, ie after popping it from the queue
+        """
+        if index < 0 or index >= self._len: raise IndexError("Index out of bounds")
+        slot: int = self._slot_of(index)
+        value: int | None = self._slots[slot]
+        self._slots[slot] = -1
+        self._add(slot, -1, -(value if value!=None else 0), 0 if value!=None else -1)
+        self._len -= 1
+
+    def clear(self):
+        self.rebuild(())
+
+    def _compact(self):
+        self.rebuild([value for value in self._slots[:self._used] if value!=-1])
+
+    def seconds_between(self, start: int, end: int) -> tuple[int, bool]:
+        """Total length of the songs in the queue from start up to (not including) end
+
+        Returns:
+            tuple[int, bool]: Total seconds of the songs with known durations, and whether every song's duration was known
+        """
+        start = min(max(start, 0), self._len)
+        end = min(max(end, start), self._len)
+        hi_secs, hi_unknown = self._prefix(self._slot_of(end - 1) + 1) if end > 0 else (0, 0)
+        lo_secs, lo_unknown = self._prefix(self._slot_of(start - 1) + 1) if start > 0 else (0, 0)
+        return hi_secs - lo_secs, hi_unknown==lo_unknown
+
+    def total(self) -> tuple[int, bool]:
+        """Total length of the queue
+
+        Returns:
+            tuple[int, bool]: Total seconds of the songs with known durations, and whether every song's duration was known
+        """
+        return self.seconds_between(0, self._len)
@@ -0,0 +1,329 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from typing import Any
+import yt_dlp
+from metrics import REGISTRY, Counter, Histogram
+from executors import Pool, EXTRACTION
+
+type ExtractionError = ExtractionError
+type CircuitBreaker = CircuitBreaker
+type ExtractResult = dict[str, Any] | Exception | None
+
+EXTRACTIONS: Histogram = REGISTRY.histogram("music_bot_extraction_seconds", "Time taken to extract video info with yt_dlp, by extractor", ("extractor",))
+EXTRACTION_FAILURES: Counter = REGISTRY.counter("music_bot_extraction_failures_total", "Video info extractions that failed or found nothing, by kind of failure", ("kind",))
+HEDGES: Counter = REGISTRY.counter("music_bot_extraction_hedges_total", "Hedged extraction attempts, by whether the hedge was launched or won", ("result",))
+NEGATIVE_HITS: Counter = REGISTRY.counter("music_bot_extraction_negative_cache_hits_total", "Extractions answered by a cached failure instead of calling yt_dlp")
+SHED: Counter = REGISTRY.counter("music_bot_extractions_shed_total", "Extractions refused while the circuit breaker was open, by kind of request", ("request",))
+
+# Kinds of extraction failures
+UNAVAILABLE: str = "unavailable"
+RATE_LIMIT: str = "rate_limit"
+NETWORK: str = "network"
+ERROR: str = "error"
+
+# Pieces of yt_dlp error messages that identify each kind of failure, checked in order
+_FAILURE_PATTERNS: tuple[tuple[str, tuple[str, ...]], ...] = (
+    # "Sign in to confirm you're not a bot" is youtube rate limiting us, unlike "Sign in to confirm your age"
+    (RATE_LIMIT, ("http error 429", "too many requests", "confirm you're not a bot", "confirm you’re not a bot", "not a bot", "rate-limit", "rate limit")),
+    (UNAVAILABLE, ("video unavailable", "private video", "not available", "has been removed", "been terminated", "copyright",
+                   "confirm your age", "members-only", "unsupported url", "is not a valid url", "incomplete youtube id", "no video formats")),
+    (NETWORK, ("timed out", "unable to download", "connection", "name resolution", "name or service not known", "network is unreachable",
+               "http error 5", "remote end closed", "ssl")),
+)
+
+# Seconds a failed query is remembered for, by kind of failure. Rate limits are handled by the circuit breaker instead
+NEGATIVE_TTLS: dict[str, float] = {UNAVAILABLE: 600, NETWORK: 15, ERROR: 60}
+
+class ExtractionError(Exception):
+    """
+    Failed extraction, along with what kind of failure it was
+    """
+    def __init__(self, kind: str, message: str):
+        super().__init__(message)
+        self.kind: str = kind
+
+    def classify(e: Exception) -> str:
+        """Work out what kind of failure an exception raised by yt_dlp is
+        """
+        cause: BaseException | None = getattr(e, 'exc_info', (None, None))[1] if type(getattr(e, 'exc_info', None))==tuple else None
+        msg: str = str(e).lower()
+        for kind, patterns in _FAILURE_PATTERNS:
+            if any(pattern in msg for pattern in patterns): return kind
+        if isinstance(e, (OSError, TimeoutError)) or isinstance(cause, (OSError, TimeoutError)): return NETWORK
+        return ERROR
+
+    def from_exception(e: Exception) -> ExtractionError:
+        # yt_dlp prefixes its messages with "ERROR: "
+        return ExtractionError(ExtractionError.classify(e), str(e).removeprefix("ERROR: "))
+
+class CircuitBreaker:
+    """
+    Stops calls to a backend that is failing.
+
+    Opens right away when the backend rate limits us, or after `threshold` failures in a row.
+    Once open, calls are refused for a backoff that doubles every time the breaker opens again,
+    after which the breaker is half open and lets a single probe through. The breaker closes again if the probe succeeds.
+    """
+    CLOSED: str = "closed"
+    OPEN: str = "open"
+    HALF_OPEN: str = "half_open"
+
+    def __init__(self, threshold: int = 5, backoff: float = 30, max_backoff: float = 900):
+        """
+        Args:
+            threshold (int, optional): Failures in a row that open the breaker. Defaults to 5.
+            backoff (float, optional): Seconds the breaker stays open the first time it opens. Defaults to 30.
+            max_backoff (float, optional): Most seconds the breaker can stay open for. Defaults to 900.
+        """
+        self.threshold: int = threshold
+        self.backoff: float = backoff
+        self.max_backoff: float = max_backoff
+        self.state: str = CircuitBreaker.CLOSED
+        self.failures: int = 0
+        # Times the breaker opened since it was last closed
+        self.trips: int = 0
+        self.retry_at: float = 0
+        self._probing: bool = False
+
+    def allow(self, probe: bool = True) -> bool:
+        """Check whether a call can go through
+
+        Args:
+            probe (bool, optional): Whether the call can be used to probe a half open backend. Defaults to True.
+
+        Returns:
+            bool: True if the call can be made
+        """
+        if self.state==CircuitBreaker.OPEN and time.monotonic() >= self.retry_at: self.state = CircuitBreaker.HALF_OPEN
+        if self.state==CircuitBreaker.CLOSED: return True
+        if self.state==CircuitBreaker.HALF_OPEN and probe and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def is_probing(self) -> bool:
+        return self._probing
+
+    def success(self, probe: bool = False):
+        # Calls that were started before the breaker opened don't say whether the backend recovered
+        if self.state!=CircuitBreaker.CLOSED and not probe: return
+        self.state = CircuitBreaker.CLOSED
+        self.failures = 0
+        self.trips = 0
+        self._probing = False
+
+    def failure(self, trip: bool = False, probe: bool = False):
+        """Record a failed call
+
+        Args:
+            trip (bool, optional): Whether the failure should open the breaker right away. Defaults to False.
+            probe (bool, optional): Whether the call was the half open probe. Defaults to False.
+        """
+        if self.state==CircuitBreaker.OPEN: return
+        if self.state==CircuitBreaker.HALF_OPEN and not probe: return
+        self.failures += 1
+        if trip or probe or self.failures >= self.threshold:
+            self.trips += 1
+            self.state = CircuitBreaker.OPEN
+            self.retry_at = time.monotonic() + min(self.max_backoff, self.backoff * 2 ** (self.trips - 1))
+            self._probing = False
+
+    def release(self):
+        """Give up on the current probe without a result, so another call can probe
+        """
+        self._probing = False
+
+    def retry_in(self) -> float:
+        return max(0, self.retry_at - time.monotonic()) if self.state==CircuitBreaker.OPEN else 0
+
+class Extractor:
+    """
+    Runs yt_dlp extractions on the extraction pool.
+
+    Extractions are usually quick, but the occasional one hangs for much longer than the rest.
+    When hedging is on and an extraction has taken longer than the observed p95,
+    a second attempt is started on another worker and whichever attempt succeeds first gets used.
+    Hedges are paid for out of a budget that grows with every request, so they can only add a small fraction of extra load.
+
+    Failed queries are remembered for a while, and a circuit breaker stops extractions altogether while youtube is rate limiting us.
+    Prefetches are refused as soon as anything goes wrong, so the requests users are waiting on go first.
+    """
+    def __init__(self, options: dict[str, Any], *, name: str = "stream", pool: Pool = EXTRACTION, hedge: bool = True, hedge_options: dict[str, Any] | None = None,
+                 budget: float = 0.1, burst: float = 3, window: int = 200, min_samples: int = 20, min_delay: float = 1,
+                 breaker: CircuitBreaker | None = None, negative_cache_size: int = 1024):
+        """
+        Args:
+            options (dict[str, Any]): Options given to yt_dlp
+            name (str, optional): Name the extractor's metrics are labeled with. Defaults to "stream".
+            pool (Pool, optional): Pool the extractions run on. Defaults to EXTRACTION.
+            hedge (bool, optional): Whether slow extractions get hedged. Defaults to True.
+            hedge_options (dict[str, Any] | None, optional): Options used by hedged attempts, ie to use a different client profile. Defaults to options.
+            budget (float, optional): Hedges allowed per extraction, on average. Defaults to 0.1.
+            burst (float, optional): Most hedges that can be saved up and used at once. Defaults to 3.
+            window (int, optional): How many of the latest extraction times the p95 is taken from. Defaults to 200.
+            min_samples (int, optional): Extractions that have to be timed before hedging starts. Defaults to 20.
+            min_delay (float, optional): Shortest time an extraction can run before getting hedged. Defaults to 1.
+            breaker (CircuitBreaker | None, optional): Breaker that stops extractions while they keep failing. Defaults to a new CircuitBreaker.
+            negative_cache_size (int, optional): Most failed queries that are remembered at once. Defaults to 1024.
+        """
+        self.name: str = name
+        self._extractions: Histogram = EXTRACTIONS.labels(name)
+        self.pool: Pool = pool
+        self.hedge: bool = hedge
+        self.budget: float = budget
+        self.burst: float = burst
+        self.min_samples: int = min_samples
+        self.min_delay: float = min_delay
+        self.profiles: dict[str, dict[str, Any]] = {'primary': options, 'hedge': hedge_options if hedge_options else options}
+        self.latencies: deque[float] = deque(maxlen=window)
+        self.tokens: float = burst
+        self.requests: int = 0
+        self.hedged: int = 0
+        self.hedges_won: int = 0
+        # yt_dlp instances aren't thread safe, so every worker gets its own instance of each profile
+        self._local: threading.local = threading.local()
+        # Extraction times are recorded from worker threads
+        self._lock: threading.Lock = threading.Lock()
+        self._delay: float | None = None
+
+        self.breaker: CircuitBreaker = breaker if breaker else CircuitBreaker()
+        self.negative_cache_size: int = negative_cache_size
+        # query -> (time.monotonic() the failure expires at, the failure)
+        self._negative: dict[str, tuple[float, ExtractionError]] = {}
+        REGISTRY.gauge("music_bot_extraction_breaker_open", "Whether extractions are being refused because they keep failing (1 open, 0.5 half open, 0 closed)",
+                       fn = lambda: {CircuitBreaker.CLOSED: 0, CircuitBreaker.HALF_OPEN: 0.5, CircuitBreaker.OPEN: 1}[self.breaker.state])
+
+    def _ytdl(self, profile: str) -> yt_dlp.YoutubeDL:
+        ytdl: yt_dlp.YoutubeDL | None = getattr(self._local, profile, None)
+        if ytdl==None:
+            ytdl = yt_dlp.YoutubeDL(self.profiles[profile])
+            setattr(self._local, profile, ytdl)
+        return ytdl
+
+    def extract_now(self, query: str, profile: str = 'primary') -> ExtractResult:
+        """Extract video info on the current thread
+
+        Args:
+            query (str): URL or query to search for
+            profile (str, optional): Which options to extract with. Defaults to 'primary'.
+
+        Returns:
+            dict[str, Any] | ExtractionError | None: The video info, what went wrong, or None if nothing was found
+        """
+        start: float = time.perf_counter()
+        try:
+            data: dict[str, Any] | None = self._ytdl(profile).extract_info(query, download=False)
+            if data==None: EXTRACTION_FAILURES.labels("not_found").inc()
+            return data
+        except Exception as e:
+            err: ExtractionError = ExtractionError.from_exception(e)
+            EXTRACTION_FAILURES.labels(err.kind).inc()
+            return err
+        finally:
+            elapsed: float = time.perf_counter() - start
+            self._extractions.observe(elapsed)
+            with self._lock:
+                self.latencies.append(elapsed)
+                self._delay = None
+
+    def hedge_delay(self) -> float | None:
+        """How long an extraction can run before it gets hedged
+
+        Returns:
+            float | None: The observed p95 extraction time, or None if not enough extractions have been timed yet
+        """
+        with self._lock:
+            if self._delay==None and len(self.latencies) >= self.min_samples:
+                ordered: list[float] = sorted(self.latencies)
+                self._delay = max(self.min_delay, ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))])
+            return self._delay
+
+    async def extract(self, query: str, prefetch: bool = False) -> ExtractResult:
+        """Extract video info on the pool, unless the query failed recently or the circuit breaker is open
+
+        Args:
+            query (str): URL or query to search for
+            prefetch (bool, optional): Whether the extraction is only getting ready for later, and can be refused first. Defaults to False.
+
+        Returns:
+            dict[str, Any] | ExtractionError | None: The video info, what went wrong, or None if nothing was found
+        """
+        cached: ExtractionError | None = self._cached_failure(query)
+        if cached:
+            NEGATIVE_HITS.inc()
+            return cached
+
+        # Prefetches never probe the backend, so a user's request gets to find out whether it recovered
+        # Prefetches are also refused while extractions have started failing, before the breaker opens
+        if (prefetch and self.breaker.failures > 0) or not self.breaker.allow(probe = not prefetch):
+            SHED.labels("prefetch" if prefetch else "play").inc()
+            return ExtractionError(RATE_LIMIT, f"Youtube is refusing requests, try again in {max(1, round(self.breaker.retry_in()))}s")
+
+        probe: bool = self.breaker.is_probing()
+        try:
+            res: ExtractResult = await self._extract(query)
+        finally:
+            if probe and self.breaker.is_probing(): self.breaker.release()
+        if isinstance(res, ExtractionError) and res.kind!=UNAVAILABLE:
+            self.breaker.failure(trip = res.kind==RATE_LIMIT, probe = probe)
+        else:
+            # The backend answered, even if the video doesn't exist
+            self.breaker.success(probe)
+        if isinstance(res, ExtractionError) and res.kind in NEGATIVE_TTLS: self._cache_failure(query, res)
+        return res
+
+    def _cached_failure(self, query: str) -> ExtractionError | None:
+        entry: tuple[float, ExtractionError] | None = self._negative.get(query)
+        if entry==None: return None
+        if entry[0] <= time.monotonic():
+            del self._negative[query]
+            return None
+        return entry[1]
+
+    def _cache_failure(self, query: str, err: ExtractionError):
+        self._negative.pop(query, None)
+        # Dicts keep insertion order, so the first entry is the oldest
+        while len(self._negative) >= self.negative_cache_size: del self._negative[next(iter(self._negative))]
+        self._negative[query] = (time.monotonic() + NEGATIVE_TTLS[err.kind], err)
+
+    async def _extract(self, query: str) -> ExtractResult:
+        self.requests += 1
+        self.tokens = min(self.burst, self.tokens + self.budget)
+        primary: asyncio.Future = self.pool.submit(self.extract_now, query, 'primary')
+        delay: float | None = self.hedge_delay() if self.hedge else None
+        if delay==None: return await primary
+
+        attempts: set[asyncio.Future] = {primary}
+        try:
+            done, attempts = await asyncio.wait(attempts, timeout=delay)
+            if done: return primary.result()
+
+            # Don't add to the load of a pool that's already backed up, or of a backend that's already failing
+            if self.tokens < 1 or self.pool.queued > 0 or self.breaker.state!=CircuitBreaker.CLOSED: return await primary
+            self.tokens -= 1
+            self.hedged += 1
+            HEDGES.labels("launched").inc()
+            hedge: asyncio.Future = self.pool.submit(self.extract_now, query, 'hedge')
+            attempts.add(hedge)
+
+            # The first attempt to find the video wins, otherwise whichever fails last
+            while True:
+                done, attempts = await asyncio.wait(attempts, return_when=asyncio.FIRST_COMPLETED)
+                winner: asyncio.Future | None = next((a for a in done if isinstance(a.result(), dict)), None)
+                if winner==None and len(attempts)==0: winner = done.pop()
+                if winner==None: continue
+                if winner is hedge:
+                    self.hedges_won += 1
+                    HEDGES.labels("won").inc()
+                return winner.result()
+        finally:
+            # Attempts still waiting for a worker never start. Ones that already started run to the end and get ignored
+            for attempt in attempts: attempt.cancel()
+
+    def stats(self) -> dict[str, float]:
+        delay: float | None = self.hedge_delay()
+        return {'requests': self.requests, 'hedged': self.hedged, 'hedges_won': self.hedges_won,
+                'hedge_delay': delay if delay!=None else float('nan'), 'tokens': self.tokens,
+                'breaker': self.breaker.state, 'retry_in': self.breaker.retry_in(), 'negative_cached': len(self._negative)}
@@ -0,0 +1,91 @@
+import asyncio
+import importlib.util
+from urllib.parse import urlsplit
+import aiohttp
+from metrics import REGISTRY, Counter, Histogram
+
+# aiohttp can only decode brotli if one of these is installed
+BROTLI: bool = importlib.util.find_spec("brotli")!=None or importlib.util.find_spec("brotlicffi")!=None
+
+HTTP_REQUESTS: Histogram = REGISTRY.histogram("http_request_seconds", "Time taken by outgoing HTTP requests, including reading the body", ("host",))
+HTTP_RETRIES: Counter = REGISTRY.counter("http_retries_total", "Outgoing HTTP requests that were retried", ("host",))
+HTTP_BYTES: Counter = REGISTRY.counter("http_received_bytes_total", "Decompressed bytes received from outgoing HTTP requests", ("host",))
+
+class HttpError(Exception):
+    def __init__(self, status: int, url: str):
+        super().__init__(f"HTTP {status} from {url}")
+        self.status: int = status
+
+class HttpClient:
+    """
+    Shared async HTTP client. Keeps connections alive between requests, asks for compressed responses,
+    and retries requests that time out or fail with a server error.
+    """
+    def __init__(self, *, headers: dict[str, str] | None = None, timeout: float = 15, retries: int = 2, backoff: float = 0.5,
+                 limit_per_host: int = 8, session: aiohttp.ClientSession | None = None):
+        """
+        Args:
+            headers (dict[str, str] | None, optional): Headers sent with every request. Defaults to None.
+            timeout (float, optional): Seconds a single attempt can take, including reading the body. Defaults to 15.
+            retries (int, optional): How many times a failed request gets retried. Defaults to 2.
+            backoff (float, optional): Seconds to wait before the first retry, doubling for each retry after. Defaults to 0.5.
+            limit_per_host (int, optional): Most connections open to a single host. Defaults to 8.
+            session (aiohttp.ClientSession | None, optional): Session to use instead of creating one, ie for testing. Defaults to None.
+        """
+        self.headers: dict[str, str] = {**(headers if headers else {}), 'Accept-Encoding': "gzip, deflate, br" if BROTLI else "gzip, deflate"}
+        self.timeout: float = timeout
+        self.retries: int = retries
+        self.backoff: float = backoff
+        self.limit_per_host: int = limit_per_host
+        self._session: aiohttp.ClientSession | None = session
+
+    def session(self) -> aiohttp.ClientSession:
+        # Created lazily, since a session has to be created while the event loop is running
+        if self._session==None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector = aiohttp.TCPConnector(limit_per_host=self.limit_per_host, keepalive_timeout=60, ttl_dns_cache=300),
+                timeout = aiohttp.ClientTimeout(total=self.timeout),
+                headers = self.headers,
+                auto_decompress = True)
+        return self._session
+
+    async def get_text(self, url: str) -> str:
+        """Download a page as text, retrying on timeouts, connection errors, 429s, and 5xx responses
+
+        Args:
+            url (str): URL of the page
+
+        Returns:
+            str: Decompressed and decoded body of the page
+
+        Raises:
+            HttpError: If the final attempt got an error response
+            aiohttp.ClientError | asyncio.TimeoutError: If the final attempt failed to connect or timed out
+        """
+        host: str = urlsplit(url).hostname or ""
+        attempt: int = 0
+        while True:
+            start: float = asyncio.get_running_loop().time()
+            try:
+                async with self.session().get(url) as resp:
+                    if resp.status >= 400:
+                        raise HttpError(resp.status, url)
+                    # The body is read as bytes first, so the counter gets bytes rather than characters
+                    raw: bytes = await resp.read()
+                    HTTP_BYTES.labels(host).inc(len(raw))
+                    return raw.decode(resp.get_encoding(), errors="replace")
+            except (HttpError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+                # Client errors (other than being rate limited) won't change by retrying
+                if attempt >= self.retries or (isinstance(e, HttpError) and e.status < 500 and e.status!=429): raise
+            finally:
+                HTTP_REQUESTS.labels(host).observe(asyncio.get_running_loop().time() - start)
+            
+            attempt += 1
+            HTTP_RETRIES.labels(host).inc()
+            await asyncio.sleep(self.backoff * 2 ** (attempt - 1))
+
+    async def close(self):
+        """Close the session's connections. Must be called before the event loop closes, otherwise aiohttp warns about an unclosed session
+        """
+        if self._session and not self._session.closed:
+            await self._session.close()
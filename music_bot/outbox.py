@@ -0,0 +1,169 @@
+import asyncio
+import discord
+from metrics import REGISTRY, Counter
+
+type Notice = Notice
+type _ChannelBox = _ChannelBox
+
+OUTBOX_NOTICES: Counter = REGISTRY.counter("music_bot_outbox_notices_total", "Status notices posted to the outbox, by kind", ("kind",))
+OUTBOX_CALLS: Counter = REGISTRY.counter("music_bot_outbox_rest_calls_total", "REST calls made to deliver status notices, by method", ("method",))
+OUTBOX_SAVED: Counter = REGISTRY.counter("music_bot_outbox_rest_calls_saved_total", "REST calls avoided by merging status notices into one message")
+
+# Most queued songs listed in one status message
+MAX_LINES: int = 10
+# Channels the outbox keeps track of before it forgets the ones with nothing left to send
+MAX_BOXES: int = 1024
+
+class Notice:
+    """
+    A single status update for a text channel, ie a song that was queued or started playing
+    """
+    QUEUED: str = "queued"
+    NOW_PLAYING: str = "now_playing"
+
+    __slots__ = ('kind', 'title', 'line', 'url', 'thumbnail')
+
+    def __init__(self, kind: str, title: str, line: str, url: str | None = None, thumbnail: str | None = None):
+        self.kind: str = kind
+        self.title: str = title
+        self.line: str = line
+        self.url: str | None = url
+        self.thumbnail: str | None = thumbnail
+
+    def embed(self) -> discord.Embed:
+        embed: discord.Embed = discord.Embed(title = self.title, description = self.line, url = self.url)
+        if self.thumbnail: embed.set_thumbnail(url = self.thumbnail)
+        return embed
+
+class _ChannelBox:
+    def __init__(self):
+        self.pending: list[Notice] = []
+        self.task: asyncio.Task | None = None
+        # Whether the task is still waiting out the window, rather than sending
+        self.waiting: bool = False
+        # Id of the last status message sent to the channel, and the notices it currently shows.
+        # Only the id is kept, since a whole message would stay in memory for as long as the channel is known
+        self.status_id: int | None = None
+        self.shown: list[Notice] = []
+
+class Outbox:
+    """
+    Per-channel queue of status notices.
+
+    Notices posted to a channel within `window` seconds of each other are merged into one embed,
+    and if the bot's last status message is still the latest message in the channel, it gets edited instead of sending a new one.
+    """
+    def __init__(self, window: float = 1.0):
+        """
+        Args:
+            window (float, optional): Seconds to wait for more notices before sending. Defaults to 1.0.
+        """
+        self.window: float = window
+        self._boxes: dict[int, _ChannelBox] = {}
+        self.notices: int = 0
+        self.calls: int = 0
+
+    def post(self, channel: discord.abc.Messageable, notice: Notice):
+        """Queue a notice to be sent to a channel
+
+        Args:
+            channel (discord.abc.Messageable): Channel to send the notice to
+            notice (Notice): The notice
+        """
+        box: _ChannelBox | None = self._boxes.get(channel.id)
+        if box==None:
+            # Channels with nothing left to send only lose the chance to edit their last status message, so they can be dropped
+            if len(self._boxes) >= MAX_BOXES:
+                self._boxes = {k: b for k, b in self._boxes.items() if b.task and not b.task.done()}
+            box = self._boxes[channel.id] = _ChannelBox()
+        box.pending.append(notice)
+        self.notices += 1
+        OUTBOX_NOTICES.labels(notice.kind).inc()
+        # A task that is already sending picks the notice up once it's done
+        if box.task==None or box.task.done():
+            box.waiting = True
+            box.task = asyncio.get_running_loop().create_task(self._send_later(channel, box))
+
+    async def flush(self, channel: discord.abc.Messageable):
+        """Send the notices waiting for a channel right away, ie before sending something that should come after them
+        """
+        box: _ChannelBox | None = self._boxes.get(channel.id)
+        if box==None or box.task==None or box.task.done(): return
+        if box.waiting:
+            # Nothing has been sent yet, so the window can be cut short
+            box.waiting = False
+            box.task.cancel()
+            box.task = asyncio.get_running_loop().create_task(self._send_all(channel, box))
+        # Otherwise a send is in flight, and cancelling it could lose or reorder messages
+        await asyncio.shield(box.task)
+
+    def saved(self) -> int:
+        """REST calls avoided so far, compared to sending every notice as its own message
+        """
+        return self.notices - self.calls
+
+    async def _send_later(self, channel: discord.abc.Messageable, box: _ChannelBox):
+        try:
+            await asyncio.sleep(self.window)
+        finally:
+            box.waiting = False
+        await self._send_all(channel, box)
+
+    async def _send_all(self, channel: discord.abc.Messageable, box: _ChannelBox):
+        # Notices posted while a message was being sent go out right after it, in order
+        while len(box.pending) > 0: await self._send(channel, box)
+
+    async def _send(self, channel: discord.abc.Messageable, box: _ChannelBox):
+        if len(box.pending)==0: return
+        notices: list[Notice] = box.pending
+        box.pending = []
+
+        # Keep adding to the status message while nobody has sent anything after it
+        if box.status_id and getattr(channel, 'last_message_id', None)==box.status_id:
+            # A song starting replaces what the message showed before, otherwise the new songs are added to it
+            shown: list[Notice] = notices if any(n.kind==Notice.NOW_PLAYING for n in notices) else box.shown + notices
+            try:
+                await channel.get_partial_message(box.status_id).edit(embed = Outbox.render(shown))
+                self._sent(len(notices), "edit")
+                box.shown = shown
+                return
+            except discord.HTTPException:
+                pass
+
+        try:
+            box.status_id = (await channel.send(embed = Outbox.render(notices))).id
+            box.shown = notices
+            self._sent(len(notices), "send")
+        except discord.HTTPException as e:
+            print(f"Failed to send status to channel {channel.id}: {e}")
+
+    def _sent(self, notices: int, method: str):
+        self.calls += 1
+        OUTBOX_CALLS.labels(method).inc()
+        OUTBOX_SAVED.inc(notices - 1)
+
+    def render(notices: list[Notice]) -> discord.Embed:
+        """Merge notices into one embed. A single notice is shown as is.
+        Otherwise the latest song to start playing is shown, along with every song that was queued
+
+        Args:
+            notices (list[Notice]): Notices in the order they were posted
+
+        Returns:
+            discord.Embed: The merged embed
+        """
+        if len(notices)==1: return notices[0].embed()
+
+        playing: Notice | None = next((n for n in reversed(notices) if n.kind==Notice.NOW_PLAYING), None)
+        queued: list[Notice] = [n for n in notices if n.kind==Notice.QUEUED]
+        lines: list[str] = [n.line for n in queued[-MAX_LINES:]]
+        if len(queued) > MAX_LINES: lines.insert(0, f"...and {len(queued) - MAX_LINES} more")
+
+        if playing:
+            embed: discord.Embed = playing.embed()
+            if queued: embed.add_field(name = f"Queued {len(queued)} song{'s' if len(queued)!=1 else ''}", value = '\n'.join(lines)[:1024], inline = False)
+            return embed
+
+        embed: discord.Embed = discord.Embed(title = f"Queued {len(queued)} songs", description = '\n'.join(lines))
+        if queued[-1].thumbnail: embed.set_thumbnail(url = queued[-1].thumbnail)
+        return embed
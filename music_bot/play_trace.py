@@ -0,0 +1,102 @@
+import threading
+import time
+import discord
+from metrics import REGISTRY, Histogram
+
+type PlayTrace = PlayTrace
+
+# Stages a -play goes through before the song can be heard, in order
+STAGES: tuple[str, ...] = ("join", "wait_query", "create", "play_song", "ffmpeg_spawn", "first_packet")
+
+# Upper bounds (in seconds) of the histogram buckets
+BUCKETS: tuple[float, ...] = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+
+class PlayStats:
+    """
+    Per-stage latency histograms of every traced play, from the -play command to the first audio packet
+    """
+    def __init__(self):
+        stages: Histogram = REGISTRY.histogram("music_bot_play_stage_seconds", "Time spent in each stage between -play and the first audio packet", ("stage",), BUCKETS)
+        self.stages: dict[str, Histogram] = {stage: stages.labels(stage) for stage in STAGES}
+        self.total: Histogram = REGISTRY.histogram("music_bot_time_to_first_audio_seconds", "Time between -play and the first audio packet", buckets=BUCKETS)
+        # Traces finish on the audio player's thread
+        self._lock: threading.Lock = threading.Lock()
+
+    def observe(self, trace: PlayTrace):
+        with self._lock:
+            for stage, seconds in trace.durations().items():
+                self.stages[stage].observe(seconds)
+            self.total.observe(trace.marks[-1][1] - trace.started)
+
+    def summary(self) -> str:
+        """Table of the count, mean, and estimated p50/p95 of every stage
+
+        Returns:
+            str: The table, as plain text
+        """
+        rows: list[str] = [f"{'stage':<14}{'n':>6}{'mean':>9}{'p50':>9}{'p95':>9}"]
+        with self._lock:
+            for stage, hist in [*self.stages.items(), ("total", self.total)]:
+                if hist.count==0: continue
+                rows.append(f"{stage:<14}{hist.count:>6}{hist.sum/hist.count*1000:>7.0f}ms{_fmt(hist.quantile(0.5)):>9}{_fmt(hist.quantile(0.95)):>9}")
+        return '\n'.join(rows)
+
+def _fmt(seconds: float) -> str:
+    return "inf" if seconds==float('inf') else f"≤{seconds*1000:.0f}ms" if seconds < 1 else f"≤{seconds:g}s"
+
+# Process-wide play stats
+PLAY_STATS: PlayStats = PlayStats()
+
+class PlayTrace:
+    """
+    Timestamps of every stage a single -play goes through, from receiving the command to sending the first audio packet
+    """
+    def __init__(self, stats: PlayStats = PLAY_STATS):
+        self.started: float = time.perf_counter()
+        self.marks: list[tuple[str, float]] = []
+        self.stats: PlayStats = stats
+        self.finished: bool = False
+
+    def mark(self, stage: str):
+        """Mark that a stage just ended
+        """
+        if not self.finished: self.marks.append((stage, time.perf_counter()))
+
+    def durations(self) -> dict[str, float]:
+        """How long each stage took, measured from the end of the stage before it
+        """
+        res: dict[str, float] = {}
+        last: float = self.started
+        for stage, t in self.marks:
+            res[stage] = res.get(stage, 0) + t - last
+            last = t
+        return res
+
+    def finish(self):
+        """Add this trace to the aggregated stats
+        """
+        if self.finished or len(self.marks)==0: return
+        self.finished = True
+        self.stats.observe(self)
+
+class TracedSource(discord.AudioSource):
+    """
+    Wraps an audio source, finishing a PlayTrace once the first packet of audio is read from it
+    """
+    def __init__(self, source: discord.AudioSource, trace: PlayTrace):
+        self.source: discord.AudioSource = source
+        self.trace: PlayTrace | None = trace
+
+    def read(self) -> bytes:
+        data: bytes = self.source.read()
+        if self.trace and data:
+            self.trace.mark("first_packet")
+            self.trace.finish()
+            self.trace = None
+        return data
+
+    def is_opus(self) -> bool:
+        return self.source.is_opus()
+
+    def cleanup(self):
+        self.source.cleanup()
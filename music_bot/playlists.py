@@ -0,0 +1,68 @@
+import json
+import sqlite3
+from .client import QueuedSong
+
+class PlaylistStore:
+    """
+    Saves queues as named playlists for each server, so they can be loaded again without searching for every song
+    """
+    def __init__(self, file: str = 'playlists.db'):
+        self.file: str = file
+        
+    def _connect(self) -> sqlite3.Connection:
+        # Several worker processes may use the same file when the bot is sharded
+        conn = sqlite3.connect(self.file, timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS playlists (
+                guild_id INTEGER,
+                name TEXT,
+                songs TEXT,
+                PRIMARY KEY (guild_id, name)
+            )
+        ''')
+        return conn
+    
+    def save(self, guild_id: int, name: str, songs: list[QueuedSong]):
+        """Save a list of songs as a playlist, replacing any playlist of the same name in this server
+
+        Args:
+            guild_id (int): Id of the server the playlist belongs to
+            name (str): Name of the playlist
+            songs (list[QueuedSong]): Songs in the playlist
+        """
+        data: str = json.dumps([song.to_record() for song in songs], separators=(',', ':'), ensure_ascii=False)
+        conn = self._connect()
+        conn.execute('''
+            INSERT OR REPLACE INTO playlists (guild_id, name, songs) VALUES (?, ?, ?)
+        ''', (guild_id, name, data))
+        conn.commit()
+        conn.close()
+        
+    def load(self, guild_id: int, name: str) -> list[QueuedSong] | None:
+        """Load a saved playlist
+
+        Args:
+            guild_id (int): Id of the server the playlist belongs to
+            name (str): Name of the playlist
+
+        Returns:
+            list[QueuedSong] | None: Songs in the playlist (without video players), or None if there is no playlist with that name
+        """
+        conn = self._connect()
+        row: tuple[str] | None = conn.execute('''
+            SELECT songs FROM playlists WHERE guild_id=? AND name=?
+        ''', (guild_id, name)).fetchone()
+        conn.close()
+        if row==None: return None
+        return [QueuedSong.from_record(record) for record in json.loads(row[0])]
+    
+    def names(self, guild_id: int) -> list[str]:
+        """Names of all playlists saved in a server
+        """
+        conn = self._connect()
+        rows: list[tuple[str]] = conn.execute('''
+            SELECT name FROM playlists WHERE guild_id=? ORDER BY name
+        ''', (guild_id,)).fetchall()
+        conn.close()
+        return [name for name, in rows]
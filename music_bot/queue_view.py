@@ -0,0 +1,117 @@
+import time
+import discord
+from .client import MusicBotClient, QueuedSong
+
+type QueuePages = QueuePages
+
+# Songs shown on each page of the queue
+PAGE_SIZE: int = 8
+
+class QueuePages:
+    """
+    Renders pages of a client's queue. Rendered pages are kept until the queue or the current song changes,
+    so flipping back and forth only renders each page once, and rendering a page only looks at the songs on that page
+    (plus an O(log n) lookup of when each one plays).
+    """
+    def __init__(self, client: MusicBotClient, page_size: int = PAGE_SIZE):
+        self.client: MusicBotClient = client
+        self.page_size: int = page_size
+        self._key: tuple[int, bool] | None = None
+        self._pages: dict[int, discord.Embed] = {}
+
+    def page_count(self) -> int:
+        return max(1, (len(self.client.queue) + self.page_size - 1) // self.page_size)
+
+    def page_of(self, index: int) -> int:
+        """Page that the song at an index of the queue is on
+        """
+        return min(max(index, 0) // self.page_size, self.page_count() - 1)
+
+    def get(self, page: int) -> discord.Embed:
+        """Get a rendered page of the queue
+
+        Args:
+            page (int): Index of the page, which gets clamped to the pages that exist
+
+        Returns:
+            discord.Embed: The page
+        """
+        # The version changes whenever the queue or the position in it does
+        key: tuple[int, bool] = (self.client.version, self.client.is_active())
+        if key!=self._key:
+            self._pages.clear()
+            self._key = key
+        page = min(max(page, 0), self.page_count() - 1)
+        embed: discord.Embed | None = self._pages.get(page)
+        if embed==None: embed = self._pages[page] = self._render(page)
+        return embed
+
+    def _render(self, page: int) -> discord.Embed:
+        queue: list[QueuedSong] = self.client.queue
+        curr_idx: int = self.client.curr_song()[1]
+        start: int = page * self.page_size
+        count: int = self.page_count()
+        # When upcoming songs play, as timestamps, so the page stays right while songs play through
+        now: float = time.time()
+        lines: list[str] = []
+        for i, s in enumerate(queue[start:start+self.page_size], start):
+            line: str = f"{i+1}. " + (f"🎶 **{s.name}**" if i==curr_idx else s.name) + f" [[{s.duration}]({s.url})]"
+            eta: tuple[float, bool] | None = self.client.eta(i) if i!=curr_idx else None
+            if eta: line += f" <t:{int(now + eta[0])}:R>"
+            lines.append(line)
+
+        total, exact = self.client.durations.total()
+        remaining, remaining_exact = self.client.remaining()
+        return discord.Embed(
+            title = "Queue" + (f" {page+1}/{count}" if count > 1 else ""),
+            description = '\n'.join(lines)).set_footer(
+            text = f"{len(queue)} songs · {QueuedSong.format_duration(total)}{'' if exact else '+'} total · {QueuedSong.format_duration(remaining)}{'' if remaining_exact else '+'} left")
+
+class QueueView(discord.ui.View):
+    """
+    Buttons for flipping through the pages of the queue in a single message
+    """
+    def __init__(self, pages: QueuePages, page: int = 0, timeout: float = 180):
+        """
+        Args:
+            pages (QueuePages): Pages of the queue being shown
+            page (int, optional): Page to start on. Defaults to 0.
+            timeout (float, optional): Seconds without a button press before the buttons get removed. Defaults to 180.
+        """
+        super().__init__(timeout = timeout)
+        self.pages: QueuePages = pages
+        self.page: int = page
+        self.message: discord.Message | None = None
+        self._update_buttons()
+
+    def _update_buttons(self):
+        count: int = self.pages.page_count()
+        self.page = min(max(self.page, 0), count - 1)
+        self.previous.disabled = self.page==0
+        self.next.disabled = self.page>=count - 1
+
+    async def _show(self, interaction: discord.Interaction):
+        self._update_buttons()
+        await interaction.response.edit_message(embed = self.pages.get(self.page), view = self)
+
+    @discord.ui.button(emoji = "◀️", style = discord.ButtonStyle.secondary)
+    async def previous(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.page -= 1
+        await self._show(interaction)
+
+    @discord.ui.button(emoji = "🎶", style = discord.ButtonStyle.secondary)
+    async def current(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.page = self.pages.page_of(self.pages.client.curr_song()[1])
+        await self._show(interaction)
+
+    @discord.ui.button(emoji = "▶️", style = discord.ButtonStyle.secondary)
+    async def next(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.page += 1
+        await self._show(interaction)
+
+    async def on_timeout(self):
+        if self.message==None: return
+        try:
+            await self.message.edit(view = None)
+        except discord.HTTPException:
+            pass
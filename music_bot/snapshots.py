@@ -0,0 +1,87 @@
+import asyncio
+import json
+import os
+from typing import Any
+from .client import MusicBotClient
+from executors import MISC
+
+class QueueSnapshots:
+    """
+    Periodically saves the queue of every connected MusicBotClient to disk (one file per server),
+    so queues can be restored after the bot restarts.
+    
+    Only servers whose queue changed since the last snapshot get written again.
+    """
+    def __init__(self, directory: str = 'queue_snapshots', interval: float = 30):
+        self.directory: str = directory
+        self.interval: float = interval
+        # guild id -> client version at the time of the last snapshot
+        self._saved: dict[int, int] = {}
+        self._task: asyncio.Task | None = None
+        
+    def _path(self, guild_id: int) -> str:
+        return os.path.join(self.directory, f"{guild_id}.json")
+    
+    def _write(self, guild_id: int, state: dict[str, Any]):
+        # Write to a temporary file first so a crash mid-write never leaves a broken snapshot
+        os.makedirs(self.directory, exist_ok=True)
+        tmp: str = self._path(guild_id) + ".tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(state, f, separators=(',', ':'), ensure_ascii=False)
+        os.replace(tmp, self._path(guild_id))
+    
+    def _delete(self, guild_id: int):
+        try:
+            os.remove(self._path(guild_id))
+        except FileNotFoundError:
+            pass
+    
+    async def save(self, clients: dict[int, MusicBotClient]):
+        """Save a snapshot of every client whose queue changed since the last snapshot
+
+        Args:
+            clients (dict[int, MusicBotClient]): Connected clients, by guild id
+        """
+        for guild_id, client in list(clients.items()):
+            if self._saved.get(guild_id)==client.version: continue
+            # Build the state on the event loop so the queue can't change while it is copied
+            state: dict[str, Any] = client.get_state()
+            self._saved[guild_id] = client.version
+            await MISC.run(self._write, guild_id, state)
+    
+    async def discard(self, guild_id: int):
+        """Delete the snapshot for a server, ie when the bot was told to leave and the queue shouldn't come back
+        """
+        self._saved.pop(guild_id, None)
+        await MISC.run(self._delete, guild_id)
+    
+    def load_all(self) -> list[dict[str, Any]]:
+        """Load every saved snapshot
+
+        Returns:
+            list[dict[str, Any]]: States saved by MusicBotClient.get_state
+        """
+        if not os.path.isdir(self.directory): return []
+        states: list[dict[str, Any]] = []
+        for file in os.listdir(self.directory):
+            if not file.endswith(".json"): continue
+            try:
+                with open(os.path.join(self.directory, file), encoding='utf-8') as f:
+                    states.append(json.load(f))
+            except (OSError, ValueError) as e:
+                print(f"Could not load queue snapshot {file}: {e}")
+        return states
+    
+    def start(self, clients: dict[int, MusicBotClient]):
+        """Start saving snapshots of the given clients every `interval` seconds
+        """
+        if self._task and not self._task.done(): return
+        self._task = asyncio.get_running_loop().create_task(self._run(clients))
+        
+    async def _run(self, clients: dict[int, MusicBotClient]):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.save(clients)
+            except Exception as e:
+                print(f"Failed to save queue snapshots: {e}")
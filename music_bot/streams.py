@@ -0,0 +1,51 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Hashable
+
+class StreamUrls:
+    """
+    Stream urls of songs, kept outside of the songs themselves.
+
+    Stream urls are long, only needed by the few songs about to play, and expire after a few hours,
+    so only the most recently used ones are kept, and songs of the same video share one.
+    """
+    def __init__(self, capacity: int = 512, ttl: float = 5 * 3600):
+        """
+        Args:
+            capacity (int, optional): Most stream urls kept at once. Defaults to 512.
+            ttl (float, optional): Seconds a stream url is used for before it's considered expired. Defaults to 5 hours.
+        """
+        self.capacity: int = capacity
+        self.ttl: float = ttl
+        # key -> (time.monotonic() the url expires at, url), least recently used first
+        self._urls: OrderedDict[Hashable, tuple[float, str]] = OrderedDict()
+        # Keys of songs whose stream url is being searched for
+        self.resolving: set[Hashable] = set()
+        # Songs are played from the audio player's thread
+        self._lock: threading.Lock = threading.Lock()
+
+    def get(self, key: Hashable) -> str | None:
+        with self._lock:
+            entry: tuple[float, str] | None = self._urls.get(key)
+            if entry==None: return None
+            if entry[0] <= time.monotonic():
+                del self._urls[key]
+                return None
+            self._urls.move_to_end(key)
+            return entry[1]
+
+    def set(self, key: Hashable, url: str | None):
+        with self._lock:
+            if url==None:
+                self._urls.pop(key, None)
+                return
+            self._urls[key] = (time.monotonic() + self.ttl, url)
+            self._urls.move_to_end(key)
+            while len(self._urls) > self.capacity: self._urls.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._urls)
+
+# Stream urls of every song in the process
+STREAM_URLS: StreamUrls = StreamUrls()
@@ -0,0 +1,141 @@
+import asyncio
+import threading
+from typing import Any, Callable, Hashable
+
+class _Timer:
+    __slots__ = ('key', 'slot', 'rounds', 'callback')
+
+    def __init__(self, key: Hashable, slot: int, rounds: int, callback: Callable[[], Any]):
+        self.key: Hashable = key
+        self.slot: int = slot
+        self.rounds: int = rounds
+        self.callback: Callable[[], Any] = callback
+
+class TimerWheel:
+    """
+    Hashed timer wheel shared by every client in the process.
+
+    A single task ticks through the wheel, instead of every client keeping its own sleeping task around for each timeout.
+    Arming and disarming a timer are O(1), and timers are identified by a key, so arming a key again replaces its old timer.
+    """
+    def __init__(self, tick: float = 1, slots: int = 512):
+        """
+        Args:
+            tick (float, optional): Seconds between ticks, which is also how precise timers are. Defaults to 1.
+            slots (int, optional): Number of slots in the wheel. Timers longer than tick*slots take extra rounds of the wheel. Defaults to 512.
+        """
+        self.tick: float = tick
+        self._slots: list[dict[Hashable, _Timer]] = [{} for _ in range(slots)]
+        self._timers: dict[Hashable, _Timer] = {}
+        self._cursor: int = 0
+        # Timers can be armed from the audio player thread
+        self._lock: threading.Lock = threading.Lock()
+        self._task: asyncio.Task | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._fired_tasks: set[asyncio.Task] = set()
+
+        self.armed_total: int = 0
+        self.disarmed_total: int = 0
+        self.fired_total: int = 0
+
+    def start(self, loop: asyncio.AbstractEventLoop):
+        """Start ticking on the given event loop, if not already started. Must be called from the loop's thread.
+        """
+        if self._task and not self._task.done() and self._loop==loop: return
+        self._loop = loop
+        self._task = loop.create_task(self._run())
+
+    def arm(self, key: Hashable, delay: float, callback: Callable[[], Any]):
+        """Run callback after delay seconds, replacing any timer already armed with the same key
+
+        Args:
+            key (Hashable): Identifies the timer, ie for disarming it
+            delay (float): Seconds until the callback runs (rounded up to the next tick)
+            callback (Callable[[], Any]): Function to run. If it returns a coroutine, the coroutine gets run as a task
+        """
+        ticks: int = max(1, -int(-delay // self.tick))
+        with self._lock:
+            self._remove(key)
+            slot: int = (self._cursor + ticks) % len(self._slots)
+            timer: _Timer = _Timer(key, slot, (ticks - 1) // len(self._slots), callback)
+            self._slots[slot][key] = timer
+            self._timers[key] = timer
+            self.armed_total += 1
+
+    def disarm(self, key: Hashable) -> bool:
+        """Stop a timer from running
+
+        Args:
+            key (Hashable): Key the timer was armed with
+
+        Returns:
+            bool: Whether there was a timer to disarm
+        """
+        with self._lock:
+            if self._remove(key):
+                self.disarmed_total += 1
+                return True
+            return False
+
+    def is_armed(self, key: Hashable) -> bool:
+        return key in self._timers
+
+    def _remove(self, key: Hashable) -> bool:
+        timer: _Timer | None = self._timers.pop(key, None)
+        if timer==None: return False
+        del self._slots[timer.slot][key]
+        return True
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.tick)
+            self._advance()
+
+    def _advance(self):
+        due: list[_Timer] = []
+        with self._lock:
+            self._cursor = (self._cursor + 1) % len(self._slots)
+            slot: dict[Hashable, _Timer] = self._slots[self._cursor]
+            for key, timer in list(slot.items()):
+                if timer.rounds > 0:
+                    timer.rounds -= 1
+                    continue
+                del slot[key]
+                del self._timers[key]
+                due.append(timer)
+            self.fired_total += len(due)
+
+        for timer in due:
+            try:
+                res: Any = timer.callback()
+                if asyncio.iscoroutine(res):
+                    task: asyncio.Task = self._loop.create_task(res)
+                    self._fired_tasks.add(task)
+                    task.add_done_callback(self._fired_tasks.discard)
+            except Exception as e:
+                print(f"Timer {timer.key} failed: {e}")
+
+    def __len__(self) -> int:
+        return len(self._timers)
+
+    def stats(self) -> dict[str, Any]:
+        """Metrics about the timers in this wheel
+
+        Returns:
+            dict[str, Any]: Number of pending timers (in total and by kind, which is the first item of tuple keys) and lifetime totals
+        """
+        with self._lock:
+            by_kind: dict[str, int] = {}
+            for key in self._timers:
+                kind: str = str(key[0]) if type(key)==tuple and len(key) > 0 else type(key).__name__
+                by_kind[kind] = by_kind.get(kind, 0) + 1
+            return {
+                'pending': len(self._timers),
+                'pending_by_kind': by_kind,
+                'armed_total': self.armed_total,
+                'disarmed_total': self.disarmed_total,
+                'fired_total': self.fired_total,
+            }
+
+# Process-wide timer wheel used by every MusicBotClient
+TIMERS: TimerWheel = TimerWheel()
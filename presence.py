@@ -0,0 +1,100 @@
+import asyncio
+import discord
+from cmd_manager.rate_limit import TokenBucket
+from metrics import REGISTRY, Counter
+
+type Presence = tuple[discord.BaseActivity | None, discord.Status]
+
+PRESENCE_CHANGES: Counter = REGISTRY.counter("presence_changes_total", "Changes made to what the bot's presence should be")
+PRESENCE_UPDATES: Counter = REGISTRY.counter("presence_updates_sent_total", "Presence updates sent to discord, after coalescing changes")
+
+class PresenceManager:
+    """
+    Owns the bot's presence. Callers say what the presence should be, and the manager decides when to send it.
+
+    Changes made while waiting for the gateway's presence budget replace each other, so only the latest one gets sent.
+    When several servers are playing something, the presence rotates between them.
+    """
+    def __init__(self, client: discord.Client, *, updates: int = 5, per: float = 60, rotate_every: float = 30):
+        """
+        Args:
+            client (discord.Client): Client whose presence is managed
+            updates (int, optional): Most presence updates sent every `per` seconds. Defaults to 5.
+            per (float, optional): Seconds the presence budget refills over. Defaults to 60.
+            rotate_every (float, optional): Seconds each server's song is shown for while several servers are playing. Defaults to 30.
+        """
+        self.client: discord.Client = client
+        self.rotate_every: float = rotate_every
+        self._budget: TokenBucket = TokenBucket(updates, updates / per)
+        self.default: Presence = (None, discord.Status.online)
+        # guild id -> what the guild wants shown, in the order guilds started playing
+        self.guilds: dict[int, Presence] = {}
+        self._rotation: int = 0
+        self._sent: Presence | None = None
+        self._changed: asyncio.Event = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self.requested: int = 0
+        self.sent: int = 0
+
+    def start(self):
+        """Start sending presence updates. Must be called from the event loop once the client is connected
+        """
+        if self._task and not self._task.done(): return
+        # Whatever was sent before a reconnect is gone
+        self._sent = None
+        self._changed.set()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def set_default(self, activity: discord.BaseActivity | None, status: discord.Status = discord.Status.online):
+        """Set the presence shown while no server is playing anything
+        """
+        self.default = (activity, status)
+        self._request()
+
+    def set_playing(self, guild_id: int, activity: discord.BaseActivity, status: discord.Status = discord.Status.online):
+        """Set what a server is playing, replacing what it was playing before
+        """
+        self.guilds[guild_id] = (activity, status)
+        self._request()
+
+    def clear(self, guild_id: int):
+        """Stop showing what a server is playing
+        """
+        if self.guilds.pop(guild_id, None) != None: self._request()
+
+    def desired(self) -> Presence:
+        """The presence that should be shown right now
+        """
+        if len(self.guilds)==0: return self.default
+        presences: list[Presence] = list(self.guilds.values())
+        return presences[self._rotation % len(presences)]
+
+    def _request(self):
+        self.requested += 1
+        PRESENCE_CHANGES.inc()
+        self._changed.set()
+
+    async def _run(self):
+        while True:
+            rotating: bool = len(self.guilds) > 1
+            try:
+                await asyncio.wait_for(self._changed.wait(), self.rotate_every if rotating else None)
+            except asyncio.TimeoutError:
+                self._rotation += 1
+            self._changed.clear()
+
+            # Changes made while waiting for the budget are picked up below, so the latest one wins
+            wait: float = self._budget.time_until()
+            if wait > 0: await asyncio.sleep(wait)
+
+            desired: Presence = self.desired()
+            if desired==self._sent: continue
+            self._budget.take()
+            try:
+                await self.client.change_presence(activity = desired[0], status = desired[1])
+            except Exception as e:
+                print(f"Failed to update presence: {e}")
+                continue
+            self._sent = desired
+            self.sent += 1
+            PRESENCE_UPDATES.inc()
@@ -1,7 +1,19 @@
 import sqlite3
+import time
+from metrics import REGISTRY, Histogram
+
+DB_WRITES: Histogram = REGISTRY.histogram("song_logger_write_seconds", "Time taken by song log SQLite writes", ("table",))
+
+def _connect() -> sqlite3.Connection:
+    # Every worker process logs to the same file when the bot is sharded, so writers wait for each other instead of failing,
+    # and WAL lets the counts be read while another process is writing
+    conn = sqlite3.connect('botmusic.db', timeout=30)
+    conn.execute('PRAGMA journal_mode=WAL')
+    return conn
 
 def incr_music_counter(url: str, name: str):
-    conn = sqlite3.connect('botmusic.db')
+    start: float = time.perf_counter()
+    conn = _connect()
     cursor = conn.cursor()
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS music_counter (
@@ -18,12 +30,54 @@ def incr_music_counter(url: str, name: str):
     ''', (url,))
     conn.commit()
     conn.close()
+    DB_WRITES.labels("music_counter").observe(time.perf_counter() - start)
     
 def get_music_counts(num: int) -> list[tuple[str, int, str]]:
-    conn = sqlite3.connect('botmusic.db')
+    conn = _connect()
     cursor = conn.cursor()
     cursor.execute('''
         SELECT * FROM music_counter ORDER BY count DESC;
     ''')
     return cursor.fetchmany(num)
 
+
+def incr_transition_counter(prev_url: str, url: str, name: str):
+    start: float = time.perf_counter()
+    conn = _connect()
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS song_transitions (
+            prev_url TEXT,
+            url TEXT,
+            count INTEGER,
+            name TEXT,
+            PRIMARY KEY (prev_url, url)
+        )
+    ''')
+    cursor.execute('''
+        INSERT OR IGNORE INTO song_transitions (prev_url, url, count, name) VALUES (?, ?, ?, ?)
+    ''', (prev_url, url, 0, name))
+    cursor.execute('''
+        UPDATE song_transitions SET count = count + 1, name = ? WHERE prev_url=? AND url=?
+    ''', (name, prev_url, url))
+    conn.commit()
+    conn.close()
+    DB_WRITES.labels("song_transitions").observe(time.perf_counter() - start)
+
+def get_transitions() -> list[tuple[str, str, int, str]]:
+    conn = _connect()
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS song_transitions (
+            prev_url TEXT,
+            url TEXT,
+            count INTEGER,
+            name TEXT,
+            PRIMARY KEY (prev_url, url)
+        )
+    ''')
+    rows: list[tuple[str, str, int, str]] = cursor.execute('''
+        SELECT prev_url, url, count, name FROM song_transitions;
+    ''').fetchall()
+    conn.close()
+    return rows
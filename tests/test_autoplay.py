@@ -0,0 +1,61 @@
+import itertools
+import unittest
+from unittest import mock
+from music_bot.autoplay import CooccurrenceIndex
+
+class TestCooccurrenceIndex(unittest.TestCase):
+    def setUp(self):
+        self.saved: list[tuple[str, str, str]] = []
+        self.index: CooccurrenceIndex = CooccurrenceIndex(on_record = lambda *row: self.saved.append(row))
+
+    def play(self, *urls: str):
+        for prev_url, url in zip(urls, urls[1:]): self.index.record(prev_url, url, url.upper())
+
+    def test_picks_most_common_follow_up(self):
+        self.play("a", "b", "a", "c", "a", "c")
+        self.assertEqual(self.index.pick("a"), ("c", "C"))
+        self.assertEqual(self.index.counts["a"], {"b": 1, "c": 2})
+        # b catches up, but only overtakes c once it has more plays
+        self.play("a", "b")
+        self.assertEqual(self.index.pick("a"), ("c", "C"))
+        self.play("a", "b")
+        self.assertEqual(self.index.pick("a"), ("b", "B"))
+
+    def test_unknown_song(self):
+        self.play("a", "b")
+        self.assertIsNone(self.index.pick("b"))
+        self.assertIsNone(self.index.pick("z"))
+
+    def test_ignores_repeats_and_session_starts(self):
+        self.index.record(None, "a", "A")
+        self.index.record("a", "a", "A")
+        self.index.record("a", None, "")
+        self.assertEqual(len(self.index), 0)
+        self.assertEqual(self.saved, [])
+
+    def test_record_persists(self):
+        self.play("a", "b")
+        self.assertEqual(self.saved, [("a", "b", "B")])
+
+    def test_load_weights(self):
+        self.index.load([("a", "b", 5, "B"), ("a", "c", 3, "C"), ("a", "c", 3, "C")])
+        self.assertEqual(self.index.pick("a"), ("c", "C"))
+        # Loading doesn't save the rows again
+        self.assertEqual(self.saved, [])
+
+    def test_exclude(self):
+        self.play("a", "b", "a", "b", "a", "c", "a", "d")
+        # Random picks walk the follow-ups in order: b, c, d
+        with mock.patch('music_bot.autoplay.random.randrange', side_effect = itertools.cycle([0, 1, 2])):
+            self.assertEqual(self.index.pick("a", exclude = {"b"}), ("c", "C"))
+        with mock.patch('music_bot.autoplay.random.randrange', side_effect = itertools.cycle([0, 1, 2])):
+            self.assertEqual(self.index.pick("a", exclude = {"b", "c"}), ("d", "D"))
+        # Excluding anything but the best follow-up doesn't change the pick
+        self.assertEqual(self.index.pick("a", exclude = {"c"}), ("b", "B"))
+
+    def test_everything_excluded(self):
+        self.play("a", "b", "a", "c")
+        self.assertIsNone(self.index.pick("a", exclude = {"b", "c"}))
+
+if __name__ == '__main__':
+    unittest.main()
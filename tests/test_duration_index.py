@@ -0,0 +1,68 @@
+import random
+import unittest
+from music_bot.duration_index import DurationIndex
+
+def expected(durations: list[int | None], start: int, end: int) -> tuple[int, bool]:
+    """seconds_between worked out on a plain list
+    """
+    songs: list[int | None] = durations[max(start, 0):max(end, 0)]
+    return sum(d for d in songs if d!=None and d >= 0), all(d!=None and d >= 0 for d in songs)
+
+class TestDurationIndex(unittest.TestCase):
+    def check(self, index: DurationIndex, durations: list[int | None]):
+        self.assertEqual(len(index), len(durations))
+        for start in range(-1, len(durations) + 2):
+            for end in range(start, len(durations) + 2):
+                self.assertEqual(index.seconds_between(start, end), expected(durations, start, end), (start, end, durations))
+        self.assertEqual(index.total(), expected(durations, 0, len(durations)))
+
+    def test_append_and_extend(self):
+        index: DurationIndex = DurationIndex([10, None, 30])
+        durations: list[int | None] = [10, None, 30]
+        self.check(index, durations)
+        index.append(-1)
+        durations.append(-1)
+        index.extend([5, 0, None, 7])
+        durations.extend([5, 0, None, 7])
+        self.check(index, durations)
+
+    def test_remove(self):
+        durations: list[int | None] = [10, None, 30, -1, 50, 60]
+        index: DurationIndex = DurationIndex(durations)
+        for i in (0, 2, 3, 0):
+            index.remove(i)
+            del durations[i]
+            self.check(index, durations)
+        with self.assertRaises(IndexError): index.remove(len(durations))
+        with self.assertRaises(IndexError): index.remove(-1)
+
+    def test_clear(self):
+        index: DurationIndex = DurationIndex([10, None, 30])
+        index.clear()
+        self.check(index, [])
+        index.extend([None, 4])
+        self.check(index, [None, 4])
+
+    def test_many_appends_and_removes(self):
+        # Enough appends to pack the slots and grow the trees several times
+        rng: random.Random = random.Random(0)
+        index: DurationIndex = DurationIndex()
+        durations: list[int | None] = []
+        for step in range(2000):
+            if durations and rng.random() < 0.4:
+                i: int = rng.randrange(len(durations))
+                index.remove(i)
+                del durations[i]
+            else:
+                value: int | None = rng.choice([None, -1, rng.randrange(1, 600)])
+                index.append(value)
+                durations.append(value)
+            if step % 100==0:
+                start: int = rng.randrange(len(durations) + 1)
+                end: int = rng.randrange(start, len(durations) + 1)
+                self.assertEqual(index.seconds_between(start, end), expected(durations, start, end))
+        self.assertEqual(index.total(), expected(durations, 0, len(durations)))
+        self.assertEqual(len(index), len(durations))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,30 @@
+import asyncio
+import time
+import unittest
+from executors import Pool
+
+class TestPool(unittest.TestCase):
+    def test_cancel_queued_job(self):
+        async def run() -> tuple[Pool, int]:
+            pool: Pool = Pool("test_cancel", 1)
+            running: asyncio.Future = pool.submit(time.sleep, 0.1)
+            queued: asyncio.Future = pool.submit(time.sleep, 0.1)
+            await asyncio.sleep(0.02)
+            waiting: int = pool.queued
+            queued.cancel()
+            await running
+            await asyncio.sleep(0.02)
+            return pool, waiting
+
+        pool, waiting = asyncio.run(run())
+        self.assertEqual(waiting, 1)
+        self.assertEqual(pool.queued, 0)
+        self.assertEqual(pool.active, 0)
+
+    def test_result(self):
+        async def run() -> int:
+            return await Pool("test_result", 2).run(sum, [1, 2, 3])
+        self.assertEqual(asyncio.run(run()), 6)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import asyncio
+import time
+import unittest
+from typing import Any
+from executors import Pool
+from music_bot.extractor import Extractor, ExtractionError, RATE_LIMIT, UNAVAILABLE, NETWORK, ERROR
+
+class SlowExtractor(Extractor):
+    """Extractor whose extractions sleep instead of calling yt_dlp
+    """
+    def __init__(self, pool: Pool, seconds: float):
+        super().__init__({}, name = "test", pool = pool)
+        self.seconds: float = seconds
+
+    def extract_now(self, query: str, profile: str = 'primary') -> dict[str, Any]:
+        time.sleep(self.seconds)
+        return {'title': query, 'profile': profile}
+
+class TestHedging(unittest.TestCase):
+    def test_hedge_waits_for_a_worker(self):
+        async def run() -> tuple[dict[str, Any], Pool, SlowExtractor]:
+            # The only worker is busy with the first attempt, so the hedge gets queued behind it
+            pool: Pool = Pool("test_hedge", 1)
+            extractor: SlowExtractor = SlowExtractor(pool, 0.2)
+            extractor._delay = 0.05
+            res: dict[str, Any] = await extractor.extract("song")
+            # The worker may have picked the hedge up before it got cancelled, in which case it runs to the end
+            await asyncio.sleep(0.3)
+            return res, pool, extractor
+
+        res, pool, extractor = asyncio.run(run())
+        self.assertEqual(res['profile'], 'primary')
+        self.assertEqual(extractor.hedged, 1)
+        self.assertEqual(pool.queued, 0)
+        self.assertEqual(pool.active, 0)
+
+    def test_cancelled_extraction_leaves_pool_queue(self):
+        async def run() -> tuple[int, int, Pool]:
+            pool: Pool = Pool("test_hedge_cancel", 1)
+            extractor: SlowExtractor = SlowExtractor(pool, 0.2)
+            extractor._delay = 0.05
+            task: asyncio.Task = asyncio.ensure_future(extractor.extract("song"))
+            await asyncio.sleep(0.1)
+            # The hedge is waiting for the worker, and cancelling the extraction cancels it before it starts
+            waiting: int = pool.queued
+            task.cancel()
+            await asyncio.sleep(0.01)
+            after_cancel: int = pool.queued
+            await asyncio.sleep(0.2)
+            return waiting, after_cancel, pool
+
+        waiting, after_cancel, pool = asyncio.run(run())
+        self.assertEqual(waiting, 1)
+        self.assertEqual(after_cancel, 0)
+        self.assertEqual(pool.queued, 0)
+        self.assertEqual(pool.active, 0)
+
+class TestClassify(unittest.TestCase):
+    def test_age_restricted_is_unavailable(self):
+        e: Exception = Exception("ERROR: [youtube] dQw4w9WgXcQ: Sign in to confirm your age. This video may be inappropriate for some users.")
+        self.assertEqual(ExtractionError.classify(e), UNAVAILABLE)
+
+    def test_bot_check_is_rate_limit(self):
+        e: Exception = Exception("ERROR: [youtube] dQw4w9WgXcQ: Sign in to confirm you're not a bot. This helps protect our community.")
+        self.assertEqual(ExtractionError.classify(e), RATE_LIMIT)
+
+    def test_other_failures(self):
+        self.assertEqual(ExtractionError.classify(Exception("ERROR: Unable to download webpage: HTTP Error 429: Too Many Requests")), RATE_LIMIT)
+        self.assertEqual(ExtractionError.classify(Exception("ERROR: [youtube] abc: Video unavailable")), UNAVAILABLE)
+        self.assertEqual(ExtractionError.classify(Exception("ERROR: Unable to download webpage: timed out")), NETWORK)
+        self.assertEqual(ExtractionError.classify(Exception("ERROR: something else")), ERROR)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import asyncio
+import gzip
+import unittest
+from aiohttp import web
+from music_bot.fetch import HttpClient, HttpError, HTTP_BYTES
+
+PAGE: str = "<html>" + "ünïcödé playlist " * 1000 + "</html>"
+
+class LocalServer:
+    """Stand-in for youtube on a local port. Fails the first `failures` requests to /flaky with a 503
+    """
+    def __init__(self, failures: int = 0):
+        self.failures: int = failures
+        self.requests: int = 0
+        self.encodings: list[str] = []
+        app: web.Application = web.Application()
+        app.router.add_get('/page', self.page)
+        app.router.add_get('/flaky', self.flaky)
+        app.router.add_get('/missing', self.missing)
+        self.runner: web.AppRunner = web.AppRunner(app)
+        self.url: str = ""
+
+    async def start(self):
+        await self.runner.setup()
+        site: web.TCPSite = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        self.url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+
+    async def page(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        self.encodings.append(request.headers.get('Accept-Encoding', ''))
+        return web.Response(body = gzip.compress(PAGE.encode()), headers = {'Content-Encoding': 'gzip', 'Content-Type': 'text/html; charset=utf-8'})
+
+    async def flaky(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        if self.requests <= self.failures: return web.Response(status = 503)
+        return web.Response(text = "ok")
+
+    async def missing(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        return web.Response(status = 404)
+
+class TestHttpClient(unittest.TestCase):
+    def run_with_server(self, test, failures: int = 0):
+        async def run():
+            server: LocalServer = LocalServer(failures)
+            await server.start()
+            client: HttpClient = HttpClient(retries = 2, backoff = 0.01)
+            try:
+                return await test(server, client)
+            finally:
+                await client.close()
+                await server.runner.cleanup()
+        return asyncio.run(run())
+
+    def test_compressed_page(self):
+        async def test(server: LocalServer, client: HttpClient):
+            received: float = HTTP_BYTES.labels("127.0.0.1").value
+            self.assertEqual(await client.get_text(server.url + "/page"), PAGE)
+            self.assertEqual(await client.get_text(server.url + "/page"), PAGE)
+            self.assertIn("gzip", server.encodings[0])
+            # Counted in decompressed bytes, not characters
+            self.assertEqual(HTTP_BYTES.labels("127.0.0.1").value - received, 2 * len(PAGE.encode()))
+        self.run_with_server(test)
+
+    def test_retries_server_errors(self):
+        async def test(server: LocalServer, client: HttpClient):
+            self.assertEqual(await client.get_text(server.url + "/flaky"), "ok")
+            self.assertEqual(server.requests, 3)
+        self.run_with_server(test, failures = 2)
+
+    def test_gives_up_after_retries(self):
+        async def test(server: LocalServer, client: HttpClient):
+            with self.assertRaises(HttpError):
+                await client.get_text(server.url + "/flaky")
+            self.assertEqual(server.requests, 3)
+        self.run_with_server(test, failures = 5)
+
+    def test_client_errors_are_not_retried(self):
+        async def test(server: LocalServer, client: HttpClient):
+            with self.assertRaises(HttpError) as raised:
+                await client.get_text(server.url + "/missing")
+            self.assertEqual(raised.exception.status, 404)
+            self.assertEqual(server.requests, 1)
+        self.run_with_server(test)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+import asyncio
+import unittest
+from cmd_manager.lanes import GuildLane
+
+class TestGuildLane(unittest.TestCase):
+    def test_runs_in_order(self):
+        async def run() -> tuple[list[str], list[str]]:
+            lane: GuildLane = GuildLane()
+            log: list[str] = []
+            def command(name: str, delay: float):
+                async def run(handoff: asyncio.Event) -> str:
+                    log.append(f"start {name}")
+                    await asyncio.sleep(delay)
+                    log.append(f"end {name}")
+                    return name
+                return run
+            # The first command is the slowest, but still finishes before the others start
+            futures: list[asyncio.Future] = [lane.submit(command(name, delay), lambda: "full") for name, delay in (("a", 0.03), ("b", 0.01), ("c", 0))]
+            return log, list(await asyncio.gather(*futures))
+
+        log, results = asyncio.run(run())
+        self.assertEqual(log, ["start a", "end a", "start b", "end b", "start c", "end c"])
+        self.assertEqual(results, ["a", "b", "c"])
+
+    def test_handoff_starts_next_command(self):
+        async def run() -> list[str]:
+            lane: GuildLane = GuildLane()
+            log: list[str] = []
+            async def slow(handoff: asyncio.Event):
+                log.append("slow ordered part")
+                handoff.set()
+                await asyncio.sleep(0.05)
+                log.append("slow done")
+            async def fast(handoff: asyncio.Event):
+                log.append("fast")
+            await asyncio.gather(lane.submit(slow, lambda: None), lane.submit(fast, lambda: None))
+            return log
+
+        self.assertEqual(asyncio.run(run()), ["slow ordered part", "fast", "slow done"])
+
+    def test_reject_when_full(self):
+        async def run() -> tuple[list, dict]:
+            lane: GuildLane = GuildLane(maxsize = 2)
+            release: asyncio.Event = asyncio.Event()
+            async def blocked(handoff: asyncio.Event) -> str:
+                await release.wait()
+                return "ran"
+            running: asyncio.Future = lane.submit(blocked, lambda: "full")
+            # Let the first command start, so it's no longer waiting in the lane
+            await asyncio.sleep(0)
+            waiting: list[asyncio.Future] = [lane.submit(blocked, lambda: "full") for _ in range(2)]
+            rejected: asyncio.Future = lane.submit(blocked, lambda: "full")
+            self.assertTrue(rejected.done())
+            release.set()
+            return await asyncio.gather(running, *waiting, rejected), lane.stats()
+
+        results, stats = asyncio.run(run())
+        self.assertEqual(results, ["ran", "ran", "ran", "full"])
+        self.assertEqual(stats['rejected'], 1)
+        self.assertEqual(stats['max_depth'], 2)
+
+    def test_drop_oldest_when_full(self):
+        async def run() -> list:
+            lane: GuildLane = GuildLane(maxsize = 1, overflow = "drop_oldest")
+            release: asyncio.Event = asyncio.Event()
+            def command(name: str):
+                async def run(handoff: asyncio.Event) -> str:
+                    await release.wait()
+                    return name
+                return run
+            running: asyncio.Future = lane.submit(command("a"), lambda: "dropped")
+            await asyncio.sleep(0)
+            oldest: asyncio.Future = lane.submit(command("b"), lambda: "dropped")
+            newest: asyncio.Future = lane.submit(command("c"), lambda: "dropped")
+            release.set()
+            return await asyncio.gather(running, oldest, newest)
+
+        self.assertEqual(asyncio.run(run()), ["a", "dropped", "c"])
+
+    def test_errors_reach_the_command(self):
+        async def run():
+            lane: GuildLane = GuildLane()
+            async def fail(handoff: asyncio.Event): raise RuntimeError("failed")
+            async def ok(handoff: asyncio.Event): return "ok"
+            failed: asyncio.Future = lane.submit(fail, lambda: None)
+            after: asyncio.Future = lane.submit(ok, lambda: None)
+            with self.assertRaises(RuntimeError): await failed
+            self.assertEqual(await after, "ok")
+        asyncio.run(run())
+
+    def test_on_idle(self):
+        async def run() -> int:
+            idle: list[int] = []
+            lane: GuildLane = GuildLane(on_idle = lambda: idle.append(lane.depth()))
+            async def command(handoff: asyncio.Event): pass
+            await asyncio.gather(*(lane.submit(command, lambda: None) for _ in range(3)))
+            await asyncio.sleep(0)
+            return idle
+
+        self.assertEqual(asyncio.run(run()), [0])
+
+    def test_unknown_overflow(self):
+        with self.assertRaises(ValueError): GuildLane(overflow = "block")
+
+if __name__ == '__main__':
+    unittest.main()
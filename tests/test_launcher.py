@@ -0,0 +1,119 @@
+import contextlib
+import io
+import unittest
+from unittest import mock
+from launcher import Launcher, Worker, shard_of
+
+class FakeProcess:
+    """Worker process that runs until the test makes it exit
+    """
+    def __init__(self):
+        self.code: int | None = None
+
+    def poll(self) -> int | None:
+        return self.code
+
+    def terminate(self):
+        self.code = 0
+
+    def kill(self):
+        self.code = -9
+
+    def wait(self, timeout: float | None = None) -> int:
+        return self.code
+
+class FakeClock:
+    def __init__(self):
+        self.now: float = 0
+
+    def __call__(self) -> float:
+        return self.now
+
+class TestLauncher(unittest.TestCase):
+    def setUp(self):
+        self.spawned: list[tuple[int, FakeProcess]] = []
+        self.clock: FakeClock = FakeClock()
+        self.enterContext(mock.patch('launcher.time.monotonic', self.clock))
+        # The launcher prints every start and exit
+        self.enterContext(contextlib.redirect_stdout(io.StringIO()))
+
+    def spawn(self, worker: Worker) -> FakeProcess:
+        process: FakeProcess = FakeProcess()
+        self.spawned.append((worker.index, process))
+        return process
+
+    def crash(self, worker: Worker, after: float):
+        """Let the worker run for after seconds, exit, and get noticed by the launcher
+        """
+        self.clock.now += after
+        worker.process.code = 1
+        self.launcher.poll()
+
+    def restart(self, worker: Worker):
+        self.clock.now = worker.restart_at
+        self.launcher.poll()
+
+    def test_plan(self):
+        self.assertEqual(Launcher.plan(16, 4), [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9, 10, 11], [12, 13, 14, 15]])
+        self.assertEqual(Launcher.plan(5, 2), [[0, 1], [2, 3, 4]])
+        self.assertEqual(Launcher.plan(3, 3), [[0], [1], [2]])
+        # Every shard goes to exactly one worker
+        for shards, workers in ((7, 3), (100, 7), (1, 1)):
+            self.assertEqual(sorted(sum(Launcher.plan(shards, workers), [])), list(range(shards)))
+
+    def test_rejects_more_workers_than_shards(self):
+        with self.assertRaises(ValueError): Launcher(4, 2, spawn = self.spawn)
+
+    def test_owner(self):
+        launcher: Launcher = Launcher(3, 10, spawn = self.spawn)
+        for guild_id in (0, 1 << 22, 462469935436922880, 175928847299117063, 81384788765712384, 2**63 - 1):
+            shard: int = (guild_id >> 22) % 10
+            self.assertEqual(shard_of(guild_id, 10), shard)
+            self.assertIn(shard, launcher.owner(guild_id).shard_ids)
+
+    def test_start_passes_shards(self):
+        launcher: Launcher = Launcher(2, 4, spawn = self.spawn)
+        launcher.start()
+        self.assertEqual([index for index, process in self.spawned], [0, 1])
+        self.assertEqual(launcher.workers[1].env(), {'BOT_WORKER': '1', 'BOT_SHARD_IDS': '2,3', 'BOT_SHARD_COUNT': '4'})
+
+    def test_crash_backoff(self):
+        self.launcher = Launcher(1, spawn = self.spawn, restart_delay = 5, max_restart_delay = 60, stable_after = 30)
+        self.launcher.start()
+        worker: Worker = self.launcher.workers[0]
+        delays: list[float] = []
+        for _ in range(6):
+            self.crash(worker, after = 1)
+            delays.append(worker.restart_at - self.clock.now)
+            # Not restarted before its delay is up
+            self.clock.now = worker.restart_at - 0.5
+            self.launcher.poll()
+            self.assertIsNotNone(worker.restart_at)
+            self.restart(worker)
+        self.assertEqual(delays, [5, 10, 20, 40, 60, 60])
+        self.assertEqual(worker.restarts, 6)
+        self.assertEqual(len(self.spawned), 7)
+
+    def test_backoff_resets_after_staying_up(self):
+        self.launcher = Launcher(1, spawn = self.spawn, restart_delay = 5, max_restart_delay = 60, stable_after = 30)
+        self.launcher.start()
+        worker: Worker = self.launcher.workers[0]
+        for _ in range(3):
+            self.crash(worker, after = 1)
+            self.restart(worker)
+        self.assertEqual(worker.restart_delay, 20)
+        self.crash(worker, after = 30)
+        self.assertEqual(worker.restart_delay, 5)
+        self.assertEqual(worker.restart_at - self.clock.now, 5)
+
+    def test_stop_doesnt_restart(self):
+        self.launcher = Launcher(2, spawn = self.spawn)
+        self.launcher.start()
+        self.launcher.stop()
+        self.clock.now += 1000
+        self.launcher.poll()
+        self.assertEqual(len(self.spawned), 2)
+        self.assertTrue(all(process.code==0 for index, process in self.spawned))
+
+if __name__ == '__main__':
+    unittest.main()
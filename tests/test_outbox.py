@@ -0,0 +1,108 @@
+import asyncio
+import unittest
+from music_bot.outbox import Outbox, Notice, MAX_BOXES
+
+class FakeMessage:
+    def __init__(self, id: int, embed):
+        self.id: int = id
+        self.embeds: list = [embed]
+
+    async def edit(self, embed):
+        self.embeds.append(embed)
+
+class FakeChannel:
+    """Text channel whose sends take a while, like a REST call
+    """
+    def __init__(self, delay: float):
+        self.id: int = 1
+        self.delay: float = delay
+        self.sent: list[FakeMessage] = []
+        self.last_message_id: int | None = None
+
+        # Whether someone else talks right after each message, so the next notice can't be merged into it
+        self.busy: bool = True
+
+    async def send(self, embed) -> FakeMessage:
+        await asyncio.sleep(self.delay)
+        message: FakeMessage = FakeMessage(len(self.sent) + 1, embed)
+        self.sent.append(message)
+        self.last_message_id = None if self.busy else message.id
+        return message
+
+    def get_partial_message(self, id: int) -> FakeMessage:
+        return self.sent[id - 1]
+
+def queued(name: str) -> Notice:
+    return Notice(Notice.QUEUED, "Queued", name)
+
+class TestOutbox(unittest.TestCase):
+    def test_notice_posted_while_sending_is_sent(self):
+        async def run() -> FakeChannel:
+            outbox: Outbox = Outbox(window = 0.01)
+            channel: FakeChannel = FakeChannel(delay = 0.05)
+            outbox.post(channel, queued("a"))
+            # Sending has started by now
+            await asyncio.sleep(0.03)
+            outbox.post(channel, queued("b"))
+            await asyncio.sleep(0.2)
+            return channel
+
+        channel: FakeChannel = asyncio.run(run())
+        self.assertEqual([m.embeds[0].description for m in channel.sent], ["a", "b"])
+
+    def test_flush_while_sending_keeps_order(self):
+        async def run() -> FakeChannel:
+            outbox: Outbox = Outbox(window = 0.01)
+            channel: FakeChannel = FakeChannel(delay = 0.05)
+            outbox.post(channel, queued("a"))
+            await asyncio.sleep(0.03)
+            outbox.post(channel, queued("b"))
+            await outbox.flush(channel)
+            return channel
+
+        channel: FakeChannel = asyncio.run(run())
+        self.assertEqual([m.embeds[0].description for m in channel.sent], ["a", "b"])
+
+    def test_flush_cuts_window_short(self):
+        async def run() -> FakeChannel:
+            outbox: Outbox = Outbox(window = 10)
+            channel: FakeChannel = FakeChannel(delay = 0)
+            outbox.post(channel, queued("a"))
+            outbox.post(channel, queued("b"))
+            await asyncio.wait_for(outbox.flush(channel), 1)
+            return channel
+
+        channel: FakeChannel = asyncio.run(run())
+        self.assertEqual(len(channel.sent), 1)
+        self.assertEqual(channel.sent[0].embeds[0].title, "Queued 2 songs")
+
+    def test_edits_status_message_nobody_replied_to(self):
+        async def run() -> FakeChannel:
+            outbox: Outbox = Outbox(window = 0)
+            channel: FakeChannel = FakeChannel(delay = 0)
+            channel.busy = False
+            outbox.post(channel, queued("a"))
+            await outbox.flush(channel)
+            outbox.post(channel, queued("b"))
+            await outbox.flush(channel)
+            return channel
+
+        channel: FakeChannel = asyncio.run(run())
+        self.assertEqual(len(channel.sent), 1)
+        self.assertEqual(channel.sent[0].embeds[-1].title, "Queued 2 songs")
+
+    def test_forgets_idle_channels(self):
+        async def run() -> Outbox:
+            outbox: Outbox = Outbox(window = 0)
+            channels: list[FakeChannel] = [FakeChannel(delay = 0) for _ in range(MAX_BOXES + 1)]
+            for i, channel in enumerate(channels):
+                channel.id = i
+                outbox.post(channel, queued("a"))
+                await outbox.flush(channel)
+            return outbox
+
+        outbox: Outbox = asyncio.run(run())
+        self.assertEqual(list(outbox._boxes), [MAX_BOXES])
+
+if __name__ == '__main__':
+    unittest.main()
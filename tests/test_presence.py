@@ -0,0 +1,64 @@
+import asyncio
+import unittest
+import discord
+from presence import PresenceManager
+
+class FakeClient:
+    def __init__(self):
+        self.presences: list[tuple[str | None, discord.Status]] = []
+
+    async def change_presence(self, activity: discord.BaseActivity | None, status: discord.Status):
+        self.presences.append((activity.name if activity else None, status))
+
+class TestPresenceManager(unittest.TestCase):
+    def test_latest_change_wins_while_waiting_for_budget(self):
+        async def run() -> tuple[FakeClient, PresenceManager]:
+            client: FakeClient = FakeClient()
+            # One update every 0.2s
+            manager: PresenceManager = PresenceManager(client, updates = 1, per = 0.2)
+            manager.set_default(discord.Game("idle"))
+            manager.start()
+            await asyncio.sleep(0.01)
+            # The budget is used up, so these all wait and only the last one gets sent
+            for name in ("first", "second", "third"):
+                manager.set_playing(1, discord.Game(name))
+                await asyncio.sleep(0.02)
+            await asyncio.sleep(0.3)
+            manager._task.cancel()
+            return client, manager
+
+        client, manager = asyncio.run(run())
+        self.assertEqual(client.presences, [("idle", discord.Status.online), ("third", discord.Status.online)])
+        self.assertEqual(manager.requested, 4)
+        self.assertEqual(manager.sent, 2)
+
+    def test_unchanged_presence_isnt_sent(self):
+        async def run() -> FakeClient:
+            client: FakeClient = FakeClient()
+            manager: PresenceManager = PresenceManager(client, updates = 5, per = 0.1)
+            manager.start()
+            await asyncio.sleep(0.01)
+            # Playing and stopping before the update goes out leaves the presence as it was
+            manager.set_playing(1, discord.Game("song"))
+            manager.clear(1)
+            await asyncio.sleep(0.05)
+            manager._task.cancel()
+            return client
+
+        self.assertEqual(asyncio.run(run()).presences, [(None, discord.Status.online)])
+
+    def test_rotates_between_servers(self):
+        async def run() -> FakeClient:
+            client: FakeClient = FakeClient()
+            manager: PresenceManager = PresenceManager(client, updates = 100, per = 1, rotate_every = 0.05)
+            manager.set_playing(1, discord.Game("a"))
+            manager.set_playing(2, discord.Game("b"))
+            manager.start()
+            await asyncio.sleep(0.13)
+            manager._task.cancel()
+            return client
+
+        self.assertEqual([name for name, status in asyncio.run(run()).presences], ["a", "b", "a"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import unittest
+from unittest import mock
+from cmd_manager.rate_limit import TokenBucket, RateLimit, CommandLimits
+
+class FakeClock:
+    def __init__(self):
+        self.now: float = 1000
+
+    def __call__(self) -> float:
+        return self.now
+
+class TestTokenBucket(unittest.TestCase):
+    def setUp(self):
+        self.clock: FakeClock = FakeClock()
+        self.enterContext(mock.patch('cmd_manager.rate_limit.time.monotonic', self.clock))
+
+    def test_starts_full(self):
+        bucket: TokenBucket = TokenBucket(3, 1)
+        self.assertTrue(bucket.is_full())
+        self.assertEqual([bucket.take() for _ in range(4)], [True, True, True, False])
+
+    def test_refill(self):
+        bucket: TokenBucket = TokenBucket(2, 0.5)
+        bucket.take()
+        bucket.take()
+        self.clock.now += 1
+        self.assertFalse(bucket.take())
+        self.clock.now += 1
+        self.assertTrue(bucket.take())
+        self.assertFalse(bucket.take())
+
+    def test_refill_stops_at_capacity(self):
+        bucket: TokenBucket = TokenBucket(2, 1)
+        bucket.take()
+        self.clock.now += 100
+        self.assertTrue(bucket.is_full())
+        self.assertEqual([bucket.take() for _ in range(3)], [True, True, False])
+
+    def test_time_until(self):
+        bucket: TokenBucket = TokenBucket(4, 2)
+        self.assertEqual(bucket.time_until(), 0)
+        for _ in range(4): bucket.take()
+        self.assertAlmostEqual(bucket.time_until(), 0.5)
+        self.assertAlmostEqual(bucket.time_until(3), 1.5)
+        self.clock.now += 0.25
+        self.assertAlmostEqual(bucket.time_until(), 0.25)
+        self.clock.now += 0.25
+        self.assertEqual(bucket.time_until(), 0)
+
+class TestRateLimit(unittest.TestCase):
+    def setUp(self):
+        self.clock: FakeClock = FakeClock()
+        self.enterContext(mock.patch('cmd_manager.rate_limit.time.monotonic', self.clock))
+
+    def test_keys_are_separate(self):
+        limit: RateLimit = RateLimit(2, 10)
+        self.assertEqual([limit.allow('a') for _ in range(3)], [True, True, False])
+        self.assertTrue(limit.allow('b'))
+
+    def test_refills_over_per(self):
+        limit: RateLimit = RateLimit(2, 10)
+        limit.allow('a')
+        limit.allow('a')
+        self.clock.now += 5
+        self.assertTrue(limit.allow('a'))
+        self.assertFalse(limit.allow('a'))
+
+    def test_drops_full_buckets(self):
+        limit: RateLimit = RateLimit(1, 1)
+        for key in range(1024): limit.allow(key)
+        self.clock.now += 1
+        limit.allow('new')
+        self.assertEqual(list(limit._buckets), ['new'])
+
+    def test_command_limits(self):
+        limits: CommandLimits = CommandLimits(user = RateLimit(2, 10), guild = RateLimit(3, 10))
+        self.assertTrue(limits.allow(1, 100))
+        self.assertTrue(limits.allow(1, 100))
+        # Over the user's limit
+        self.assertFalse(limits.allow(1, 100))
+        self.assertTrue(limits.allow(2, 100))
+        # Over the server's limit
+        self.assertFalse(limits.allow(3, 100))
+
+if __name__ == '__main__':
+    unittest.main()
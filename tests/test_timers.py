@@ -0,0 +1,92 @@
+import asyncio
+import unittest
+from music_bot.timers import TimerWheel
+
+class TestTimerWheel(unittest.TestCase):
+    def setUp(self):
+        # Ticked by hand with _advance, so no event loop is needed
+        self.wheel: TimerWheel = TimerWheel(tick = 1, slots = 8)
+        self.fired: list[str] = []
+
+    def advance(self, ticks: int):
+        for _ in range(ticks): self.wheel._advance()
+
+    def callback(self, name: str):
+        return lambda: self.fired.append(name)
+
+    def test_arm(self):
+        self.wheel.arm('a', 3, self.callback('a'))
+        self.assertTrue(self.wheel.is_armed('a'))
+        self.advance(2)
+        self.assertEqual(self.fired, [])
+        self.advance(1)
+        self.assertEqual(self.fired, ['a'])
+        self.assertFalse(self.wheel.is_armed('a'))
+        self.assertEqual(len(self.wheel), 0)
+
+    def test_delay_rounds_up_to_a_tick(self):
+        self.wheel.arm('a', 0.2, self.callback('a'))
+        self.wheel.arm('b', 1.5, self.callback('b'))
+        self.advance(1)
+        self.assertEqual(self.fired, ['a'])
+        self.advance(1)
+        self.assertEqual(self.fired, ['a', 'b'])
+
+    def test_rearm_replaces_timer(self):
+        self.wheel.arm('a', 2, self.callback('first'))
+        self.advance(1)
+        self.wheel.arm('a', 3, self.callback('second'))
+        self.assertEqual(len(self.wheel), 1)
+        self.advance(2)
+        self.assertEqual(self.fired, [])
+        self.advance(1)
+        self.assertEqual(self.fired, ['second'])
+
+    def test_disarm(self):
+        self.wheel.arm('a', 2, self.callback('a'))
+        self.wheel.arm('b', 2, self.callback('b'))
+        self.assertTrue(self.wheel.disarm('a'))
+        self.assertFalse(self.wheel.disarm('a'))
+        self.advance(8)
+        self.assertEqual(self.fired, ['b'])
+        self.assertEqual(self.wheel.stats()['disarmed_total'], 1)
+
+    def test_delay_longer_than_a_round(self):
+        # 8 slots, so 20 ticks go around the wheel twice before landing
+        self.wheel.arm('a', 20, self.callback('a'))
+        self.wheel.arm('b', 4, self.callback('b'))
+        self.advance(4)
+        self.assertEqual(self.fired, ['b'])
+        self.advance(15)
+        self.assertEqual(self.fired, ['b'])
+        self.advance(1)
+        self.assertEqual(self.fired, ['b', 'a'])
+
+    def test_delay_of_exactly_one_round(self):
+        self.wheel.arm('a', 8, self.callback('a'))
+        self.advance(7)
+        self.assertEqual(self.fired, [])
+        self.advance(1)
+        self.assertEqual(self.fired, ['a'])
+
+    def test_runs_coroutine_callbacks(self):
+        async def run() -> list[str]:
+            self.wheel.start(asyncio.get_running_loop())
+            async def fire(): self.fired.append('a')
+            self.wheel.arm('a', 0.01, fire)
+            await asyncio.sleep(0.1)
+            self.wheel._task.cancel()
+            return self.fired
+        self.wheel = TimerWheel(tick = 0.01, slots = 8)
+        self.assertEqual(asyncio.run(run()), ['a'])
+
+    def test_stats_by_kind(self):
+        self.wheel.arm(('inactivity', 1), 5, self.callback('a'))
+        self.wheel.arm(('inactivity', 2), 5, self.callback('b'))
+        self.wheel.arm(('resume', 1), 5, self.callback('c'))
+        stats: dict = self.wheel.stats()
+        self.assertEqual(stats['pending'], 3)
+        self.assertEqual(stats['pending_by_kind'], {'inactivity': 2, 'resume': 1})
+
+if __name__ == '__main__':
+    unittest.main()